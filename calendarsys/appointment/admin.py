@@ -1,48 +1,129 @@
+from datetime import time, timedelta
+
 from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connections
 from django.shortcuts import render, redirect
-from datetime import date, time
-from .utils import generate_time_slots, generate_week, generate_month, regenerate_slots
-
+from django.utils.functional import cached_property
 
 from .models import Day, TimeSlot, Appointment, Business
 from .forms import SlotGenerationForm
 from .utils import (
+    block_slots,
+    cancel_appointments,
     generate_time_slots,
     generate_week,
     generate_month,
-    regenerate_slots
+    regenerate_slots,
+    unblock_slots,
 )
 
-from django.contrib import admin
-from django.contrib.auth.models import User
-from .models import Business
-
 
 # Unregister original User admin and register new one
 admin.site.unregister(User)
 
 
+# -------------------------
+# LARGE TABLES
+# -------------------------
+ESTIMATE_THRESHOLD = 10000
+
+
+def estimated_row_count(model, using):
+    """
+    Row count from the planner statistics (SQLite after ANALYZE, PostgreSQL),
+    or None when there are none.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] > 0 else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Unfiltered changelists of big tables page on the planner's row
+    estimate instead of a COUNT(*) over the whole table.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # No second COUNT(*) for the "n total" next to filtered results
+    show_full_result_count = False
+    list_per_page = 50
+
+
+# -------------------------
+# BUSINESS
+# -------------------------
+@admin.register(Business)
+class BusinessAdmin(admin.ModelAdmin):
+    list_display = ("name", "owner", "shard", "created_at")
+    list_select_related = ("owner",)
+    raw_id_fields = ("owner",)
+    # Used by the business autocompletes of the other admins
+    search_fields = ("name",)
+    ordering = ("name",)
+    readonly_fields = ("shard",)
+
+
+# -------------------------
+# DAY
+# -------------------------
 class TimeSlotInline(admin.TabularInline):
     model = TimeSlot
     extra = 0
-    readonly_fields = ("is_booked",)
-    fields = ("start", "end", "is_booked")
+    readonly_fields = ("booked", "is_booked")
+    fields = ("start", "end", "staff", "capacity", "booked", "is_blocked", "is_booked")
+    raw_id_fields = ("staff",)
+
+    def get_queryset(self, request):
+        # Each row's __str__ names the business
+        return super().get_queryset(request).select_related("business")
 
 
 @admin.register(Day)
-class DayAdmin(admin.ModelAdmin):
+class DayAdmin(LargeTableAdmin):
     list_display = ("date", "business_name")  # <-- updated
+    list_select_related = ("business",)
+    autocomplete_fields = ("business",)
+    date_hierarchy = "date"
+    ordering = ("-date",)
     inlines = [TimeSlotInline]
+    actions = ["generate_slots_action", "generate_week_action", "generate_month_action", "regenerate_slots_action"]
 
     # method to show business name in list_display
+    @admin.display(description="Business", ordering="business__name")
     def business_name(self, obj):
         return obj.business.name
-    business_name.short_description = "Business"
 
 
     # -----------------------------------------
     # 1️⃣ Generate slots for selected days
     # -----------------------------------------
+    @admin.action(description="Generate slots for selected days")
     def generate_slots_action(self, request, queryset):
         if "apply" in request.POST:
             form = SlotGenerationForm(request.POST)
@@ -53,7 +134,9 @@ class DayAdmin(admin.ModelAdmin):
                         day,
                         form.cleaned_data["start_time"],
                         form.cleaned_data["end_time"],
-                        form.cleaned_data["interval_minutes"]
+                        form.cleaned_data["interval_minutes"],
+                        breaks=form.cleaned_data["breaks"],
+                        capacity=form.cleaned_data["capacity"],
                     )
                 self.message_user(request, f"Created {created_total} time slots.")
                 return redirect(request.get_full_path())
@@ -67,11 +150,10 @@ class DayAdmin(admin.ModelAdmin):
             "title": "Generate Time Slots for Selected Days"
         })
 
-    generate_slots_action.short_description = "Generate slots for selected days"
-
     # -----------------------------------------
     # 2️⃣ Generate week
     # -----------------------------------------
+    @admin.action(description="Generate whole week")
     def generate_week_action(self, request, queryset):
         if len(queryset) != 1:
             self.message_user(request, "Select ONE day to generate a week.", "error")
@@ -82,19 +164,19 @@ class DayAdmin(admin.ModelAdmin):
         days_created, slots_created = generate_week(
             business=day.business,
             start_date=day.date,
+            end_date=day.date + timedelta(days=6),
             start_time=time(9, 0),
             end_time=time(17, 0),
-            interval_minutes=30,
+            interval=30,
             breaks=[(time(12, 0), time(13, 0))]
         )
 
         self.message_user(request, f"Week generated: {days_created} days, {slots_created} slots.")
 
-    generate_week_action.short_description = "Generate whole week"
-
     # -----------------------------------------
     # 3️⃣ Generate month
     # -----------------------------------------
+    @admin.action(description="Generate whole month")
     def generate_month_action(self, request, queryset):
         if len(queryset) != 1:
             self.message_user(request, "Select ONE day from the month.", "error")
@@ -108,17 +190,16 @@ class DayAdmin(admin.ModelAdmin):
             month=day.date.month,
             start_time=time(9, 0),
             end_time=time(17, 0),
-            interval_minutes=30,
+            interval=30,
             breaks=[(time(12, 0), time(13, 0))]
         )
 
         self.message_user(request, f"Month generated: {days_created} days, {slots_created} slots.")
 
-    generate_month_action.short_description = "Generate whole month"
-
     # -----------------------------------------
     # 4️⃣ Regenerate slots (delete unused)
     # -----------------------------------------
+    @admin.action(description="Regenerate slots (keep booked ones)")
     def regenerate_slots_action(self, request, queryset):
         if len(queryset) != 1:
             self.message_user(request, "Select ONE day to regenerate.", "error")
@@ -136,13 +217,56 @@ class DayAdmin(admin.ModelAdmin):
 
         self.message_user(request, f"Regenerated: {created} new slots (booked slots preserved).")
 
-    regenerate_slots_action.short_description = "Regenerate slots (keep booked ones)"
 
-
-# Register the remaining models
-admin.site.register(TimeSlot)
-admin.site.register(Appointment)
-admin.site.register(Business)
-admin.site.register(User)
+# -------------------------
+# TIME SLOT
+# -------------------------
+@admin.register(TimeSlot)
+class TimeSlotAdmin(LargeTableAdmin):
+    list_display = ("start_at", "end_at", "business", "staff", "capacity", "booked", "is_blocked", "is_booked")
+    list_select_related = ("business", "staff")
+    list_filter = ("is_booked", "is_blocked")
+    raw_id_fields = ("day", "staff")
+    date_hierarchy = "start_at"  # timeslot_start_at_idx
+    ordering = ("-start_at",)
+    readonly_fields = ("booked", "is_booked")
+    actions = ["block_action", "unblock_action"]
+
+    @admin.action(description="Block selected slots (unbooked ones)")
+    def block_action(self, request, queryset):
+        blocked = block_slots(queryset)
+        self.message_user(request, f"Blocked {blocked} slots; slots with bookings were left open.")
+
+    @admin.action(description="Unblock selected slots")
+    def unblock_action(self, request, queryset):
+        self.message_user(request, f"Unblocked {unblock_slots(queryset)} slots.")
+
+
+# -------------------------
+# APPOINTMENT
+# -------------------------
+@admin.register(Appointment)
+class AppointmentAdmin(LargeTableAdmin):
+    list_display = ("id", "client", "business", "slot_start", "created_at")
+    list_select_related = ("client", "business", "slot")
+    raw_id_fields = ("client", "slot")
+    date_hierarchy = "created_at"
+    ordering = ("-id",)
+    actions = ["cancel_action"]
+
+    @admin.display(description="Slot", ordering="slot__start_at")
+    def slot_start(self, obj):
+        return obj.slot.start_at
+
+    def get_actions(self, request):
+        # delete_selected skips Appointment.delete(): the slots would keep their places taken
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description="Cancel selected bookings")
+    def cancel_action(self, request, queryset):
+        self.message_user(request, f"Cancelled {cancel_appointments(queryset)} bookings.")
 
 
+admin.site.register(User)
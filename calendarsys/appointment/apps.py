@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class AppointmentConfig(AppConfig):
@@ -7,24 +9,31 @@ class AppointmentConfig(AppConfig):
 
     def ready(self):
         """
-        Automatically create the Business Staff group and assign permissions.
-        All imports MUST be inside ready(), otherwise Django throws
-        AppRegistryNotReady.
+        No database access here: ready() runs on every process start
+        (gunicorn workers, manage.py, tests). The Business Staff group is
+        created by a post_migrate handler instead, after auth has created
+        the TimeSlot permissions.
         """
-        try:
-            from django.contrib.auth.models import Group, Permission
-            from django.contrib.contenttypes.models import ContentType
-            from .models import TimeSlot  # models imported here to avoid registry issues
+        from django.contrib.auth.models import User
 
-            # Create or get the group
-            group, created = Group.objects.get_or_create(name="Business Staff")
+        from .models import Business
+        from .signals import (
+            configure_sqlite,
+            create_staff_group,
+            delete_reference_row,
+            index_business,
+            install_query_timer,
+            mirror_reference_row,
+            prepare_shard,
+            unindex_business,
+        )
 
-            # Assign only TimeSlot permissions
-            ct = ContentType.objects.get_for_model(TimeSlot)
-            perms = Permission.objects.filter(content_type=ct)
-
-            group.permissions.set(perms)
-
-        except Exception as e:
-            # Do NOT crash migrations or server startup
-            print("⚠ AppointmentConfig.ready() warning:", e)
+        post_migrate.connect(create_staff_group, sender=self, dispatch_uid="appointment_create_staff_group")
+        post_migrate.connect(prepare_shard, sender=self, dispatch_uid="appointment_prepare_shard")
+        for model in (User, Business):
+            post_save.connect(mirror_reference_row, sender=model, dispatch_uid=f"appointment_mirror_{model.__name__}")
+            post_delete.connect(delete_reference_row, sender=model, dispatch_uid=f"appointment_unmirror_{model.__name__}")
+        post_save.connect(index_business, sender=Business, dispatch_uid="appointment_index_business")
+        post_delete.connect(unindex_business, sender=Business, dispatch_uid="appointment_unindex_business")
+        connection_created.connect(install_query_timer, dispatch_uid="appointment_install_query_timer")
+        connection_created.connect(configure_sqlite, dispatch_uid="appointment_configure_sqlite")
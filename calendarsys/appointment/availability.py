@@ -0,0 +1,56 @@
+"""
+Cached availability summaries of a business (the month heatmap).
+
+Entries are cached under a key that includes a per-business version.
+Whatever changes the slots of a business calls invalidate_availability(),
+which bumps that version once the transaction commits: readers move on to
+new keys and the old entries are never read again, they just expire.
+
+- APPOINTMENT_AVAILABILITY_CACHE: cache alias (default 'default'). Use a
+  shared cache with several workers, or each process invalidates only its
+  own copy.
+- APPOINTMENT_AVAILABILITY_TIMEOUT: seconds an entry lives (default 300),
+  also the bound on staleness for writes that skip invalidation.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+def get_cache():
+    return caches[getattr(settings, 'APPOINTMENT_AVAILABILITY_CACHE', 'default')]
+
+
+def version_key(business_id):
+    return f'appointment:availability:{business_id}:version'
+
+
+def availability_version(business_id):
+    cache = get_cache()
+    # Seeded from the clock, so a version lost to eviction does not start
+    # over at a number that old entries are still cached under
+    cache.add(version_key(business_id), time.time_ns(), timeout=None)
+    return cache.get(version_key(business_id)) or 0
+
+
+def invalidate_availability(business_id, using=DEFAULT_DB_ALIAS):
+    """Make the cached summaries of `business_id` stale once the transaction on `using` commits."""
+
+    def bump():
+        cache = get_cache()
+        try:
+            cache.incr(version_key(business_id))
+        except ValueError:  # not cached: any new version will do
+            cache.set(version_key(business_id), time.time_ns(), timeout=None)
+
+    # Bumping before commit would let a reader cache the old rows again
+    transaction.on_commit(bump, using=using, robust=True)
+
+
+def cached_month(business_id, year, month, compute):
+    """compute() for the month of `business_id`, from the cache when the version still matches."""
+    key = f'appointment:availability:{business_id}:v{availability_version(business_id)}:{year}-{month:02d}'
+    timeout = getattr(settings, 'APPOINTMENT_AVAILABILITY_TIMEOUT', 300)
+    return get_cache().get_or_set(key, compute, timeout)
@@ -0,0 +1,148 @@
+"""
+Group-commit booking, selected with APPOINTMENT_BOOKING_MODE = 'queue'.
+
+SQLite has a single writer: every concurrent booking transaction takes
+the write lock, commits and lets the next one in, and under a burst most
+of them sit out the busy timeout. In queue mode a request thread hands
+its booking (a claim) to an in-process queue and waits. One writer
+thread per database alias takes up to APPOINTMENT_BOOKING_BATCH claims
+and runs them all in one transaction, so a burst of bookings costs one
+lock acquisition and one commit instead of one each. Every claim runs in
+its own savepoint: one that fails (slot full, client already booked that
+day) is rolled back alone, and its exception is raised in the request
+that submitted it once the batch has committed.
+
+'direct' (the default) books in the request thread, as before. Claims
+submitted inside a transaction are also run directly, since the writer
+would wait for the lock that transaction holds. The queue is per
+process: with several workers, each has its own writer.
+"""
+import contextvars
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, connections, transaction
+
+from .metrics import BOOKING_BATCH_SIZE
+
+
+class Claim:
+    def __init__(self, func):
+        self.func = func
+        # Run with the submitting request's context (current shard, primary pin)
+        self.context = contextvars.copy_context()
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.state = 'queued'  # -> 'running' | 'cancelled'
+        self.result = None
+        self.error = None
+
+    def start(self):
+        with self.lock:
+            if self.state == 'cancelled':
+                return False
+            self.state = 'running'
+            return True
+
+    def cancel(self):
+        """Withdraw the claim if the writer has not started it yet."""
+        with self.lock:
+            if self.state == 'running':
+                return False
+            self.state = 'cancelled'
+            return True
+
+    def run(self):
+        try:
+            self.result = self.context.run(self.func)
+        except Exception as error:
+            self.error = error
+
+
+class BookingWriter:
+    """Drains the claims of one database alias, committing them in batches."""
+
+    def __init__(self, using):
+        self.using = using
+        self.claims = queue.Queue()
+        self.thread = threading.Thread(target=self.loop, name=f'booking-writer-{using}', daemon=True)
+        self.thread.start()
+
+    def submit(self, func):
+        claim = Claim(func)
+        self.claims.put(claim)
+        timeout = getattr(settings, 'APPOINTMENT_BOOKING_TIMEOUT', 30)
+        if not claim.done.wait(timeout) and claim.cancel():
+            raise ValidationError("Bookings are very busy right now, please try again.")
+        # Already running: its batch is committing, give it one more timeout
+        if not claim.done.wait(timeout):
+            raise ValidationError("Your booking could not be confirmed in time, please check your bookings.")
+        if claim.error is not None:
+            raise claim.error
+        return claim.result
+
+    def next_batch(self):
+        """Block for one claim, then take what else arrives within the batch window."""
+        batch = [self.claims.get()]
+        size = getattr(settings, 'APPOINTMENT_BOOKING_BATCH', 50)
+        deadline = time.monotonic() + getattr(settings, 'APPOINTMENT_BOOKING_BATCH_WAIT_MS', 2) / 1000
+        while len(batch) < size:
+            try:
+                batch.append(self.claims.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def loop(self):
+        while True:
+            batch = [claim for claim in self.next_batch() if claim.start()]
+            if not batch:
+                continue
+            try:
+                self.commit(batch)
+            except Exception as error:  # nothing was booked; the writer carries on
+                for claim in batch:
+                    claim.result, claim.error = None, claim.error or error
+            finally:
+                # Whatever happened, no request is left waiting
+                for claim in batch:
+                    claim.done.set()
+
+    def commit(self, batch):
+        close_old_connections()
+        BOOKING_BATCH_SIZE.observe(len(batch))
+        with transaction.atomic(using=self.using):
+            for claim in batch:
+                with transaction.atomic(using=self.using):
+                    claim.run()
+                    if claim.error is not None:
+                        # Roll back this claim's savepoint only
+                        transaction.set_rollback(True, using=self.using)
+
+
+writers = {}
+writers_lock = threading.Lock()
+
+
+def get_writer(using):
+    with writers_lock:
+        # A writer whose thread died is replaced rather than queued to forever
+        if using not in writers or not writers[using].thread.is_alive():
+            writers[using] = BookingWriter(using)
+        return writers[using]
+
+
+def run_booking(using, func):
+    """
+    Call `func` (which books and returns the Appointment) in a transaction
+    on `using`: in this thread, or batched with other bookings by the
+    writer in queue mode. Raises whatever `func` raised.
+    """
+    mode = getattr(settings, 'APPOINTMENT_BOOKING_MODE', 'direct')
+    if mode != 'queue' or connections[using].in_atomic_block:
+        with transaction.atomic(using=using):
+            return func()
+    return get_writer(using).submit(func)
@@ -1,7 +1,7 @@
-from datetime import time
+from datetime import time, timedelta
 from django import forms
 from django.contrib.auth.models import User
-from .models import UserProfile, Business, Day
+from .models import UserProfile, Business, Day, slot_datetime
 
 
 # -------------------------
@@ -10,7 +10,8 @@ from .models import UserProfile, Business, Day
 class UserRegistrationForm(forms.ModelForm):
     password = forms.CharField(widget=forms.PasswordInput)
     role = forms.ChoiceField(choices=UserProfile.USER_ROLES)
-    business = forms.ModelChoiceField(queryset=Business.objects.all(), required=False)
+    # Picked with the business search (signup.html); a <select> would list every business
+    business = forms.ModelChoiceField(queryset=Business.objects.all(), required=False, widget=forms.HiddenInput)
 
     class Meta:
         model = User
@@ -89,11 +90,35 @@ class SlotGenerationForm(forms.Form):
         initial=30,
         help_text="Length of each slot in minutes",
     )
+    capacity = forms.IntegerField(
+        label="Places per slot",
+        required=False,
+        min_value=1,
+        max_value=500,
+        initial=1,
+        help_text="Bookings each slot takes, e.g. staff working in parallel or class size",
+    )
     breaks = forms.CharField(
         label="Breaks (optional)",
         required=False,
         help_text='Format: "12:00-13:00,15:00-15:15"',
     )
+    staff = forms.ModelChoiceField(
+        queryset=User.objects.none(),
+        required=False,
+        empty_label="Whole business",
+        help_text="Generate the slots on this staff member's calendar",
+    )
+
+    def __init__(self, *args, business=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if business is not None:
+            self.fields["staff"].queryset = User.objects.filter(
+                businessstaff__business=business, businessstaff__is_active=True
+            ).order_by("username")
+
+    def clean_capacity(self):
+        return self.cleaned_data.get("capacity") or 1
 
     def clean_breaks(self):
         data = self.cleaned_data.get("breaks")
@@ -111,3 +136,62 @@ class SlotGenerationForm(forms.Form):
             except Exception:
                 raise forms.ValidationError("Invalid breaks format. Use HH:MM-HH:MM, separated by commas.")
         return breaks_list
+
+
+# -------------------------
+# CLOSURE FORM
+# -------------------------
+class ClosureForm(forms.Form):
+    start_date = forms.DateField(label="From", widget=forms.DateInput(attrs={"type": "date"}))
+    end_date = forms.DateField(label="To", widget=forms.DateInput(attrs={"type": "date"}))
+    start_time = forms.TimeField(
+        label="From time",
+        required=False,
+        widget=forms.TimeInput(format="%H:%M", attrs={"type": "time"}),
+        help_text="Leave both times empty to close whole days",
+    )
+    end_time = forms.TimeField(
+        label="To time",
+        required=False,
+        widget=forms.TimeInput(format="%H:%M", attrs={"type": "time"}),
+    )
+    staff = forms.ModelChoiceField(
+        queryset=User.objects.none(),
+        required=False,
+        empty_label="Whole business",
+        help_text="Close only this staff member's calendar",
+    )
+    reason = forms.CharField(max_length=200, required=False, help_text="e.g. Public holiday")
+
+    def __init__(self, *args, business=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if business is not None:
+            self.fields["staff"].queryset = User.objects.filter(
+                businessstaff__business=business, businessstaff__is_active=True
+            ).order_by("username")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date, end_date = cleaned_data.get("start_date"), cleaned_data.get("end_date")
+        start_time, end_time = cleaned_data.get("start_time"), cleaned_data.get("end_time")
+        if start_date and end_date and end_date < start_date:
+            raise forms.ValidationError("The closure cannot end before it starts.")
+        if start_date and end_date and (end_date - start_date).days > 366:
+            raise forms.ValidationError("Close at most a year at a time.")
+        if (start_time is None) != (end_time is None):
+            raise forms.ValidationError("Give both times, or neither to close whole days.")
+        if start_time is not None and start_time >= end_time:
+            raise forms.ValidationError("Start time must be before end time.")
+        return cleaned_data
+
+    def ranges(self):
+        """
+        (start_at, end_at) periods to close: the whole span for whole days,
+        else the same hours on every date of it.
+        """
+        data = self.cleaned_data
+        start_date, end_date = data["start_date"], data["end_date"]
+        if data["start_time"] is None:
+            return [(slot_datetime(start_date, time.min), slot_datetime(end_date + timedelta(days=1), time.min))]
+        dates = [start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+        return [(slot_datetime(d, data["start_time"]), slot_datetime(d, data["end_time"])) for d in dates]
@@ -0,0 +1,259 @@
+"""
+Live slot availability over Server-Sent Events.
+
+Booking and cancellation publish `slot_booked` / `slot_freed` events, and
+blocking (closures included) `slots_blocked` / `slots_unblocked`, once
+their transaction commits, to the channels "day:<id>" and "business:<id>".
+The SSE views (day_events, business_events) subscribe to one channel and
+stream what arrives, so a waiting client holds one connection instead of
+reloading the day page.
+
+The hub is chosen with APPOINTMENT_LIVE_BACKEND:
+
+- appointment.live.LocalHub (default): in-process fan-out. Only subscribers
+  served by the process that handled the booking see the event, so use it
+  with a single ASGI worker.
+- appointment.live.CacheHub: events go through the Django cache (configure a
+  shared one, e.g. Redis or Memcached) and subscribers poll it. Works across
+  worker processes and resumes from the browser's Last-Event-ID.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict
+from functools import cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+DEFAULT_BACKEND = 'appointment.live.LocalHub'
+
+
+def day_channel(day_id):
+    return f'day:{day_id}'
+
+
+def business_channel(business_id):
+    return f'business:{business_id}'
+
+
+# -------------------------
+# HUBS
+# -------------------------
+class LocalSubscription:
+    def __init__(self, hub, channel):
+        self.hub = hub
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self, timeout):
+        """Next (id, event, data), or None after `timeout` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def deliver(self, message):
+        # Called from whichever thread published
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+        except RuntimeError:  # event loop already closed
+            self.close()
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class LocalHub:
+    """In-process broadcast: publish() hands each message to every subscriber's event loop."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+        self.ids = itertools.count(1)
+
+    async def subscribe(self, channel, last_id=None):
+        # last_id is ignored: nothing is kept for replay
+        subscription = LocalSubscription(self, channel)
+        with self.lock:
+            self.subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+
+    def publish(self, channel, event, data):
+        message = (next(self.ids), event, data)
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+
+class CacheSubscription:
+    def __init__(self, hub, channel, last_id):
+        self.hub = hub
+        self.channel = channel
+        self.last_id = last_id
+
+    async def get(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            message = await self.hub.next_message(self.channel, self)
+            if message is not None or time.monotonic() >= deadline:
+                return message
+            await asyncio.sleep(self.hub.poll_interval)
+
+    def close(self):
+        pass
+
+
+class CacheHub:
+    """
+    Cross-process broadcast through the Django cache: each channel keeps a
+    sequence counter and one key per event (expiring after `ttl` seconds).
+    """
+
+    def __init__(self, alias='default', poll_interval=0.5, ttl=300):
+        self.alias = alias
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, channel, suffix):
+        return f'appointment:live:{channel}:{suffix}'
+
+    async def subscribe(self, channel, last_id=None):
+        if last_id is None:
+            last_id = await self.cache.aget(self.key(channel, 'seq'), 0)
+        return CacheSubscription(self, channel, last_id)
+
+    def publish(self, channel, event, data):
+        seq_key = self.key(channel, 'seq')
+        self.cache.add(seq_key, 0, timeout=None)
+        try:
+            event_id = self.cache.incr(seq_key)
+        except ValueError:  # counter evicted since add()
+            self.cache.add(seq_key, 0, timeout=None)
+            event_id = self.cache.incr(seq_key)
+        self.cache.set(self.key(channel, event_id), (event, data), self.ttl)
+
+    async def next_message(self, channel, subscription):
+        """Oldest event after subscription.last_id that is still in the cache, or None."""
+        current = await self.cache.aget(self.key(channel, 'seq'), 0)
+        if current < subscription.last_id:  # counter was evicted and restarted
+            subscription.last_id = 0
+        while subscription.last_id < current:
+            subscription.last_id += 1
+            message = await self.cache.aget(self.key(channel, subscription.last_id))
+            if message is not None:
+                return (subscription.last_id, *message)
+        return None
+
+
+@cache
+def load_hub(path):
+    return import_string(path)()
+
+
+def get_hub():
+    return load_hub(getattr(settings, 'APPOINTMENT_LIVE_BACKEND', DEFAULT_BACKEND))
+
+
+# -------------------------
+# PUBLISHING
+# -------------------------
+def publish_slot_change(slot, event):
+    """
+    Announce that `slot` was booked or freed, on its day and business
+    channels, after the current transaction commits. A `slot_booked` slot
+    may still have places left.
+    """
+    data = {
+        'slot': slot.id,
+        'day': slot.day_id,
+        'business': slot.business_id,
+        'date': slot.date.isoformat(),
+        'start': slot.start.isoformat(),
+        'end': slot.end.isoformat(),
+        # As last seen by this process; the next event or snapshot corrects it
+        'places_left': slot.places_left,
+    }
+
+    def send():
+        hub = get_hub()
+        hub.publish(day_channel(data['day']), event, data)
+        hub.publish(business_channel(data['business']), event, data)
+
+    # A broken hub must not fail the booking that already committed
+    transaction.on_commit(send, robust=True)
+
+
+def publish_slots_change(business_id, days, event):
+    """
+    Announce that slots of a business were blocked or unblocked, one event
+    per day on its day and business channels, after the current transaction
+    commits. `days` maps day ids to slot ids, as record_slot_events() returns.
+    """
+    messages = [{'day': day_id, 'business': business_id, 'slots': slot_ids} for day_id, slot_ids in days.items()]
+
+    def send():
+        hub = get_hub()
+        for data in messages:
+            hub.publish(day_channel(data['day']), event, data)
+            hub.publish(business_channel(business_id), event, data)
+
+    transaction.on_commit(send, robust=True)
+
+
+# -------------------------
+# STREAMING
+# -------------------------
+def sse(event, data, event_id=None):
+    lines = [] if event_id is None else [f'id: {event_id}']
+    lines += [f'event: {event}', f'data: {json.dumps(data)}']
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_start(snapshot=None):
+    """Reconnect delay for the browser, then the optional snapshot event."""
+    retry_ms = getattr(settings, 'APPOINTMENT_LIVE_RETRY_MS', 3000)
+    start = f'retry: {retry_ms}\n\n'
+    return start if snapshot is None else start + sse('snapshot', snapshot)
+
+
+async def event_stream(subscription, snapshot=None):
+    """
+    SSE body: stream_start(), then every published event, with a comment
+    line as keepalive. Ends after APPOINTMENT_LIVE_MAX_AGE seconds; the
+    browser reconnects by itself.
+    """
+    heartbeat = getattr(settings, 'APPOINTMENT_LIVE_HEARTBEAT', 15)
+    max_age = getattr(settings, 'APPOINTMENT_LIVE_MAX_AGE', 300)
+
+    ends = time.monotonic() + max_age
+    try:
+        yield stream_start(snapshot)
+        while (remaining := ends - time.monotonic()) > 0:
+            message = await subscription.get(min(heartbeat, remaining))
+            if message is None:
+                yield ': keepalive\n\n'
+            else:
+                event_id, event, data = message
+                yield sse(event, data, event_id)
+    finally:
+        subscription.close()
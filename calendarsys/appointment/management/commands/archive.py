@@ -0,0 +1,35 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from appointment.models import Day
+from appointment.sharding import shards
+from appointment.utils import archive_days_before
+
+
+class Command(BaseCommand):
+    help = (
+        "Move days older than the retention horizon, with their slots and appointments, "
+        "into the compact archive tables in batched transactions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=90,
+                            help="Keep days newer than this many days in the live tables")
+        parser.add_argument('--batch-size', type=int, default=500, help="Days per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be archived")
+
+    def handle(self, *args, **options):
+        if options['retention_days'] < 1:
+            raise CommandError("--retention-days must be at least 1.")
+        cutoff = date.today() - timedelta(days=options['retention_days'])
+
+        if options['dry_run']:
+            count = sum(Day.objects.using(alias).filter(date__lt=cutoff).count() for alias in shards())
+            self.stdout.write(f"{count} days before {cutoff} would be archived.")
+            return
+
+        days, appointments = archive_days_before(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {days} days and {appointments} appointments before {cutoff}."
+        ))
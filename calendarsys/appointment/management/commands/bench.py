@@ -0,0 +1,296 @@
+import json
+import platform
+import subprocess
+import time as timer
+from datetime import date, datetime, time, timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from appointment.models import Day, TimeSlot, Appointment
+from appointment.seeding import seed_data
+from appointment.utils import generate_time_slots, generate_week, generate_month, regenerate_slots
+
+
+WORKDAY = dict(start_time=time(9, 0), end_time=time(17, 0), interval=30, breaks=[(time(12, 0), time(13, 0))])
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    rank = max(int(round(p / 100 * len(samples) + 0.5)) - 1, 0)
+    return samples[min(rank, len(samples) - 1)]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'iterations': len(samples),
+        'ops_per_sec': len(samples) / total if total else 0.0,
+        'mean_ms': total / len(samples) * 1000 if samples else 0.0,
+        'min_ms': samples[0] * 1000 if samples else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p90_ms': percentile(samples, 90) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'max_ms': samples[-1] * 1000 if samples else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the scheduling hot paths (slot generation, booking, cancellation, dashboards) "
+        "against a seeded fixture and report ops/s and latency percentiles. "
+        "Everything runs in a transaction that is rolled back."
+    )
+
+    # Benchmarks in run order; each name maps to a bench_<name> method
+    BENCHMARKS = [
+        'generate_time_slots',
+        'generate_week',
+        'generate_month',
+        'regenerate_slots',
+        'book_slot',
+        'cancel_booking',
+        'dashboard_owner',
+        'dashboard_client',
+        'business_detail_owner',
+        'business_detail_client',
+        'day_detail_owner',
+        'day_detail_client',
+        'owner_dashboard',
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=2, help="Untimed runs before each read benchmark")
+        parser.add_argument('--only', default='', help="Comma-separated benchmark names")
+        parser.add_argument('--owners', type=int, default=10)
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--days', type=int, default=20)
+        parser.add_argument('--density', type=float, default=0.5)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help="Write JSON results to this file")
+        parser.add_argument('--compare', default=None, help="JSON results of an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        names = [n.strip() for n in options['only'].split(',') if n.strip()] or self.BENCHMARKS
+        unknown = set(names) - set(self.BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+        self.iterations = options['iterations']
+        self.warmup = options['warmup']
+
+        # The test client talks to the 'testserver' host. Avoid
+        # setup_test_environment(): its instrumented template rendering
+        # would skew every view timing.
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            with transaction.atomic():
+                self.fixture = seed_data(
+                    owners=options['owners'],
+                    clients=options['clients'],
+                    days=options['days'],
+                    density=options['density'],
+                    seed=options['seed'],
+                    prefix='bench',
+                )
+                self.owner = self.fixture['owners'][0]
+                self.client_user = self.fixture['clients'][0]
+                self.business = self.fixture['businesses'][0]
+                # Write benchmarks go to another owner's business so the
+                # rows they add do not inflate the read benchmarks
+                self.scratch = self.fixture['businesses'][-1]
+                # Far enough out not to collide with the seeded days
+                self.future = date.today() + timedelta(days=3 * 365)
+
+                results = {}
+                for name in names:
+                    results[name] = summarize(getattr(self, f'bench_{name}')())
+                    self.report(name, results[name])
+
+                transaction.set_rollback(True)
+
+        payload = {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'fixture': self.fixture['counts'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(payload, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        if options['compare']:
+            self.compare(results, options['compare'])
+
+    # -------------------------
+    # HELPERS
+    # -------------------------
+    def time_runs(self, run, setup=None, warmup=0):
+        """
+        Call run(i) `iterations` times and return the wall time of each call.
+        setup(i), if given, runs untimed before each call.
+        """
+        for i in range(warmup):
+            run(i)
+        samples = []
+        for i in range(self.iterations):
+            if setup:
+                setup(i)
+            started = timer.perf_counter()
+            run(i)
+            samples.append(timer.perf_counter() - started)
+        return samples
+
+    def http(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def request(self, client, method, url):
+        response = getattr(client, method)(url)
+        if response.streaming:
+            # Streamed pages run most of their queries while the body is sent
+            b''.join(response.streaming_content)
+            response.close()
+        if response.status_code >= 400:
+            raise CommandError(f"{method.upper()} {url} returned {response.status_code}")
+        return response
+
+    def read_view(self, user, url):
+        client = self.http(user)
+        return self.time_runs(lambda i: self.request(client, 'get', url), warmup=self.warmup)
+
+    def report(self, name, stats):
+        self.stdout.write(
+            f"{name:<24} {stats['ops_per_sec']:>9.1f} ops/s   "
+            f"p50 {stats['p50_ms']:>8.2f} ms   p90 {stats['p90_ms']:>8.2f} ms   p99 {stats['p99_ms']:>8.2f} ms"
+        )
+
+    def compare(self, results, path):
+        with open(path) as f:
+            previous = json.load(f)
+        self.stdout.write(f"\nCompared with {previous.get('commit') or path} (p50):")
+        for name, stats in results.items():
+            old = previous['results'].get(name)
+            if not old or not old['p50_ms']:
+                continue
+            change = (stats['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+            self.stdout.write(f"{name:<24} {old['p50_ms']:>8.2f} -> {stats['p50_ms']:>8.2f} ms  ({change:+.1f}%)")
+
+    # -------------------------
+    # SLOT GENERATION
+    # -------------------------
+    def bench_generate_time_slots(self):
+        days = []
+
+        def setup(i):
+            days.append(Day.objects.create(business=self.scratch, date=self.future + timedelta(days=i)))
+
+        return self.time_runs(
+            lambda i: generate_time_slots(days[i], WORKDAY['start_time'], WORKDAY['end_time'],
+                                          WORKDAY['interval'], WORKDAY['breaks']),
+            setup=setup,
+        )
+
+    def bench_generate_week(self):
+        def run(i):
+            start = self.future + timedelta(days=400 + 7 * i)
+            generate_week(self.scratch, start, start + timedelta(days=6), **WORKDAY)
+
+        return self.time_runs(run)
+
+    def bench_generate_month(self):
+        def run(i):
+            year, month = divmod(self.future.month - 1 + 12 + i, 12)
+            generate_month(self.scratch, self.future.year + 4 + year, month + 1, **WORKDAY)
+
+        return self.time_runs(run)
+
+    def bench_regenerate_slots(self):
+        day = Day.objects.create(business=self.scratch, date=self.future - timedelta(days=1))
+        return self.time_runs(
+            lambda i: regenerate_slots(day, WORKDAY['start_time'], WORKDAY['end_time'],
+                                       WORKDAY['interval'], WORKDAY['breaks'])
+        )
+
+    # -------------------------
+    # BOOKING / CANCELLATION
+    # -------------------------
+    def booking_slots(self):
+        """One free slot per iteration, each on its own day, so the client can book them all."""
+        if not hasattr(self, '_booking_slots'):
+            start = self.future - timedelta(days=self.iterations + 10)
+            days = Day.objects.bulk_create([
+                Day(business=self.scratch, date=start + timedelta(days=i)) for i in range(self.iterations)
+            ])
+            slots = [TimeSlot(day=day, start=time(10, 0), end=time(10, 30)) for day in days]
+            for slot in slots:
+                slot.set_datetimes()
+            self._booking_slots = TimeSlot.objects.bulk_create(slots)
+        return self._booking_slots
+
+    def bench_book_slot(self):
+        client = self.http(self.client_user)
+        slots = self.booking_slots()
+        return self.time_runs(
+            lambda i: self.request(client, 'post', reverse('calendar:book_slot', args=[slots[i].id]))
+        )
+
+    def bench_cancel_booking(self):
+        client = self.http(self.client_user)
+        slots = self.booking_slots()
+
+        def setup(i):
+            if not Appointment.objects.filter(slot=slots[i]).exists():
+                Appointment.objects.create(client=self.client_user, slot=slots[i])
+
+        return self.time_runs(
+            lambda i: self.request(client, 'post', reverse('calendar:cancel_booking', args=[slots[i].id])),
+            setup=setup,
+        )
+
+    # -------------------------
+    # DASHBOARDS
+    # -------------------------
+    def bench_dashboard_owner(self):
+        return self.read_view(self.owner, reverse('calendar:dashboard'))
+
+    def bench_dashboard_client(self):
+        return self.read_view(self.client_user, reverse('calendar:dashboard'))
+
+    def bench_business_detail_owner(self):
+        return self.read_view(self.owner, reverse('calendar:business_detail', args=[self.business.id]))
+
+    def bench_business_detail_client(self):
+        return self.read_view(self.client_user, reverse('calendar:business_detail', args=[self.business.id]))
+
+    def bench_day_detail_owner(self):
+        day = self.business.days.order_by('date').first()
+        return self.read_view(self.owner, reverse('calendar:day_detail', args=[day.id]))
+
+    def bench_day_detail_client(self):
+        day = self.business.days.order_by('date').first()
+        return self.read_view(self.client_user, reverse('calendar:day_detail', args=[day.id]))
+
+    def bench_owner_dashboard(self):
+        return self.read_view(self.owner, reverse('calendar:owner_dashboard', args=[self.business.id]))
@@ -0,0 +1,168 @@
+import asyncio
+import time as timer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from appointment.booking_queue import run_booking
+from appointment.models import Appointment, Business, Day, TimeSlot
+from appointment.sharding import shard_for_business
+from .bench import summarize
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent requests at the async read API through the ASGI handler "
+        "(AsyncClient on one event loop) and through the WSGI handler (test Client "
+        "in a thread pool), and report throughput and latency percentiles for both. "
+        "With --bookings, also race that many clients for one slot, booking directly and "
+        "through the group-commit queue. Reads existing data: run `manage.py seed` first."
+    )
+
+    ENDPOINTS = ['business_list', 'business_availability', 'day_availability', 'slot_search']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and handler")
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--username', default=None, help="User to log in as (default: first seeded client)")
+        parser.add_argument('--bookings', type=int, default=0,
+                            help="Clients racing for one slot in the booking contention run (0: skip it)")
+
+    def handle(self, *args, **options):
+        business = Business.objects.filter(days__slots__is_booked=False).order_by('id').first()
+        if business is None:
+            raise CommandError("No business with free slots; run `manage.py seed` first.")
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.filter(profile__role='client').order_by('id').first()
+        if user is None:
+            raise CommandError("No user to log in as.")
+
+        day = business.days.filter(slots__is_booked=False).order_by('date').first()
+        urls = {
+            'business_list': reverse('calendar:api_business_list'),
+            'business_availability': reverse('calendar:api_business_availability', args=[business.id]),
+            'day_availability': reverse('calendar:api_day_availability', args=[day.id]),
+            'slot_search': reverse('calendar:api_slot_search') + f'?business={business.id}',
+        }
+        self.total = options['requests']
+        self.concurrency = options['concurrency']
+
+        # Log in once; both handlers share the session cookie
+        login = Client()
+        login.force_login(user)
+        self.cookies = login.cookies
+
+        self.stdout.write(f"{self.total} requests per endpoint, {self.concurrency} concurrent\n")
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name in self.ENDPOINTS:
+                for handler, run in (('asgi', self.run_asgi), ('wsgi', self.run_wsgi)):
+                    started = timer.perf_counter()
+                    samples = run(urls[name])
+                    elapsed = timer.perf_counter() - started
+                    self.report(f'{name} [{handler}]', summarize(samples), self.total / elapsed)
+
+        if options['bookings']:
+            self.stdout.write(f"\n{options['bookings']} clients booking one slot, {self.concurrency} concurrent\n")
+            for mode in ('direct', 'queue'):
+                with override_settings(APPOINTMENT_BOOKING_MODE=mode):
+                    self.run_bookings(business, options['bookings'], mode)
+
+    # -------------------------
+    # HANDLERS
+    # -------------------------
+    def expect_ok(self, response, url):
+        if response.status_code >= 400:
+            raise CommandError(f"GET {url} returned {response.status_code}")
+
+    def run_asgi(self, url):
+        async def worker(count, samples):
+            client = AsyncClient()
+            client.cookies = self.cookies
+            for _ in range(count):
+                started = timer.perf_counter()
+                self.expect_ok(await client.get(url), url)
+                samples.append(timer.perf_counter() - started)
+
+        async def main():
+            samples = []
+            await asyncio.gather(*(worker(count, samples) for count in self.shares()))
+            return samples
+
+        return asyncio.run(main())
+
+    def run_wsgi(self, url):
+        def worker(count):
+            client = Client()
+            client.cookies = self.cookies
+            samples = []
+            try:
+                for _ in range(count):
+                    started = timer.perf_counter()
+                    self.expect_ok(client.get(url), url)
+                    samples.append(timer.perf_counter() - started)
+            finally:
+                connections.close_all()
+            return samples
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return [s for samples in pool.map(worker, self.shares()) for s in samples]
+
+    def run_bookings(self, business, count, mode):
+        """Book `count` clients into one scratch slot of `business`, then delete it again."""
+        clients = list(User.objects.filter(profile__role='client').order_by('id')[:count])
+        if len(clients) < count:
+            raise CommandError(f"Only {len(clients)} clients to book with; seed more or lower --bookings.")
+        using = shard_for_business(business)
+        taken = set(Day.objects.using(using).filter(business=business).values_list('date', flat=True))
+        day_date = next(d for d in (date(2100, 1, 1) + timedelta(days=i) for i in range(len(taken) + 1)) if d not in taken)
+        day = Day.objects.using(using).create(business=business, date=day_date)
+        slot = TimeSlot(day=day, start=time(9, 0), end=time(10, 0), capacity=count)
+        slot.save(using=using)
+
+        def worker(batch):
+            samples, failures = [], 0
+            try:
+                for client in batch:
+                    started = timer.perf_counter()
+                    try:
+                        run_booking(using, lambda: Appointment.objects.create(client=client, slot=slot))
+                    except Exception:  # ValidationError, "database is locked", ...
+                        failures += 1
+                    samples.append(timer.perf_counter() - started)
+            finally:
+                connections.close_all()
+            return samples, failures
+
+        batches = [clients[i::self.concurrency] for i in range(self.concurrency)]
+        try:
+            started = timer.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                results = list(pool.map(worker, [b for b in batches if b]))
+            elapsed = timer.perf_counter() - started
+        finally:
+            Day.objects.using(using).filter(pk=day.pk).delete()
+
+        failures = sum(f for _, f in results)
+        self.report(f'book one slot [{mode}]', summarize([s for samples, _ in results for s in samples]),
+                    (count - failures) / elapsed)
+        self.stdout.write(f"{'':<32} {failures} of {count} bookings failed")
+
+    def shares(self):
+        """Split the requests over the concurrent workers."""
+        per_worker, extra = divmod(self.total, self.concurrency)
+        return [per_worker + (i < extra) for i in range(self.concurrency) if per_worker + (i < extra)]
+
+    def report(self, name, stats, throughput):
+        self.stdout.write(
+            f"{name:<32} {throughput:>9.1f} req/s   "
+            f"p50 {stats['p50_ms']:>8.2f} ms   p90 {stats['p90_ms']:>8.2f} ms   p99 {stats['p99_ms']:>8.2f} ms"
+        )
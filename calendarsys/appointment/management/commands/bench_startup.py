@@ -0,0 +1,107 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Runs in a fresh interpreter, like a gunicorn worker booting. Prints one
+# JSON line with the duration of each phase and whether any phase opened a
+# database connection.
+WORKER_SCRIPT = r'''
+import io, json, sys, time
+started = time.perf_counter()
+import django
+from django.conf import settings
+settings.INSTALLED_APPS  # import the settings module
+imported = time.perf_counter()
+django.setup()
+setup_done = time.perf_counter()
+
+from django.db import connections
+def db_connected():
+    return any(connections[alias].connection is not None for alias in connections)
+setup_used_db = db_connected()
+
+from django.core.handlers.wsgi import WSGIHandler
+handler = WSGIHandler()
+handler_done = time.perf_counter()
+
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1], 'QUERY_STRING': '',
+    'SERVER_NAME': sys.argv[2], 'SERVER_PORT': '80', 'HTTP_HOST': sys.argv[2],
+    'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(b''), 'wsgi.errors': sys.stderr,
+}
+status = []
+body = b''.join(handler(environ, lambda s, h, exc_info=None: status.append(s)))
+first_request_done = time.perf_counter()
+
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'setup_ms': (setup_done - imported) * 1000,
+    'handler_ms': (handler_done - setup_done) * 1000,
+    'first_request_ms': (first_request_done - handler_done) * 1000,
+    'status': status[0] if status else None,
+    'setup_used_db': setup_used_db,
+    'request_used_db': db_connected(),
+}))
+'''
+
+PHASES = ['import_ms', 'setup_ms', 'handler_ms', 'first_request_ms', 'process_ms']
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold start of a WSGI worker in fresh interpreters: settings import, "
+        "django.setup(), handler/middleware loading and the first request. "
+        "Fails if django.setup() touches the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--path', default='/appointment/login/', help="URL of the first request")
+        parser.add_argument('--output', default=None, help="Write JSON results to this file")
+
+    def handle(self, *args, **options):
+        host = next((h for h in settings.ALLOWED_HOSTS if h not in ('*',) and not h.startswith('.')), 'localhost')
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'calendarsys.settings')}
+
+        runs = []
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, '-c', WORKER_SCRIPT, options['path'], host],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            elapsed = (time.perf_counter() - started) * 1000
+            if result.returncode:
+                raise CommandError(f"Worker failed:\n{result.stderr}")
+            run = json.loads(result.stdout.strip().splitlines()[-1])
+            run['process_ms'] = elapsed
+            runs.append(run)
+
+        summary = {
+            phase: {
+                'median_ms': statistics.median(r[phase] for r in runs),
+                'max_ms': max(r[phase] for r in runs),
+            }
+            for phase in PHASES
+        }
+        for phase in PHASES:
+            self.stdout.write(
+                f"{phase:<18} median {summary[phase]['median_ms']:>8.1f} ms   max {summary[phase]['max_ms']:>8.1f} ms"
+            )
+        self.stdout.write(f"first request status: {runs[0]['status']}")
+        self.stdout.write(f"request opened a DB connection: {any(r['request_used_db'] for r in runs)}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'path': options['path'], 'summary': summary, 'runs': runs}, f, indent=2)
+
+        if any(r['setup_used_db'] for r in runs):
+            raise CommandError("django.setup() opened a database connection.")
+        self.stdout.write(self.style.SUCCESS("django.setup() did not touch the database."))
@@ -0,0 +1,60 @@
+import io
+import pstats
+import re
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+PROFILE_NAME = re.compile(
+    r'^\d{8}-\d{6}-(?P<url_name>[\w.]+)-(?P<role>\w+)-(?P<queries>\d+)q-(?P<ms>\d+)ms-\d+\.prof$'
+)
+
+
+class Command(BaseCommand):
+    help = "Summarize the top cumulative hot spots across profiles written by ProfilingMiddleware."
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', nargs='?', default=None,
+                            help="Defaults to APPOINTMENT_PROFILE_DIR")
+        parser.add_argument('--url-name', default=None, help="Only profiles of this URL name, e.g. calendar.dashboard")
+        parser.add_argument('--role', default=None, help="Only profiles of this user role")
+        parser.add_argument('--limit', type=int, default=25, help="Number of functions to show")
+        parser.add_argument('--sort', default='cumulative', choices=['cumulative', 'tottime', 'ncalls'])
+
+    def handle(self, *args, **options):
+        directory = Path(options['directory'] or getattr(settings, 'APPOINTMENT_PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+        if not directory.is_dir():
+            raise CommandError(f"No profile directory at {directory}")
+
+        files = []
+        requests = Counter()
+        slowest = {}
+        for path in sorted(directory.glob('*.prof')):
+            match = PROFILE_NAME.match(path.name)
+            if not match:
+                continue
+            if options['url_name'] and match['url_name'] != options['url_name']:
+                continue
+            if options['role'] and match['role'] != options['role']:
+                continue
+            files.append(str(path))
+            key = (match['url_name'], match['role'])
+            requests[key] += 1
+            slowest[key] = max(slowest.get(key, 0), int(match['ms']))
+
+        if not files:
+            raise CommandError("No matching profiles found.")
+
+        self.stdout.write(f"{len(files)} profiles\n")
+        self.stdout.write(f"{'url name':<36} {'role':<10} {'count':>6} {'slowest':>10}")
+        for (name, role), count in requests.most_common():
+            self.stdout.write(f"{name:<36} {role:<10} {count:>6} {slowest[(name, role)]:>8}ms")
+        self.stdout.write('')
+
+        output = io.StringIO()
+        stats = pstats.Stats(*files, stream=output)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(output.getvalue())
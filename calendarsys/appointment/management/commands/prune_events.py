@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from appointment.models import ScheduleEvent
+from appointment.outbox import prune_events
+from appointment.sharding import shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete change feed events older than the retention period, in batches. "
+        "Consumers that have not synced within it get a 410 and take a new snapshot."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=30,
+                            help="Keep events newer than this many days")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Events per DELETE")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        if options['retention_days'] < 1:
+            raise CommandError("--retention-days must be at least 1.")
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+
+        if options['dry_run']:
+            count = sum(ScheduleEvent.objects.using(alias).filter(created_at__lt=cutoff).count() for alias in shards())
+            self.stdout.write(f"Up to {count} events before {cutoff:%Y-%m-%d %H:%M} would be deleted.")
+            return
+
+        deleted = prune_events(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} events before {cutoff:%Y-%m-%d %H:%M}."))
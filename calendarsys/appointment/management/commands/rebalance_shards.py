@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count
+
+from appointment.models import Business, TimeSlot
+from appointment.sharding import move_business, shard_for_business, shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Move a business's days, slots and appointments to another shard. "
+        "Without --to, the shard holding the fewest slots is chosen. "
+        "Without a business, print the load of every shard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('business_id', nargs='?', type=int)
+        parser.add_argument('--to', default=None, help="Target shard alias")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be moved")
+
+    def handle(self, *args, **options):
+        load = {alias: TimeSlot.objects.using(alias).count() for alias in shards()}
+        if options['business_id'] is None:
+            businesses = dict(
+                Business.objects.values_list('shard').annotate(n=Count('id')).values_list('shard', 'n')
+            )
+            for alias in shards():
+                count = businesses.get(alias, 0) + (businesses.get('', 0) if alias == DEFAULT_DB_ALIAS else 0)
+                self.stdout.write(f"{alias:<16} {count:>6} businesses {load[alias]:>10} slots")
+            return
+
+        business = Business.objects.filter(pk=options['business_id']).first()
+        if business is None:
+            raise CommandError(f"Business {options['business_id']} does not exist.")
+        source = shard_for_business(business)
+        target = options['to'] or min(load, key=load.get)
+        if target not in load:
+            raise CommandError(f"Unknown shard {target!r}; configured: {', '.join(load)}.")
+        if target == source:
+            self.stdout.write(f"'{business.name}' is already on {source}.")
+            return
+
+        if options['dry_run']:
+            slots = TimeSlot.objects.using(source).filter(business=business).count()
+            self.stdout.write(f"Would move '{business.name}' ({slots} slots) from {source} to {target}.")
+            return
+
+        moved = move_business(business, target)
+        summary = ', '.join(f"{count} {name.replace('_', ' ')}" for name, count in moved.items())
+        self.stdout.write(self.style.SUCCESS(f"Moved '{business.name}' from {source} to {target}: {summary}."))
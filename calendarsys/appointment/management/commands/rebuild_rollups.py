@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from appointment.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the utilization rollups of every live date from the days, slots and bookings. "
+        "Cancellation counts come from the change feed only and are kept."
+    )
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} daily rollups."))
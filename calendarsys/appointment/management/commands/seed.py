@@ -0,0 +1,52 @@
+from datetime import date, time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from appointment.seeding import seed_data
+
+
+class Command(BaseCommand):
+    help = "Generate a deterministic, production-sized data set with bulk inserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owners', type=int, default=10)
+        parser.add_argument('--businesses-per-owner', type=int, default=2)
+        parser.add_argument('--staff-per-business', type=int, default=2)
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--days', type=int, default=20, help="Weekdays generated per business")
+        parser.add_argument('--start-date', type=date.fromisoformat, default=None, help="YYYY-MM-DD, defaults to tomorrow")
+        parser.add_argument('--start-time', type=time.fromisoformat, default=time(9, 0))
+        parser.add_argument('--end-time', type=time.fromisoformat, default=time(17, 0))
+        parser.add_argument('--interval', type=int, default=30, help="Slot length in minutes")
+        parser.add_argument('--density', type=float, default=0.5, help="Fraction of slots booked (0-1)")
+        parser.add_argument('--prefix', default='seed', help="Prefix for usernames and business names")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not 0 <= options['density'] <= 1:
+            raise CommandError("--density must be between 0 and 1.")
+        if options['start_time'] >= options['end_time']:
+            raise CommandError("--start-time must be before --end-time.")
+
+        result = seed_data(
+            owners=options['owners'],
+            businesses_per_owner=options['businesses_per_owner'],
+            staff_per_business=options['staff_per_business'],
+            clients=options['clients'],
+            days=options['days'],
+            start_time=options['start_time'],
+            end_time=options['end_time'],
+            interval=options['interval'],
+            density=options['density'],
+            start_date=options['start_date'],
+            prefix=options['prefix'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+        )
+
+        for name, count in result['counts'].items():
+            self.stdout.write(f"{name:>13}: {count}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded '{options['prefix']}' data. Every seeded user has the password 'password'."
+        ))
@@ -0,0 +1,36 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from appointment.sharding import shards
+from appointment.utils import due_reminders, send_reminders
+
+
+class Command(BaseCommand):
+    help = (
+        "Email a reminder to every client booked on the given day (default: tomorrow). "
+        "Appointments already reminded are skipped, so the command can be rerun safely."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', default=None, help="Day to remind about, YYYY-MM-DD")
+        parser.add_argument('--batch-size', type=int, default=200, help="Messages per send and per UPDATE")
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many reminders are due")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        try:
+            day = date.fromisoformat(options['date']) if options['date'] else None
+        except ValueError:
+            raise CommandError(f"Invalid --date {options['date']!r}; expected YYYY-MM-DD.")
+
+        if options['dry_run']:
+            day = day or timezone.localdate() + timedelta(days=1)
+            count = sum(due_reminders(day).using(alias).count() for alias in shards())
+            self.stdout.write(f"{count} reminders due for {day}.")
+            return
+
+        sent = send_reminders(day, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} reminders."))
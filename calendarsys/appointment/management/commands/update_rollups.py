@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from appointment.rollups import update_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the change feed events recorded since the last run to the utilization rollups "
+        "of the owner analytics page. Run it every few minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Events per transaction")
+
+    def handle(self, *args, **options):
+        applied = update_rollups(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Applied {applied} events to the rollups."))
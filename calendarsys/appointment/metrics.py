@@ -0,0 +1,204 @@
+"""
+In-process performance metrics.
+
+Per-request timings (query count, DB time, template time) are collected in a
+context variable by PerformanceMiddleware and aggregated into per-URL-name
+histograms. registry.render() returns them in the Prometheus text format.
+
+Each process keeps its own registry: with several gunicorn workers, every
+scrape of /metrics reads the worker that served it.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] += amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            yield f'{self.name}{format_labels(labels)} {value:g}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self.values.get(tuple(sorted(labels.items())))
+        return sum(series[:-1]) if series else 0
+
+    def sum(self, **labels):
+        series = self.values.get(tuple(sorted(labels.items())))
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, list(series)) for key, series in self.values.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, observed in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += observed
+                le = bound if bound == '+Inf' else f'{bound:g}'
+                yield f'{self.name}_bucket{format_labels(labels + (("le", le),))} {cumulative}'
+            yield f'{self.name}_sum{format_labels(labels)} {series[-1]:g}'
+            yield f'{self.name}_count{format_labels(labels)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation):
+        metric = Counter(name, documentation)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    'appointment_request_duration_seconds', 'Total request latency by URL name.')
+REQUEST_DB_DURATION = registry.histogram(
+    'appointment_request_db_seconds', 'Time spent in database queries per request.')
+REQUEST_TEMPLATE_DURATION = registry.histogram(
+    'appointment_request_template_seconds', 'Time spent rendering templates per request.')
+REQUEST_QUERIES = registry.histogram(
+    'appointment_request_queries', 'Database queries per request.', buckets=QUERY_BUCKETS)
+BOOKING_CONFLICTS = registry.counter(
+    'appointment_booking_conflicts_total', 'Booking attempts rejected because the slot was taken.')
+SLOTS_GENERATED = registry.counter(
+    'appointment_slots_generated_total', 'Time slots created by the slot generators.')
+BOOKING_BATCH_SIZE = registry.histogram(
+    'appointment_booking_batch_size', 'Bookings committed per group-commit transaction (queue mode).',
+    buckets=(1, 2, 5, 10, 20, 50, 100))
+REQUESTS_THROTTLED = registry.counter(
+    'appointment_requests_throttled_total', 'Requests refused with 429 by a rate limit, by rule and scope.')
+REQUESTS_SHED = registry.counter(
+    'appointment_requests_shed_total', 'Requests refused with 503 by the concurrency cap.')
+
+
+# -------------------------
+# PER-REQUEST TIMING
+# -------------------------
+class RequestTiming:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+
+current_timing = ContextVar('current_timing', default=None)
+
+
+def db_timer(execute, sql, params, many, context):
+    """connection.execute_wrapper() hook: count queries and time them."""
+    timing = current_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.queries += 1
+        timing.db_time += time.perf_counter() - started
+
+
+class TimedTemplate:
+    """Wraps a backend template to add its render time to the current request."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        timing = current_timing.get()
+        if timing is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        db_time = timing.db_time
+        try:
+            return self.template.render(context, request)
+        finally:
+            # Lazy querysets evaluated by the template count as DB time only
+            timing.template_time += time.perf_counter() - started - (timing.db_time - db_time)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    DjangoTemplates backend that reports render time to PerformanceMiddleware.
+    Use it as the TEMPLATES 'BACKEND'.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
@@ -0,0 +1,425 @@
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from .models import Business
+from .profiling import CProfileProfiler, SamplingProfiler
+from .routers import primary_pinned
+from .sharding import current_shard, is_sharded, shard_for_business, shard_for_pk
+from .metrics import (
+    RequestTiming,
+    current_timing,
+    REQUEST_DURATION,
+    REQUEST_DB_DURATION,
+    REQUEST_TEMPLATE_DURATION,
+    REQUEST_QUERIES,
+    REQUESTS_SHED,
+)
+
+
+def url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+def streamed_page(response):
+    """
+    A streamed response that still does the page's work as it is sent
+    (appointment.streaming), as opposed to an open-ended SSE stream.
+    """
+    return response.streaming and not response.get('Content-Type', '').startswith('text/event-stream')
+
+
+def wrap_stream(response, finished, timing=None):
+    """
+    Replace the content of a streamed `response` with the same chunks,
+    counting the queries they run into `timing`, and call `finished` once
+    when it has been sent, or closed unsent.
+    """
+    called = []
+
+    def finish():
+        if not called:
+            called.append(True)
+            finished()
+
+    def count():
+        return current_timing.set(timing) if timing is not None else None
+
+    def uncount(token):
+        if token is not None:
+            current_timing.reset(token)
+
+    if response.is_async:
+        async def chunks(content=aiter(response.streaming_content)):
+            try:
+                while True:
+                    token = count()
+                    try:
+                        chunk = await anext(content, None)
+                    finally:
+                        uncount(token)
+                    if chunk is None:
+                        break
+                    yield chunk
+            finally:
+                finish()
+    else:
+        def chunks(content=iter(response.streaming_content)):
+            try:
+                while True:
+                    token = count()
+                    try:
+                        chunk = next(content, None)
+                    finally:
+                        uncount(token)
+                    if chunk is None:
+                        break
+                    yield chunk
+            finally:
+                finish()
+
+    response.streaming_content = chunks()
+    # A generator closed before its first chunk skips its finally
+    response._resource_closers.append(finish)
+    return response
+
+
+class PerformanceMiddleware:
+    """
+    Records, per request, the query count, DB time, view time and template
+    render time. Emits them as a Server-Timing header and feeds the
+    per-URL-name histograms served at /metrics.
+
+    Put it first in MIDDLEWARE so the session/auth queries are included, and
+    use appointment.metrics.TimedDjangoTemplates as the template backend to
+    get template timings. Works for sync and async views alike: queries are
+    timed by the execute wrapper every connection gets on creation (see
+    signals.install_query_timer), which finds the request through a context
+    variable. A streamed page is recorded once its last chunk is sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        return self.finish(request, response, timing, started)
+
+    async def __acall__(self, request):
+        timing, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        return self.finish(request, response, timing, started)
+
+    def start(self):
+        timing = RequestTiming()
+        return timing, current_timing.set(timing), time.perf_counter()
+
+    def finish(self, request, response, timing, started):
+        finished = time.perf_counter()
+        total = finished - started
+        # Everything from the view call until the response came back
+        view = finished - request._view_started if hasattr(request, '_view_started') else 0.0
+
+        python = max(view - timing.db_time - timing.template_time, 0.0)
+        # Sent before the body: for a streamed page it covers the view only
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timing.db_time * 1000:.2f};desc="{timing.queries} queries"',
+            f'tpl;dur={timing.template_time * 1000:.2f}',
+            f'view;dur={view * 1000:.2f}',
+            f'py;dur={python * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+        if streamed_page(response):
+            # The histograms get the whole page, once it has been sent
+            return wrap_stream(response, lambda: self.observe(request, timing, started), timing)
+        self.observe(request, timing, started)
+        return response
+
+    def observe(self, request, timing, started):
+        name = url_name(request)
+        REQUEST_DURATION.observe(time.perf_counter() - started, url_name=name)
+        REQUEST_DB_DURATION.observe(timing.db_time, url_name=name)
+        REQUEST_TEMPLATE_DURATION.observe(timing.template_time, url_name=name)
+        REQUEST_QUERIES.observe(timing.queries, url_name=name)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._view_started = time.perf_counter()
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Sheds load before it reaches the database: at most
+    APPOINTMENT_MAX_CONCURRENT_REQUESTS requests of this process run at
+    once, the others get an immediate 503 with Retry-After instead of
+    queueing for the SQLite write lock. A streamed page holds its slot
+    until it has been sent; an SSE stream counts only until its view
+    returns, as it mostly waits for events. The cap is per process: with N workers
+    the site admits N times as many. Not used when the setting is None.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.limit = getattr(settings, 'APPOINTMENT_MAX_CONCURRENT_REQUESTS', None)
+        if not self.limit:
+            raise MiddlewareNotUsed
+        self.retry_after = getattr(settings, 'APPOINTMENT_SHED_RETRY_AFTER', 1)
+        self.get_response = get_response
+        self.running = 0
+        self.lock = threading.Lock()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enter():
+            return self.shed()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.exit()
+            raise
+        return self.release(response)
+
+    async def __acall__(self, request):
+        if not self.enter():
+            return self.shed()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self.exit()
+            raise
+        return self.release(response)
+
+    def release(self, response):
+        """Free the slot now, or once a streamed page has been sent."""
+        if streamed_page(response):
+            return wrap_stream(response, self.exit)
+        self.exit()
+        return response
+
+    def enter(self):
+        with self.lock:
+            if self.running >= self.limit:
+                return False
+            self.running += 1
+            return True
+
+    def exit(self):
+        with self.lock:
+            self.running -= 1
+
+    def shed(self):
+        REQUESTS_SHED.inc()
+        response = HttpResponse("Server busy, please retry shortly.", status=503, content_type='text/plain')
+        response['Retry-After'] = str(self.retry_after)
+        return response
+
+
+class PrimaryPinningMiddleware:
+    """
+    Pins the database reads of a request to the primary (see
+    routers.PrimaryReplicaRouter) when the request may write (POST, PUT,
+    PATCH, DELETE), and for APPOINTMENT_REPLICA_PIN_SECONDS after it through
+    a cookie, so the page a booking redirects to does not read a replica
+    that has not caught up yet.
+    """
+    sync_capable = True
+    async_capable = True
+    cookie = 'pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'APPOINTMENT_REPLICA_PIN_SECONDS', 5)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = primary_pinned.set(self.pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            primary_pinned.reset(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        token = primary_pinned.set(self.pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            primary_pinned.reset(token)
+        return self.finish(request, response)
+
+    def writes(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def pinned(self, request):
+        return self.writes(request) or self.cookie in request.COOKIES
+
+    def finish(self, request, response):
+        if self.writes(request) and self.pin_seconds:
+            response.set_cookie(self.cookie, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
+
+
+class ShardMiddleware:
+    """
+    Routes the scheduling queries of a request to the shard of the business,
+    day or slot named in its URL (see appointment.sharding). Views without
+    one (dashboards, slot search) fan out themselves. Not used with a
+    single shard.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not is_sharded():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = current_shard.set(self.shard(request))
+        try:
+            return self.get_response(request)
+        finally:
+            current_shard.reset(token)
+
+    async def __acall__(self, request):
+        token = current_shard.set(await sync_to_async(self.shard)(request))
+        try:
+            return await self.get_response(request)
+        finally:
+            current_shard.reset(token)
+
+    def shard(self, request):
+        try:
+            kwargs = resolve(request.path_info).kwargs
+        except Resolver404:
+            return None
+        if 'day_id' in kwargs:
+            return shard_for_pk(kwargs['day_id'])
+        if 'slot_id' in kwargs:
+            return shard_for_pk(kwargs['slot_id'])
+        if 'business_id' in kwargs:
+            business = Business.objects.filter(pk=kwargs['business_id']).only('shard').first()
+            return shard_for_business(business) if business else None
+        return None
+
+
+def user_role(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    profile = getattr(user, 'profile', None)
+    return profile.role if profile else 'user'
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in profiler for slow requests. Writes one .prof file per kept request
+    to APPOINTMENT_PROFILE_DIR, named after the URL name, user role, query
+    count and duration; summarize them with `manage.py profile_summary`.
+
+    Settings:
+    - APPOINTMENT_PROFILE_THRESHOLD_MS: keep profiles of requests at least
+      this slow (None: off). Every request is profiled to catch them.
+    - APPOINTMENT_PROFILE_SAMPLE_RATE: also keep this fraction of all
+      requests, whatever their latency (default 0).
+    - APPOINTMENT_PROFILER: 'sampling' (default, low overhead) or 'cprofile'.
+    - APPOINTMENT_PROFILE_INTERVAL_MS: sampling period (default 5).
+
+    Place it after PerformanceMiddleware to reuse its query count. It is
+    sync only: while enabled, async views run in a worker thread. A
+    streamed page is profiled until its last chunk is sent.
+    """
+
+    def __init__(self, get_response):
+        self.threshold = getattr(settings, 'APPOINTMENT_PROFILE_THRESHOLD_MS', None)
+        self.sample_rate = getattr(settings, 'APPOINTMENT_PROFILE_SAMPLE_RATE', 0.0)
+        if self.threshold is None and not self.sample_rate:
+            raise MiddlewareNotUsed("Profiling is disabled")
+        self.kind = getattr(settings, 'APPOINTMENT_PROFILER', 'sampling')
+        self.interval = getattr(settings, 'APPOINTMENT_PROFILE_INTERVAL_MS', 5) / 1000
+        self.directory = Path(getattr(settings, 'APPOINTMENT_PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+        self.get_response = get_response
+
+    def make_profiler(self):
+        if self.kind == 'cprofile':
+            return CProfileProfiler()
+        return SamplingProfiler(interval=self.interval)
+
+    def __call__(self, request):
+        sampled = random.random() < self.sample_rate
+        if self.threshold is None and not sampled:
+            return self.get_response(request)
+
+        timing = current_timing.get()
+        token = None
+        if timing is None:
+            # PerformanceMiddleware is not in front of us: count queries here
+            timing = RequestTiming()
+            token = current_timing.set(timing)
+
+        profiler = self.make_profiler()
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            profiler.stop()
+            raise
+        finally:
+            if token is not None:
+                current_timing.reset(token)
+
+        if streamed_page(response) and not response.is_async:
+            # Streamed pages (appointment.streaming) do their work as they are sent
+            return wrap_stream(response, lambda: self.finish(profiler, request, timing, started, sampled), timing)
+        self.finish(profiler, request, timing, started, sampled)
+        return response
+
+    def finish(self, profiler, request, timing, started, sampled):
+        profiler.stop()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if sampled or elapsed_ms >= self.threshold:
+            self.save(profiler, request, timing.queries, elapsed_ms)
+
+    def save(self, profiler, request, queries, elapsed_ms):
+        name = re.sub(r'[^\w.]+', '.', url_name(request))
+        filename = (
+            f"{datetime.now():%Y%m%d-%H%M%S}-{name}-{user_role(request)}"
+            f"-{queries}q-{elapsed_ms:.0f}ms-{os.getpid()}.prof"
+        )
+        self.directory.mkdir(parents=True, exist_ok=True)
+        profiler.dump(self.directory / filename)
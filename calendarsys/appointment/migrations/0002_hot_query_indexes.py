@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='client',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='appointments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='business',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='owned_businesses', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='day',
+            name='business',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='days', to='appointment.business'),
+        ),
+        migrations.AlterField(
+            model_name='timeslot',
+            name='day',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='appointment.day'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['client', 'slot'], name='appointment_client_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='business',
+            index=models.Index(fields=['owner', 'name'], name='business_owner_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='day',
+            index=models.Index(fields=['business', 'date'], name='day_business_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['day', 'start'], name='timeslot_day_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(condition=models.Q(('is_booked', False)), fields=['day', 'start'], name='timeslot_free_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment', '0002_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_username', models.CharField(max_length=150)),
+                ('date', models.DateField()),
+                ('start', models.TimeField()),
+                ('end', models.TimeField()),
+                ('created_at', models.DateTimeField()),
+                ('business', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_appointments', to='appointment.business')),
+                ('client', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_appointments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['date', 'start'],
+                'indexes': [models.Index(fields=['business', 'date'], name='appt_archive_business_date_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DayArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('total_slots', models.PositiveIntegerField(default=0)),
+                ('free_slots', models.PositiveIntegerField(default=0)),
+                ('bookings', models.PositiveIntegerField(default=0)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('business', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_days', to='appointment.business')),
+            ],
+            options={
+                'ordering': ['date'],
+                'unique_together': {('business', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment', '0003_archive_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='business',
+            name='shard',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
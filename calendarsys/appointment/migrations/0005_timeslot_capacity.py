@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:19
+
+from django.db import migrations, models
+
+
+def count_existing_bookings(apps, schema_editor):
+    # Until now a booked slot held exactly one appointment
+    TimeSlot = apps.get_model('appointment', 'TimeSlot')
+    TimeSlot.objects.using(schema_editor.connection.alias).filter(is_booked=True).update(booked=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment', '0004_business_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timeslot',
+            name='booked',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='timeslot',
+            name='capacity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(count_existing_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.CheckConstraint(condition=models.Q(('booked__lte', models.F('capacity'))), name='timeslot_booked_lte_capacity'),
+        ),
+    ]
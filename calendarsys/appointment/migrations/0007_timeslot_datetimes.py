@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_datetimes(apps, schema_editor):
+    TimeSlot = apps.get_model('appointment', 'TimeSlot')
+    slots = TimeSlot.objects.using(schema_editor.connection.alias).select_related('day').order_by('pk')
+
+    def local(day_date, value):
+        moment = datetime.combine(day_date, value)
+        return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+    batch = []
+    for slot in slots.iterator(chunk_size=2000):
+        slot.start_at = local(slot.day.date, slot.start)
+        slot.end_at = local(slot.day.date, slot.end)
+        batch.append(slot)
+        if len(batch) == 2000:
+            TimeSlot.objects.using(schema_editor.connection.alias).bulk_update(batch, ['start_at', 'end_at'])
+            batch = []
+    TimeSlot.objects.using(schema_editor.connection.alias).bulk_update(batch, ['start_at', 'end_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment', '0006_timeslot_staff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timeslot',
+            name='start_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='timeslot',
+            name='end_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_datetimes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='timeslot',
+            name='start_at',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='timeslot',
+            name='end_at',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(fields=['start_at'], name='timeslot_start_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(condition=models.Q(('is_booked', False)), fields=['start_at'], name='timeslot_free_start_at_idx'),
+        ),
+    ]
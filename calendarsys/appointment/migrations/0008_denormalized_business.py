@@ -0,0 +1,56 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_business_ids(apps, schema_editor):
+    # Two set-based UPDATEs: slots from their day, then appointments from their slot
+    alias = schema_editor.connection.alias
+    Day = apps.get_model('appointment', 'Day')
+    TimeSlot = apps.get_model('appointment', 'TimeSlot')
+    Appointment = apps.get_model('appointment', 'Appointment')
+    TimeSlot.objects.using(alias).update(
+        business=Subquery(Day.objects.filter(pk=OuterRef('day')).values('business')[:1])
+    )
+    Appointment.objects.using(alias).update(
+        business=Subquery(TimeSlot.objects.filter(pk=OuterRef('slot')).values('business')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment', '0007_timeslot_datetimes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timeslot',
+            name='business',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='appointment.business'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='business',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='appointments', to='appointment.business'),
+        ),
+        migrations.RunPython(copy_business_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='timeslot',
+            name='business',
+            field=models.ForeignKey(db_index=False, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='appointment.business'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='business',
+            field=models.ForeignKey(db_index=False, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='appointments', to='appointment.business'),
+        ),
+        migrations.AddIndex(
+            model_name='timeslot',
+            index=models.Index(condition=models.Q(('is_booked', False)), fields=['business', 'start_at'], name='timeslot_business_free_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['business', 'slot'], name='appointment_business_slot_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment', '0008_denormalized_business'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timeslot',
+            name='is_blocked',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 exists on SQLite only; other databases search the name column
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS appointment_business_fts "
+        "USING fts5(name, description, prefix='2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO appointment_business_fts (rowid, name, description) "
+        "SELECT id, name, COALESCE(description, '') FROM appointment_business"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS appointment_business_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment', '0010_appointment_reminder_sent_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment', '0014_closure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timeslot',
+            name='closure',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='slots', to='appointment.closure'),
+        ),
+    ]
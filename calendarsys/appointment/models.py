@@ -1,9 +1,14 @@
-from django.db import models, transaction
+from django.db import models, router, transaction
+from django.db.models import Case, F, Value, When
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 from django.db import models
 from datetime import date
 
+from .availability import invalidate_availability
+from .outbox import record_event, slot_data
+from .sharding import pick_shard
+
 class UserProfile(models.Model):
     USER_ROLES = (
         ('owner', 'Business Owner'),
@@ -35,26 +40,42 @@ class BusinessStaff(models.Model):
 
 class Business(models.Model):
     name = models.CharField(max_length=255, unique=True)
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="owned_businesses")
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="owned_businesses", db_index=False)
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     staff = models.ManyToManyField(User, through=BusinessStaff, related_name="business_staff")
+    # Database alias holding the days, slots and appointments (see appointment.sharding)
+    shard = models.CharField(max_length=64, blank=True, default='', editable=False)
 
+    class Meta:
+        indexes = [
+            # Owner pages list their businesses by name
+            models.Index(fields=['owner', 'name'], name='business_owner_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        if not self.shard:
+            self.shard = pick_shard(self.owner_id)
+        super().save(*args, **kwargs)
 from django.db import models
 from django.core.exceptions import ValidationError
 from datetime import date
 
 class Day(models.Model):
     date = models.DateField()
-    business = models.ForeignKey('Business', on_delete=models.CASCADE, related_name="days")
+    business = models.ForeignKey('Business', on_delete=models.CASCADE, related_name="days", db_index=False)
 
     class Meta:
         unique_together = ('date', 'business')
         ordering = ['date']
+        indexes = [
+            # business.days.all() ordered by date
+            models.Index(fields=['business', 'date'], name='day_business_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.business.name} - {self.date}"
@@ -67,29 +88,86 @@ class Day(models.Model):
 
 
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.timezone import now
+from datetime import datetime
+
+
+def slot_datetime(day_date, value):
+    """`value` (a time) on `day_date`, as an aware datetime in the current time zone."""
+    moment = datetime.combine(day_date, value)
+    return timezone.make_aware(moment) if settings.USE_TZ else moment
+
 
 class TimeSlot(models.Model):
-    day = models.ForeignKey(Day, on_delete=models.CASCADE, related_name="slots")
+    day = models.ForeignKey(Day, on_delete=models.CASCADE, related_name="slots", db_index=False)
+    # Copy of day.business_id (set by save()), so per-business queries skip the join through Day
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name="slots", db_index=False, editable=False)
     start = models.TimeField()
     end = models.TimeField()
+    # day.date + start/end, stored so time-range queries need no join to Day (see set_datetimes)
+    start_at = models.DateTimeField(editable=False)
+    end_at = models.DateTimeField(editable=False)
+    # Staff member whose calendar the slot is on; empty for a slot of the whole business
+    staff = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="staff_slots", db_index=False)
+    # Places in the slot (staff working in parallel, seats in a class)
+    capacity = models.PositiveIntegerField(default=1)
+    booked = models.PositiveIntegerField(default=0)
+    # Taken out of availability by the business (see utils.block_slots)
+    is_blocked = models.BooleanField(default=False)
+    # Closure that blocked the slot, so reopening it leaves blocks made by hand alone
+    closure = models.ForeignKey('Closure', null=True, blank=True, on_delete=models.SET_NULL, related_name="slots", editable=False)
+    # Not bookable: full (booked == capacity) or blocked. Kept in step by
+    # reserve() / release() and the set-based updates in utils
     is_booked = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['start']
+        constraints = [
+            models.CheckConstraint(condition=models.Q(booked__lte=models.F('capacity')), name='timeslot_booked_lte_capacity'),
+        ]
+        indexes = [
+            # day.slots ordered by start, duplicate and overlap checks
+            models.Index(fields=['day', 'start'], name='timeslot_day_start_idx'),
+            # One staff member's calendar: overlap checks and their load for the day
+            models.Index(fields=['staff', 'day', 'start'], name='timeslot_staff_day_idx'),
+            # Time-range scans: upcoming bookings, reminders
+            models.Index(fields=['start_at'], name='timeslot_start_at_idx'),
+            # Free slots between two moments, across days and businesses
+            models.Index(
+                fields=['start_at'],
+                condition=models.Q(is_booked=False),
+                name='timeslot_free_start_at_idx',
+            ),
+            # ... and within one business
+            models.Index(
+                fields=['business', 'start_at'],
+                condition=models.Q(is_booked=False),
+                name='timeslot_business_free_idx',
+            ),
+            # Free slots only: availability lists and counts
+            models.Index(
+                fields=['day', 'start'],
+                condition=models.Q(is_booked=False),
+                name='timeslot_free_idx',
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.day} {self.start}-{self.end}"
+        # Same text as "{day} {start}-{end}", without loading the Day
+        return f"{self.business.name} - {self.date} {self.start}-{self.end}"
 
     def clean(self):
         # Ensure start is before end
         if self.start >= self.end:
             raise ValidationError("Start time must be before end time")
         
-        # Prevent overlapping slots on the same day
+        # Prevent overlapping slots on the same day (per staff member: their slots run in parallel)
         overlapping = TimeSlot.objects.filter(
             day=self.day,
+            staff=self.staff,
             start__lt=self.end,
             end__gt=self.start
         )
@@ -102,39 +180,254 @@ class TimeSlot(models.Model):
         if self.day.date < now().date():
             raise ValidationError("Cannot create a slot for a past day.")
 
+        if self.booked > self.capacity:
+            raise ValidationError("Capacity cannot be lower than the places already booked.")
+
+    def set_datetimes(self):
+        """Fill business, start_at and end_at from the day and times. Call before bulk_create()."""
+        self.business_id = self.day.business_id
+        self.start_at = slot_datetime(self.day.date, self.start)
+        self.end_at = slot_datetime(self.day.date, self.end)
+
     def save(self, *args, **kwargs):
+        if self.start is not None and self.end is not None:
+            self.set_datetimes()
         # Ensure clean is called
         self.full_clean()
+        adding = self._state.adding or kwargs.get('force_insert')
+        kind = 'slot_created' if adding else 'slot_updated'
+        using = kwargs.get('using') or router.db_for_write(TimeSlot, instance=self)
+        if adding:
+            self.is_booked = self.booked >= self.capacity or self.is_blocked
+        else:
+            # booked belongs to reserve() / release(): an update leaves it out, so it
+            # cannot write back a stale count, and derives is_booked from the stored
+            # count (SET sees the row before the update, hence the new capacity as a value)
+            update_fields = kwargs.pop('update_fields', None) or [
+                f.name for f in self._meta.concrete_fields if not f.primary_key
+            ]
+            kwargs['update_fields'] = [name for name in update_fields if name != 'booked']
+            if 'is_booked' not in kwargs['update_fields']:
+                kwargs['update_fields'].append('is_booked')
+            self.is_booked = Value(True) if self.is_blocked else Case(
+                When(booked__gte=self.capacity, then=Value(True)), default=Value(False),
+            )
+        # The slot and its change feed event commit together
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            if not adding:
+                self.refresh_from_db(using=using, fields=['booked', 'is_booked'])
+            record_event(self.business_id, kind, slot_data(self), using)
+        invalidate_availability(self.business_id, self._state.db)
 
-        # If the slot is already booked and someone tries to save it as booked again
-        if self.pk and self.is_booked:
-            orig = TimeSlot.objects.get(pk=self.pk)
-            if orig.is_booked and self.is_booked:
-                raise ValidationError("This slot is already booked")
+    @property
+    def date(self):
+        """Local date of the slot, without loading the Day."""
+        return timezone.localdate(self.start_at) if settings.USE_TZ else self.start_at.date()
 
-        super().save(*args, **kwargs)
+    @property
+    def places_left(self):
+        return 0 if self.is_blocked else self.capacity - self.booked
+
+    def reserve(self):
+        """
+        Take one place with a single conditional UPDATE, so concurrent
+        bookings cannot overbook. Returns False when the slot is full or blocked.
+        """
+        taken = TimeSlot.objects.using(self._state.db).filter(
+            pk=self.pk, booked__lt=F('capacity'), is_blocked=False
+        ).update(
+            booked=F('booked') + 1,
+            # SET sees the row before the update: full once booked + 1 reaches capacity
+            is_booked=Case(When(booked__gte=F('capacity') - 1, then=Value(True)), default=Value(False)),
+        )
+        if taken:
+            self.booked += 1
+            self.is_booked = self.booked >= self.capacity
+            invalidate_availability(self.business_id, self._state.db)
+        return bool(taken)
+
+    def release(self):
+        """Give back one place."""
+        TimeSlot.objects.using(self._state.db).filter(pk=self.pk, booked__gt=0).update(
+            booked=F('booked') - 1, is_booked=F('is_blocked'),
+        )
+        self.booked = max(self.booked - 1, 0)
+        self.is_booked = self.is_blocked
+        invalidate_availability(self.business_id, self._state.db)
 
 
 
 class Appointment(models.Model):
-    client = models.ForeignKey(User, on_delete=models.CASCADE, related_name="appointments")
+    client = models.ForeignKey(User, on_delete=models.CASCADE, related_name="appointments", db_index=False)
     slot = models.ForeignKey(TimeSlot, on_delete=models.CASCADE, related_name="appointments")
+    # Copy of slot.business_id (set by save()), for per-business lists and checks without joins
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name="appointments", db_index=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set by send_reminders() once the reminder email went out
+    reminder_sent_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # "one booking per day" check and the client dashboard
+            models.Index(fields=['client', 'slot'], name='appointment_client_slot_idx'),
+            # Bookings of a business (owner pages, history, archiving)
+            models.Index(fields=['business', 'slot'], name='appointment_business_slot_idx'),
+            # Admin date hierarchy: drill-down bounds and its date list
+            models.Index(fields=['created_at'], name='appointment_created_at_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         # Only clients can book appointments
         if self.client.profile.role != 'client':
             raise ValidationError("Only clients can book appointments.")
 
-        # Concurrency-safe booking
-        with transaction.atomic():
-            self.slot.refresh_from_db()
-            if self.slot.is_booked:
+        # An appointment lives on its slot's shard, whatever create() picked
+        kwargs['using'] = self.slot._state.db or kwargs.get('using')
+        self.business_id = self.slot.business_id
+
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        # Concurrency-safe booking: the place and the appointment commit together
+        with transaction.atomic(using=kwargs['using']):
+            if not self.slot.reserve():
                 raise ValidationError("This slot is already booked")
-            self.slot.is_booked = True
-            self.slot.save()
             super().save(*args, **kwargs)
-            
+            self.record_event('slot_booked')
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=self._state.db):
+            self.slot.release()
+            self.record_event('slot_freed')
+            return super().delete(*args, **kwargs)
 
+    def record_event(self, kind):
+        data = {**slot_data(self.slot), 'appointment': self.id, 'client': self.client_id}
+        record_event(self.business_id, kind, data, self._state.db)
 
 
+# -------------------------
+# CLOSURES
+# -------------------------
+class Closure(models.Model):
+    """A period without bookings: a holiday, a staff absence (see utils.close_business)."""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name="closures", db_index=False)
+    # Staff member who is away; empty when the whole business is closed
+    staff = models.ForeignKey(User, null=True, blank=True, on_delete=models.CASCADE, related_name="closures", db_index=False)
+    start_at = models.DateTimeField()
+    end_at = models.DateTimeField()
+    reason = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['start_at']
+        constraints = [
+            models.CheckConstraint(condition=models.Q(end_at__gt=models.F('start_at')), name='closure_end_after_start'),
+        ]
+        indexes = [
+            # Closures of a business overlapping a period (generators, the closures page)
+            models.Index(fields=['business', 'start_at'], name='closure_business_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.business_id}: {self.start_at} - {self.end_at} {self.reason}".rstrip()
+
+
+
+
+
+# -------------------------
+# ARCHIVE
+# -------------------------
+class DayArchive(models.Model):
+    """Per-day summary kept after a past Day and its slots are archived."""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name="archived_days", db_index=False)
+    date = models.DateField()
+    total_slots = models.PositiveIntegerField(default=0)
+    free_slots = models.PositiveIntegerField(default=0)
+    bookings = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('business', 'date')
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.business_id} - {self.date} (archived)"
+
+
+class AppointmentArchive(models.Model):
+    """A past appointment, flattened so it no longer needs Day/TimeSlot rows."""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name="archived_appointments", db_index=False)
+    client = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name="archived_appointments")
+    client_username = models.CharField(max_length=150)
+    date = models.DateField()
+    start = models.TimeField()
+    end = models.TimeField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['date', 'start']
+        indexes = [
+            models.Index(fields=['business', 'date'], name='appt_archive_business_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.client_username} {self.date} {self.start}-{self.end} (archived)"
+
+
+# -------------------------
+# CHANGE FEED
+# -------------------------
+class ScheduleEvent(models.Model):
+    """One change to the schedule of a business, appended in the transaction that made it (see appointment.outbox)."""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name="schedule_events", db_index=False)
+    kind = models.CharField(max_length=32)
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # The feed of one business: id > cursor, in id order
+            models.Index(fields=['business', 'id'], name='event_business_id_idx'),
+            # Retention: events older than the cutoff
+            models.Index(fields=['created_at'], name='event_created_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.business_id} #{self.id} {self.kind}"
+
+
+class FeedCursor(models.Model):
+    """How far a consumer of the change feed has read on this shard."""
+    name = models.CharField(max_length=64, unique=True)
+    position = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+# -------------------------
+# ANALYTICS
+# -------------------------
+class DailyUtilization(models.Model):
+    """Utilization of a business on one date, kept up to date from the change feed (see appointment.rollups)."""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name="daily_utilization", db_index=False)
+    date = models.DateField()
+    slots = models.PositiveIntegerField(default=0)
+    # Places in slots that are not blocked, and how many of them are booked
+    places = models.PositiveIntegerField(default=0)
+    booked = models.PositiveIntegerField(default=0)
+    # Sum over the bookings of (slot start - booked at)
+    lead_time_seconds = models.BigIntegerField(default=0)
+    cancellations = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('business', 'date')
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.business_id} - {self.date}: {self.booked}/{self.places}"
@@ -0,0 +1,160 @@
+"""
+Change feed of scheduling events (the outbox).
+
+Every change to the schedule of a business appends a ScheduleEvent row on
+its shard, in the same transaction as the change itself, so the feed
+never shows a change that rolled back nor misses one that committed:
+
+- slot_created / slot_updated: TimeSlot.save(), with the slot's fields
+- slot_booked / slot_freed: a booking or cancellation, with the
+  appointment and client and the slot's places left
+- slots_blocked / slots_unblocked / slots_deleted: set-based changes,
+  with the ids and dates of the slots
+- staff_added / staff_removed: the staff member (the slots removed with
+  them get a slots_deleted event)
+
+api_business_changes serves the events of a business after a cursor (an
+event id) with keyset pagination, so a mirror (a CRM, a calendar sync)
+only reads what changed since its last poll. Without ?after it returns
+the current cursor alone: take that, then a snapshot, then poll from it.
+
+The cursor is only meaningful on the shard that issued it. Ids follow
+commit order because SQLite has a single writer; the head of the shard is
+read before its events, so an event committing during the read comes up
+on the next poll instead of being skipped. `manage.py prune_events`
+deletes events past the retention period; a consumer whose cursor fell
+behind it (or that moved shard with its business) gets a 410 and resyncs.
+"""
+from django.apps import apps
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .sharding import shards
+
+
+def slot_data(slot):
+    return {
+        'slot': slot.id,
+        'day': slot.day_id,
+        'date': slot.date.isoformat(),
+        'start': slot.start.isoformat(),
+        'end': slot.end.isoformat(),
+        'staff': slot.staff_id,
+        'capacity': slot.capacity,
+        'booked': slot.booked,
+        'is_blocked': slot.is_blocked,
+        'places_left': slot.places_left,
+    }
+
+
+def record_event(business_id, kind, data, using):
+    """Append one event; call inside the transaction that made the change."""
+    ScheduleEvent = apps.get_model('appointment', 'ScheduleEvent')
+    return ScheduleEvent.objects.using(using).create(business_id=business_id, kind=kind, data=data)
+
+
+def record_events(events, using):
+    """Append (business_id, kind, data) events with one INSERT."""
+    ScheduleEvent = apps.get_model('appointment', 'ScheduleEvent')
+    return ScheduleEvent.objects.using(using).bulk_create(
+        [ScheduleEvent(business_id=business_id, kind=kind, data=data) for business_id, kind, data in events]
+    )
+
+
+def record_slot_events(slots, kind):
+    """
+    One `kind` event per business listing the ids and dates of the `slots`
+    queryset. Call in the transaction that changes them, before the change.
+
+    Returns:
+    - dict: {business id: {day id: [slot ids]}}
+    """
+    changed = {}
+    by_day = {}
+    rows = slots.order_by('id').values_list('id', 'business_id', 'day_id', 'start_at')
+    for slot_id, business_id, day_id, start_at in rows:
+        data = changed.setdefault(business_id, {'slots': [], 'dates': set()})
+        data['slots'].append(slot_id)
+        data['dates'].add(timezone.localdate(start_at).isoformat())
+        by_day.setdefault(business_id, {}).setdefault(day_id, []).append(slot_id)
+    if changed:
+        record_events([
+            (business_id, kind, {'slots': data['slots'], 'dates': sorted(data['dates'])})
+            for business_id, data in changed.items()
+        ], slots.db)
+    return by_day
+
+
+def event_json(event):
+    return {'id': event.id, 'kind': event.kind, 'created_at': event.created_at.isoformat(), 'data': event.data}
+
+
+def feed_bounds(using):
+    """(oldest, newest) event id on `using`, (None, None) when there are none."""
+    ScheduleEvent = apps.get_model('appointment', 'ScheduleEvent')
+    bounds = ScheduleEvent.objects.using(using).aggregate(oldest=Min('id'), head=Max('id'))
+    return bounds['oldest'], bounds['head']
+
+
+def cursor_expired(after, oldest, head):
+    """
+    Whether events after `after` may be gone: pruned since the cursor was
+    issued (a gap before the oldest retained id) or issued by another shard.
+    Cursor 0 reads from the oldest retained event.
+    """
+    if after == 0:
+        return False
+    if head is None:
+        return after > 0
+    return after > head or after < oldest - 1
+
+
+def read_feed(business_id, after, limit, using):
+    """
+    Up to `limit` events of `business_id` after cursor `after`, oldest first.
+
+    Returns:
+    - (events, cursor, has_more): cursor is the one to poll from next
+    - None when the cursor has expired
+    """
+    ScheduleEvent = apps.get_model('appointment', 'ScheduleEvent')
+    oldest, head = feed_bounds(using)
+    if cursor_expired(after, oldest, head):
+        return None
+    if head is None:
+        return [], after, False
+    events = list(
+        ScheduleEvent.objects.using(using)
+        .filter(business_id=business_id, id__gt=after, id__lte=head)
+        .order_by('id')[:limit + 1]
+    )
+    has_more = len(events) > limit
+    events = events[:limit]
+    # Caught up: skip ahead to the head, past the other businesses' events
+    return events, events[-1].id if has_more else head, has_more
+
+
+def prune_events(cutoff, batch_size=1000, using=None):
+    """
+    Delete events created before `cutoff`, in batches, on every shard (or
+    on `using`). The newest event of a shard is kept, so the feed can tell
+    a pruned cursor from an idle one, and so are the events the local
+    consumers (FeedCursor, e.g. the rollups) have not read yet.
+
+    Returns:
+    - int: events deleted
+    """
+    ScheduleEvent = apps.get_model('appointment', 'ScheduleEvent')
+    FeedCursor = apps.get_model('appointment', 'FeedCursor')
+    deleted = 0
+    for alias in [using] if using else shards():
+        _, head = feed_bounds(alias)
+        if head is None:
+            continue
+        old = ScheduleEvent.objects.using(alias).filter(created_at__lt=cutoff, id__lt=head).order_by('id')
+        consumed = FeedCursor.objects.using(alias).aggregate(position=Min('position'))['position']
+        if consumed is not None:
+            old = old.filter(id__lte=consumed)
+        while ids := list(old.values_list('id', flat=True)[:batch_size]):
+            deleted += ScheduleEvent.objects.using(alias).filter(id__in=ids).delete()[0]
+    return deleted
@@ -0,0 +1,97 @@
+"""
+Request profilers used by ProfilingMiddleware.
+
+Both write pstats-compatible .prof files, so `manage.py profile_summary` (or
+snakeviz, or pstats directly) can read either kind:
+
+- CProfileProfiler: deterministic, exact call counts, noticeable overhead.
+- SamplingProfiler: a background thread snapshots the request thread's stack
+  every few milliseconds; cheap enough to leave on for every request.
+  Call counts are sample counts and times are estimates.
+"""
+import cProfile
+import marshal
+import sys
+import threading
+import time
+
+
+class CProfileProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+def frame_key(code):
+    # Same (file, first line, name) key cProfile uses
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = []  # [(stack outermost -> innermost, weight in seconds)]
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(frame_key(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append((stack, now - last))
+            last = now
+
+    def stats(self):
+        """Build a pstats stats dict: {func: (cc, nc, tt, ct, {caller: (cc, nc, tt, ct)})}."""
+        stats = {}
+
+        def entry(key):
+            if key not in stats:
+                stats[key] = [0, 0, 0.0, 0.0, {}]
+            return stats[key]
+
+        for stack, weight in self.samples:
+            seen = set()
+            for depth, key in enumerate(stack):
+                row = entry(key)
+                if key not in seen:  # recursion: count inclusive time once
+                    seen.add(key)
+                    row[0] += 1
+                    row[1] += 1
+                    row[3] += weight
+                if depth:
+                    caller = stack[depth - 1]
+                    cc, nc, tt, ct = row[4].get(caller, (0, 0, 0.0, 0.0))
+                    row[4][caller] = (cc + 1, nc + 1, tt, ct + weight)
+            leaf = entry(stack[-1]) if stack else None
+            if leaf:
+                leaf[2] += weight
+        return {key: (cc, nc, tt, ct, callers) for key, (cc, nc, tt, ct, callers) in stats.items()}
+
+    def dump(self, path):
+        with open(path, 'wb') as f:
+            marshal.dump(self.stats(), f)
@@ -0,0 +1,240 @@
+"""
+Utilization rollups for the owner analytics page.
+
+DailyUtilization keeps one row per (business, date) with the slots,
+open places, booked places, summed booking lead time and cancellations
+of that date, so the analytics page reads at most a year of small rows
+whatever the size of the booking history.
+
+The rows are maintained incrementally from the change feed
+(appointment.outbox): update_rollups() reads the events after its
+FeedCursor on each shard, recomputes the rows of the dates they touched
+from that date's slots and bookings, and counts the slot_freed events as
+cancellations, all in the transaction that advances the cursor, so
+each event is applied once. Run `manage.py update_rollups` every few
+minutes; the page lags the bookings by that much.
+
+`manage.py rebuild_rollups` recomputes every row from the live tables.
+Cancellations are only known from the feed, so it keeps their counts.
+Dates already archived keep their rows as they were.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .outbox import cursor_expired, feed_bounds
+from .sharding import shards
+
+
+logger = logging.getLogger(__name__)
+
+CURSOR_NAME = 'rollups'
+STATE_FIELDS = ['slots', 'places', 'booked', 'lead_time_seconds']
+COLUMNS = [*STATE_FIELDS, 'cancellations']
+
+
+def event_dates(event):
+    """Dates whose rollups `event` may change."""
+    data = event.data
+    if 'date' in data:
+        return [data['date']]
+    return data.get('dates', [])
+
+
+def compute_rows(using, business_id, dates=None):
+    """
+    Current state columns of `business_id` per date, from its days, slots
+    and bookings (every live date when `dates` is None).
+
+    Returns:
+    - dict: {date: {field: value}}
+    """
+    Day = apps.get_model('appointment', 'Day')
+    Appointment = apps.get_model('appointment', 'Appointment')
+
+    days = Day.objects.using(using).filter(business_id=business_id)
+    # Blocked slots (a closure keeps their bookings) leave places, bookings
+    # and lead time alike, so utilization stays within the open slots
+    bookings = Appointment.objects.using(using).filter(business_id=business_id, slot__is_blocked=False)
+    open_slots = Q(slots__is_blocked=False)
+    if dates is not None:
+        days = days.filter(date__in=dates)
+        bookings = bookings.filter(slot__day__date__in=dates)
+
+    rows = {
+        row['date']: {'slots': row['total'], 'places': row['places'], 'booked': row['booked'], 'lead_time_seconds': 0}
+        for row in days.values('date').annotate(
+            # Not named `slots`: that would hide the relation from the sums
+            total=Count('slots'),
+            places=Coalesce(Sum('slots__capacity', filter=open_slots), 0),
+            booked=Coalesce(Sum('slots__booked', filter=open_slots), 0),
+        )
+    }
+    lead = ExpressionWrapper(F('slot__start_at') - F('created_at'), output_field=DurationField())
+    for row in bookings.values('slot__day__date').annotate(lead=Sum(lead)):
+        if row['slot__day__date'] in rows and row['lead'] is not None:
+            rows[row['slot__day__date']]['lead_time_seconds'] = int(row['lead'].total_seconds())
+    # Dates whose day is gone count as closed
+    for day_date in dates or ():
+        rows.setdefault(day_date, dict.fromkeys(STATE_FIELDS, 0))
+    return rows
+
+
+def save_rows(using, business_id, rows):
+    """Upsert the state columns of `rows` with one INSERT ... ON CONFLICT; cancellations stay."""
+    DailyUtilization = apps.get_model('appointment', 'DailyUtilization')
+    DailyUtilization.objects.using(using).bulk_create(
+        [DailyUtilization(business_id=business_id, date=day_date, **values) for day_date, values in rows.items()],
+        update_conflicts=True,
+        unique_fields=['business', 'date'],
+        update_fields=[*STATE_FIELDS, 'updated_at'],
+        batch_size=500,
+    )
+
+
+def apply_events(events, using):
+    """Bring the rollups touched by `events` up to date."""
+    DailyUtilization = apps.get_model('appointment', 'DailyUtilization')
+    touched = defaultdict(set)
+    cancellations = Counter()
+    for event in events:
+        dates = [date.fromisoformat(value) for value in event_dates(event)]
+        touched[event.business_id].update(dates)
+        if event.kind == 'slot_freed':
+            cancellations[event.business_id, dates[0]] += 1
+
+    for business_id, dates in touched.items():
+        if dates:
+            save_rows(using, business_id, compute_rows(using, business_id, dates))
+    for (business_id, day_date), count in cancellations.items():
+        DailyUtilization.objects.using(using).filter(business_id=business_id, date=day_date).update(
+            cancellations=F('cancellations') + count,
+        )
+
+
+def update_shard(using, batch_size):
+    """Apply the events of shard `using` after the cursor, one transaction per batch. Returns events applied."""
+    FeedCursor = apps.get_model('appointment', 'FeedCursor')
+    ScheduleEvent = apps.get_model('appointment', 'ScheduleEvent')
+
+    cursor, _ = FeedCursor.objects.using(using).get_or_create(name=CURSOR_NAME)
+    oldest, head = feed_bounds(using)
+    if cursor_expired(cursor.position, oldest, head):
+        # Events were pruned before they were applied: their cancellations are lost
+        logger.warning("Rollup cursor on %s expired; rebuilding from the live tables", using)
+        rebuild_rollups(using)
+        FeedCursor.objects.using(using).filter(pk=cursor.pk).update(position=(oldest or 1) - 1)
+        cursor.refresh_from_db()
+
+    applied = 0
+    while True:
+        with transaction.atomic(using=using):
+            events = list(ScheduleEvent.objects.using(using).filter(id__gt=cursor.position).order_by('id')[:batch_size])
+            if not events:
+                return applied
+            apply_events(events, using)
+            # Only one run may apply a batch: a concurrent one moved the cursor first
+            moved = FeedCursor.objects.using(using).filter(pk=cursor.pk, position=cursor.position).update(
+                position=events[-1].id,
+            )
+            if not moved:
+                transaction.set_rollback(True, using=using)
+                return applied
+        cursor.position = events[-1].id
+        applied += len(events)
+
+
+def update_rollups(batch_size=1000, using=None):
+    """
+    Apply the change feed to the rollups on every shard (or on `using`).
+
+    Returns:
+    - int: events applied
+    """
+    return sum(update_shard(alias, batch_size) for alias in ([using] if using else shards()))
+
+
+def rebuild_rollups(using=None):
+    """
+    Recompute the state columns of every live date on every shard (or on
+    `using`), one transaction per business.
+
+    Returns:
+    - int: rows written
+    """
+    Day = apps.get_model('appointment', 'Day')
+    written = 0
+    for alias in [using] if using else shards():
+        business_ids = list(
+            Day.objects.using(alias).order_by('business_id').values_list('business_id', flat=True).distinct()
+        )
+        for business_id in business_ids:
+            with transaction.atomic(using=alias):
+                rows = compute_rows(alias, business_id)
+                save_rows(alias, business_id, rows)
+            written += len(rows)
+    return written
+
+
+# -------------------------
+# READING
+# -------------------------
+def with_rates(row):
+    """
+    `row` (rollup columns, or their sums) with the utilization and
+    cancellation rate in percent and the average lead time in hours.
+    """
+    booked, cancellations = row['booked'], row['cancellations']
+    return {
+        **row,
+        'utilization': round(100 * booked / row['places'], 1) if row['places'] else None,
+        'cancellation_rate': round(100 * cancellations / (booked + cancellations), 1) if booked + cancellations else None,
+        'lead_time_hours': round(row['lead_time_seconds'] / booked / 3600, 1) if booked else None,
+    }
+
+
+def total(rows):
+    """with_rates() of the sums of `rows`."""
+    return with_rates({name: sum(row[name] for row in rows) for name in COLUMNS})
+
+
+def utilization_by_day(business, start, end, using):
+    """Rollups of `business` from `start` to `end` (exclusive), one per date that has one."""
+    DailyUtilization = apps.get_model('appointment', 'DailyUtilization')
+    rows = (
+        DailyUtilization.objects.using(using)
+        .filter(business=business, date__gte=start, date__lt=end)
+        .values('date', *COLUMNS)
+        .order_by('date')
+    )
+    return [with_rates(row) for row in rows]
+
+
+def utilization_by_week(days):
+    """Totals of the utilization_by_day() rows `days` per week, keyed by its Monday."""
+    weeks = defaultdict(list)
+    for row in days:
+        weeks[row['date'] - timedelta(days=row['date'].weekday())].append(row)
+    return [{'week': monday, **total(rows)} for monday, rows in sorted(weeks.items())]
+
+
+def utilization_by_month(business, start, end, using):
+    """Rollups of `business` from `start` to `end` (exclusive), summed per month in the database."""
+    DailyUtilization = apps.get_model('appointment', 'DailyUtilization')
+    rows = (
+        DailyUtilization.objects.using(using)
+        .filter(business=business, date__gte=start, date__lt=end)
+        .annotate(month=TruncMonth('date')).values('month')
+        # Annotations may not reuse the field names
+        .annotate(**{f'total_{name}': Sum(name) for name in COLUMNS})
+        .order_by('month')
+    )
+    return [
+        with_rates({'month': row['month'], **{name: row[f'total_{name}'] for name in COLUMNS}})
+        for row in rows
+    ]
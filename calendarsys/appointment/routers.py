@@ -0,0 +1,94 @@
+"""
+Database routers.
+
+ShardRouter places the scheduling tables of each business on its shard;
+see appointment.sharding. List it before PrimaryReplicaRouter when both
+are used.
+
+PrimaryReplicaRouter sends writes to 'default' and reads to the aliases in
+APPOINTMENT_DATABASE_REPLICAS. Reads go to the primary instead while:
+
+- the request is pinned (PrimaryPinningMiddleware pins unsafe requests, and
+  the requests that follow them for APPOINTMENT_REPLICA_PIN_SECONDS, so a
+  client sees its own booking after the redirect), or
+- a transaction is open on the primary, so read-then-write sequences such
+  as the booking check in Appointment.save() read what they lock.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .sharding import current_shard, is_scheduling_model, shard_for_business, shards
+
+
+primary_pinned = ContextVar('primary_pinned', default=False)
+
+
+@contextmanager
+def use_primary():
+    """Route every read in the block to the primary."""
+    token = primary_pinned.set(True)
+    try:
+        yield
+    finally:
+        primary_pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    primary = DEFAULT_DB_ALIAS
+
+    def replicas(self):
+        return getattr(settings, 'APPOINTMENT_DATABASE_REPLICAS', [])
+
+    def db_for_read(self, model, **hints):
+        replicas = self.replicas()
+        if not replicas or primary_pinned.get() or connections[self.primary].in_atomic_block:
+            return self.primary
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        aliases = {self.primary, *self.replicas()}
+        return obj1._state.db in aliases and obj2._state.db in aliases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in self.replicas()
+
+
+class ShardRouter:
+    def shard(self, model, **hints):
+        instance = hints.get('instance')
+        if not is_scheduling_model(model):
+            # Reached from a row on a shard (appointment.client, ...): the
+            # mirrors only carry what the shard needs, read the real row
+            if instance is not None and instance._state.db != DEFAULT_DB_ALIAS and instance._state.db in shards():
+                return DEFAULT_DB_ALIAS
+            return None
+        if instance is not None:
+            # business.days, day.slots, slot.appointments, ...
+            if instance._meta.label_lower == 'appointment.business':
+                return shard_for_business(instance)
+            # __class__, not type(): request.user is a SimpleLazyObject
+            if is_scheduling_model(instance.__class__) and instance._state.db:
+                return instance._state.db
+        return current_shard.get()
+
+    db_for_read = shard
+    db_for_write = shard
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_scheduling_model(obj1.__class__) and is_scheduling_model(obj2.__class__):
+            # An unsaved row follows its parent's shard when saved
+            return obj1._state.db == obj2._state.db or obj1._state.adding or obj2._state.adding
+        # User and Business rows exist on every shard
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Every shard gets the full schema; unused tables stay empty
+        return None
@@ -0,0 +1,81 @@
+"""
+Business search for the signup form and the business list.
+
+On SQLite, business names and descriptions are indexed in the FTS5 table
+appointment_business_fts (migration 0011), with prefix indexes so that
+"sal" finds "Salon Anna" without scanning the businesses. The
+signals.index_business / unindex_business handlers keep it in step with
+saves and deletes; bulk loads that skip signals call index_businesses().
+
+Other databases fall back to a case-insensitive prefix match on the name.
+"""
+import re
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+FTS_TABLE = 'appointment_business_fts'
+
+
+def has_fts(using):
+    return connections[using].vendor == 'sqlite'
+
+
+def fts_query(text):
+    """Every word of `text` as a quoted prefix term, e.g. 'hair sal' -> '"hair"* "sal"*'."""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+def index_businesses(businesses, using=DEFAULT_DB_ALIAS):
+    """Add or refresh the index rows of `businesses`."""
+    if not has_fts(using):
+        return
+    rows = [(b.pk, b.name, b.description or '') for b in businesses]
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk, _, _ in rows])
+        cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', rows)
+
+
+def unindex_businesses(ids, using=DEFAULT_DB_ALIAS):
+    if not has_fts(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in ids])
+
+
+def rebuild_index(using=DEFAULT_DB_ALIAS):
+    """Reindex every business of `using` from scratch."""
+    if not has_fts(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+            f"SELECT id, name, COALESCE(description, '') FROM appointment_business"
+        )
+
+
+def search_businesses(text, limit, offset=0, using=DEFAULT_DB_ALIAS):
+    """
+    Businesses matching every word of `text` as a prefix, best match first.
+
+    Returns:
+    - list of Business
+    """
+    Business = apps.get_model('appointment', 'Business')
+    if not has_fts(using):
+        return list(Business.objects.using(using).filter(name__istartswith=text.strip())
+                    .order_by('name')[offset:offset + limit])
+
+    query = fts_query(text)
+    if not query:
+        return []
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s OFFSET %s',
+            [query, limit, offset],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    found = Business.objects.using(using).in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
@@ -0,0 +1,170 @@
+import random
+from contextlib import ExitStack
+from datetime import date, datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import UserProfile, Business, BusinessStaff, Day, TimeSlot, Appointment
+from .search import index_businesses
+from .sharding import group_by_shard, mirror_rows, pick_shard, shards
+
+
+def day_slots(start_time, end_time, interval):
+    """List of (start, end) times covering the workday, without breaks."""
+    slots = []
+    current = datetime.combine(date.min, start_time)
+    end = datetime.combine(date.min, end_time)
+    while current + timedelta(minutes=interval) <= end:
+        slots.append((current.time(), (current + timedelta(minutes=interval)).time()))
+        current += timedelta(minutes=interval)
+    return slots
+
+
+def weekdays(start_date, count):
+    """The first `count` weekdays from start_date on (Saturday and Sunday skipped)."""
+    dates = []
+    current = start_date
+    while len(dates) < count:
+        if current.weekday() < 5:
+            dates.append(current)
+        current += timedelta(days=1)
+    return dates
+
+
+def seed_data(
+    owners=10,
+    businesses_per_owner=2,
+    staff_per_business=2,
+    clients=200,
+    days=20,
+    start_time=time(9, 0),
+    end_time=time(17, 0),
+    interval=30,
+    density=0.5,
+    start_date=None,
+    prefix='seed',
+    seed=0,
+    batch_size=1000,
+    password='password',
+):
+    """
+    Deterministically generate owners, businesses, staff, clients, days,
+    slots and appointments with bulk inserts. Scheduling rows go to the
+    shard of their business.
+
+    Arguments:
+    - density: fraction of slots that get booked (0.0 - 1.0)
+    - prefix: prepended to usernames and business names so several seeds
+      can live in the same database
+    - seed: random seed, the same arguments always produce the same data
+
+    Returns:
+    - dict with the created owners, businesses, staff, clients and row counts
+    """
+    rng = random.Random(seed)
+    start_date = start_date or date.today() + timedelta(days=1)
+    password = make_password(password)  # hash once, share across users
+    slot_times = day_slots(start_time, end_time, interval)
+    dates = weekdays(start_date, days)
+
+    with ExitStack() as stack:
+        for alias in shards():
+            stack.enter_context(transaction.atomic(using=alias))
+
+        owner_users = User.objects.bulk_create(
+            [User(username=f'{prefix}-owner-{i}', password=password) for i in range(owners)],
+            batch_size=batch_size,
+        )
+        business_list = Business.objects.bulk_create(
+            [
+                Business(name=f'{prefix} business {i}-{j}', owner=owner, description=f'Seeded business {i}-{j}',
+                         shard=pick_shard(owner.id))
+                for i, owner in enumerate(owner_users)
+                for j in range(businesses_per_owner)
+            ],
+            batch_size=batch_size,
+        )
+        staff_users = User.objects.bulk_create(
+            [
+                User(username=f'{prefix}-staff-{b}-{k}', password=password)
+                for b in range(len(business_list))
+                for k in range(staff_per_business)
+            ],
+            batch_size=batch_size,
+        )
+        client_users = User.objects.bulk_create(
+            [User(username=f'{prefix}-client-{i}', password=password) for i in range(clients)],
+            batch_size=batch_size,
+        )
+
+        profiles = [UserProfile(user=u, role='owner') for u in owner_users]
+        profiles += [UserProfile(user=u, role='client') for u in staff_users]
+        profiles += [
+            UserProfile(user=u, role='client', business=rng.choice(business_list) if business_list else None)
+            for u in client_users
+        ]
+        UserProfile.objects.bulk_create(profiles, batch_size=batch_size)
+
+        BusinessStaff.objects.bulk_create(
+            [
+                BusinessStaff(user=staff_users[b * staff_per_business + k], business=business)
+                for b, business in enumerate(business_list)
+                for k in range(staff_per_business)
+            ],
+            batch_size=batch_size,
+        )
+
+        mirror_rows(User, owner_users + staff_users + client_users)
+        mirror_rows(Business, business_list)
+        index_businesses(business_list)
+
+        day_list = []
+        slots = []
+        bookings = []
+        for alias, group in group_by_shard(business_list).items():
+            shard_days = Day.objects.using(alias).bulk_create(
+                [Day(business=business, date=d) for business in group for d in dates],
+                batch_size=batch_size,
+            )
+            day_list += shard_days
+
+            # Decide bookings up front so TimeSlot.booked/is_booked are right on insert.
+            # A client never gets two bookings on the same day.
+            shard_slots = []
+            shard_bookings = []
+            for day in shard_days:
+                booked = [rng.random() < density for _ in slot_times]
+                day_clients = rng.sample(client_users, min(sum(booked), len(client_users)))
+                for (start, end), is_booked in zip(slot_times, booked):
+                    if is_booked and not day_clients:
+                        is_booked = False
+                    slot = TimeSlot(day=day, start=start, end=end, booked=int(is_booked), is_booked=is_booked)
+                    slot.set_datetimes()
+                    shard_slots.append(slot)
+                    if is_booked:
+                        shard_bookings.append((day_clients.pop(), slot))
+            TimeSlot.objects.using(alias).bulk_create(shard_slots, batch_size=batch_size)
+            Appointment.objects.using(alias).bulk_create(
+                [Appointment(client=client, slot=slot, business_id=slot.business_id) for client, slot in shard_bookings],
+                batch_size=batch_size,
+            )
+            slots += shard_slots
+            bookings += shard_bookings
+
+    return {
+        'owners': owner_users,
+        'businesses': business_list,
+        'staff': staff_users,
+        'clients': client_users,
+        'counts': {
+            'owners': len(owner_users),
+            'businesses': len(business_list),
+            'staff': len(staff_users),
+            'clients': len(client_users),
+            'days': len(day_list),
+            'slots': len(slots),
+            'appointments': len(bookings),
+        },
+    }
@@ -0,0 +1,265 @@
+"""
+Tenant sharding of the scheduling tables by business.
+
+The scheduling rows of a business (Day, TimeSlot, Appointment, their
+archives, its change feed and rollups) live on one of the database aliases in APPOINTMENT_SHARDS, so
+a large tenant generating a month of slots only locks its own shard.
+
+- Business rows are the directory: the primary copy is on 'default' and
+  Business.shard names the alias holding its scheduling rows. New
+  businesses get a shard from pick_shard(), a hash of the owner, so all
+  businesses of an owner start out together. `manage.py rebalance_shards`
+  moves a business and rewrites Business.shard.
+- User and Business rows are mirrored to every shard (see
+  signals.mirror_reference_row), so scheduling rows keep their foreign
+  keys and the existing joins (slot__business, client__username)
+  work on any shard.
+- Each shard allocates scheduling ids from its own range
+  (index * SHARD_ID_SPAN), so a day or slot id from a URL is enough to
+  find its shard.
+- routers.ShardRouter sends scheduling queries to the shard of the model
+  instance they come from, else to the shard set with on_shard()
+  (ShardMiddleware sets it from the URL), else to 'default'.
+
+With a single shard (the default) all of this reduces to 'default'.
+"""
+import zlib
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import prefetch_related_objects
+
+
+SCHEDULING_MODELS = {
+    'day', 'timeslot', 'appointment', 'dayarchive', 'appointmentarchive',
+    'scheduleevent', 'feedcursor', 'dailyutilization', 'closure',
+}
+SHARD_ID_SPAN = 10 ** 12
+
+current_shard = ContextVar('current_shard', default=None)
+
+
+def shards():
+    """Shard aliases, in id-range order. Only ever append to the setting."""
+    return list(getattr(settings, 'APPOINTMENT_SHARDS', [DEFAULT_DB_ALIAS]))
+
+
+def is_sharded():
+    return len(shards()) > 1
+
+
+def is_scheduling_model(model):
+    return model._meta.app_label == 'appointment' and model._meta.model_name in SCHEDULING_MODELS
+
+
+def pick_shard(owner_id):
+    """Deterministic shard for a new business of `owner_id`."""
+    aliases = shards()
+    return aliases[zlib.crc32(str(owner_id).encode()) % len(aliases)]
+
+
+def shard_for_business(business):
+    # Businesses from before sharding have no shard: their rows are on 'default'
+    return business.shard or DEFAULT_DB_ALIAS
+
+
+def shard_for_pk(pk):
+    """Shard that allocated the scheduling id `pk`."""
+    aliases = shards()
+    index = int(pk) // SHARD_ID_SPAN
+    return aliases[index] if index < len(aliases) else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def on_shard(alias):
+    """Route scheduling queries without an instance to hint at them to `alias`."""
+    token = current_shard.set(alias)
+    try:
+        yield
+    finally:
+        current_shard.reset(token)
+
+
+def group_by_shard(businesses):
+    """{alias: [business, ...]} for the given businesses."""
+    groups = defaultdict(list)
+    for business in businesses:
+        groups[shard_for_business(business)].append(business)
+    return groups
+
+
+def prefetch_by_shard(businesses, *lookups):
+    """prefetch_related_objects(), one round per shard the businesses live on."""
+    for alias, group in group_by_shard(businesses).items():
+        with on_shard(alias):
+            prefetch_related_objects(group, *lookups)
+
+
+def fan_out(queryset, aliases=None):
+    """Evaluate `queryset` on every shard (or on `aliases`) and concatenate the results."""
+    return [obj for alias in (aliases or shards()) for obj in queryset.using(alias)]
+
+
+# -------------------------
+# REFERENCE ROWS
+# -------------------------
+def mirror_rows(model, objs):
+    """Copy already saved `objs` to the other shards, keeping their primary keys."""
+    fields = [f.attname for f in model._meta.concrete_fields]
+    for alias in shards():
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        model._base_manager.using(alias).bulk_create(
+            [model(**{name: getattr(obj, name) for name in fields}) for obj in objs],
+            ignore_conflicts=True,
+        )
+
+
+def reserve_id_range(using):
+    """
+    Start the scheduling id sequences of shard `using` at its range, so its
+    ids never collide with another shard's. Idempotent.
+    """
+    aliases = shards()
+    if using not in aliases or not aliases.index(using):
+        return
+    start = aliases.index(using) * SHARD_ID_SPAN
+    connection = connections[using]
+    tables = [
+        model._meta.db_table for model in apps.get_app_config('appointment').get_models()
+        if is_scheduling_model(model)
+    ]
+    with connection.cursor() as cursor:
+        for table in tables:
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                    "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                    [table, start, table],
+                )
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s", [start, table, start])
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                    "GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM " + connection.ops.quote_name(table) + ")))",
+                    [table, start],
+                )
+
+
+# -------------------------
+# REBALANCING
+# -------------------------
+def copy_rows(model, rows, using, **remap):
+    """
+    Insert copies of `rows` on `using` with ids from that shard's range.
+    remap: {fk_attname: {old_id: new_id}} for parents copied before
+    (an empty foreign key stays empty).
+
+    Returns:
+    - dict: {old_id: new_id}
+    """
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    copies = []
+    for row in rows:
+        values = {f.attname: getattr(row, f.attname) for f in fields}
+        for attname, ids in remap.items():
+            if values[attname] is not None:
+                values[attname] = ids[values[attname]]
+        copies.append(model(**values))
+    model._base_manager.using(using).bulk_create(copies, batch_size=1000)
+
+    # bulk_create stamped auto_now(_add) fields with the current time
+    stamped = [f.name for f in fields if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    if stamped and copies:
+        for row, copy in zip(rows, copies):
+            for name in stamped:
+                setattr(copy, name, getattr(row, name))
+        model._base_manager.using(using).bulk_update(copies, stamped, batch_size=1000)
+    return {row.pk: copy.pk for row, copy in zip(rows, copies)}
+
+
+def move_business(business, target):
+    """
+    Move the scheduling rows of `business` to shard `target` and point
+    Business.shard at it. Rows get new ids from the target's range.
+
+    The source shard is write-locked first, so no booking can slip in
+    between the copy and the delete (on SQLite, writers on that shard wait
+    for the move). Commit order is target, then directory, then source: a
+    failure part way leaves duplicates rather than lost rows.
+
+    Returns:
+    - dict: rows moved per model name
+    """
+    from .rollups import update_rollups
+
+    Day = apps.get_model('appointment', 'Day')
+    TimeSlot = apps.get_model('appointment', 'TimeSlot')
+    Appointment = apps.get_model('appointment', 'Appointment')
+    DayArchive = apps.get_model('appointment', 'DayArchive')
+    AppointmentArchive = apps.get_model('appointment', 'AppointmentArchive')
+    ScheduleEvent = apps.get_model('appointment', 'ScheduleEvent')
+    DailyUtilization = apps.get_model('appointment', 'DailyUtilization')
+    Closure = apps.get_model('appointment', 'Closure')
+    Business = type(business)
+
+    source = shard_for_business(business)
+    if target == source:
+        return {}
+    if target not in shards():
+        raise ValueError(f"Unknown shard {target!r}")
+
+    with ExitStack() as stack:
+        # Entered source first so it commits last
+        for alias in dict.fromkeys([source, DEFAULT_DB_ALIAS, target]):
+            stack.enter_context(transaction.atomic(using=alias))
+        Business._base_manager.using(source).filter(pk=business.pk).update(shard=source)
+
+        days = list(Day.objects.using(source).filter(business=business).order_by('id'))
+        slots = list(TimeSlot.objects.using(source).filter(business=business).order_by('id'))
+        appointments = list(Appointment.objects.using(source).filter(business=business).order_by('id'))
+        day_archives = list(DayArchive.objects.using(source).filter(business=business).order_by('id'))
+        appointment_archives = list(AppointmentArchive.objects.using(source).filter(business=business).order_by('id'))
+        closures = list(Closure.objects.using(source).filter(business=business).order_by('id'))
+        # Apply the pending events first: the feed does not move (see below)
+        update_rollups(using=source)
+        rollups = list(DailyUtilization.objects.using(source).filter(business=business).order_by('id'))
+
+        day_ids = copy_rows(Day, days, target)
+        closure_ids = copy_rows(Closure, closures, target)
+        slot_ids = copy_rows(TimeSlot, slots, target, day_id=day_ids, closure_id=closure_ids)
+        copy_rows(Appointment, appointments, target, slot_id=slot_ids)
+        copy_rows(DayArchive, day_archives, target)
+        copy_rows(AppointmentArchive, appointment_archives, target)
+        copy_rows(DailyUtilization, rollups, target)
+
+        # Bottom-up, each level one set-based DELETE
+        Appointment.objects.using(source).filter(business=business).delete()
+        TimeSlot.objects.using(source).filter(business=business).delete()
+        Day.objects.using(source).filter(business=business).delete()
+        DayArchive.objects.using(source).filter(business=business).delete()
+        AppointmentArchive.objects.using(source).filter(business=business).delete()
+        Closure.objects.using(source).filter(business=business).delete()
+        # Feed cursors issued by the source expire (see appointment.outbox):
+        # consumers resync from a snapshot, so the events are not copied
+        ScheduleEvent.objects.using(source).filter(business=business).delete()
+        DailyUtilization.objects.using(source).filter(business=business).delete()
+
+        # The directory row and its mirrors (update() skips the mirroring signal)
+        for alias in shards():
+            Business._base_manager.using(alias).filter(pk=business.pk).update(shard=target)
+        business.shard = target
+
+    return {
+        'days': len(days),
+        'slots': len(slots),
+        'appointments': len(appointments),
+        'day_archives': len(day_archives),
+        'appointment_archives': len(appointment_archives),
+        'closures': len(closures),
+        'rollups': len(rollups),
+    }
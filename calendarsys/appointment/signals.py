@@ -0,0 +1,105 @@
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router
+
+from .metrics import db_timer
+from .search import index_businesses, unindex_businesses
+from .sharding import is_sharded, mirror_rows, reserve_id_range, shards
+
+
+STAFF_GROUP = "Business Staff"
+
+
+def create_staff_group(sender, using, apps=global_apps, **kwargs):
+    """
+    post_migrate handler: create the Business Staff group and give it the
+    TimeSlot permissions. Idempotent, so it is safe on every migrate.
+    `apps` is missing when the signal comes from flush.
+    """
+    try:
+        Group = apps.get_model('auth', 'Group')
+        Permission = apps.get_model('auth', 'Permission')
+    except LookupError:
+        return
+    if not router.allow_migrate_model(using, Group):
+        return
+
+    group, created = Group.objects.using(using).get_or_create(name=STAFF_GROUP)
+    perms = Permission.objects.using(using).filter(
+        content_type__app_label='appointment',
+        content_type__model='timeslot',
+    )
+    group.permissions.set(perms)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    connection_created handler: give every connection the metrics execute
+    wrapper. It only records while a request is being timed, in the same
+    thread or in a sync_to_async worker thread alike.
+    """
+    if db_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_timer)
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    connection_created handler: run the PRAGMAs of APPOINTMENT_SQLITE_PRAGMAS
+    (keyed by database alias) on each new SQLite connection. Executed on the
+    raw connection so they are not counted as request queries.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'APPOINTMENT_SQLITE_PRAGMAS', {}).get(connection.alias, {})
+    for name, value in pragmas.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def mirror_reference_row(sender, instance, using, raw=False, update_fields=None, **kwargs):
+    """
+    post_save handler for User and Business: copy the row to every shard so
+    the scheduling rows there keep their foreign keys. Logins only touch
+    last_login, which the shards do not need.
+    """
+    if raw or using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    fields = {f.attname: getattr(instance, f.attname) for f in sender._meta.concrete_fields if not f.primary_key}
+    for alias in shards():
+        if alias != DEFAULT_DB_ALIAS:
+            sender._base_manager.using(alias).update_or_create(pk=instance.pk, defaults=fields)
+
+
+def delete_reference_row(sender, instance, using, **kwargs):
+    """post_delete handler for User and Business: delete the mirrors, cascading on each shard."""
+    if using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    for alias in shards():
+        if alias != DEFAULT_DB_ALIAS:
+            sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def index_business(sender, instance, using, raw=False, update_fields=None, **kwargs):
+    """post_save handler for Business: refresh its row in the search index."""
+    if raw:
+        return
+    if update_fields is not None and not {'name', 'description'} & set(update_fields):
+        return
+    index_businesses([instance], using)
+
+
+def unindex_business(sender, instance, using, **kwargs):
+    """post_delete handler for Business: drop it from the search index."""
+    unindex_businesses([instance.pk], using)
+
+
+def prepare_shard(sender, using, **kwargs):
+    """post_migrate handler: give a shard its scheduling id range and the existing reference rows."""
+    if using == DEFAULT_DB_ALIAS or using not in shards():
+        return
+    reserve_id_range(using)
+    from django.contrib.auth.models import User
+    from .models import Business
+    for model in (User, Business):
+        mirror_rows(model, model._base_manager.using(DEFAULT_DB_ALIAS).all())
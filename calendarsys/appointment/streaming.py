@@ -0,0 +1,55 @@
+"""
+Streamed HTML pages for the owner views that list every day and booking.
+
+stream_page() renders the page template once with a marker where
+{{ sections }} stands, sends everything before it straight away, then
+the sections as a generator produces them (one per day, read with
+.iterator() querysets), then the rest of the page. The first bytes leave
+before the big queries run and memory stays flat in the number of days.
+
+Sections are rendered without the request: pass them what they need
+(e.g. csrf_token from get_token(), called in the view so the cookie is
+set on the response). Querysets read by the generator run after the view
+returned, so give them an explicit .using(): the shard set by
+ShardMiddleware is gone by then.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+
+SECTIONS_MARKER = mark_safe('<!-- sections -->')
+
+
+async def iterate_async(chunks):
+    """Serve a sync generator under ASGI one chunk at a time, instead of Django collecting it first."""
+    chunks = iter(chunks)
+    while (chunk := await sync_to_async(next)(chunks, None)) is not None:
+        yield chunk
+
+
+def stream_page(request, template_name, context, sections, empty=''):
+    """
+    StreamingHttpResponse of `template_name` with the strings of
+    `sections` (or `empty` when there are none) in place of {{ sections }}.
+    """
+    page = render_to_string(template_name, {**context, 'sections': SECTIONS_MARKER}, request)
+    head, marker, tail = page.partition(SECTIONS_MARKER)
+    if not marker:
+        # The template left {{ sections }} out (e.g. nothing to list)
+        sections, empty = (), ''
+
+    def chunks():
+        yield head
+        produced = False
+        for section in sections:
+            produced = True
+            yield section
+        if not produced:
+            yield empty
+        yield tail
+
+    content = iterate_async(chunks()) if isinstance(request, ASGIRequest) else chunks()
+    return StreamingHttpResponse(content, content_type='text/html; charset=utf-8')
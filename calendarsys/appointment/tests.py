@@ -1,3 +1,1995 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import pstats
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from importlib import import_module
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.contrib.auth.models import User, Group
+from django.contrib.contenttypes.models import ContentType
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.formats import date_format
+
+from .live import CacheHub, LocalHub, day_channel, business_channel, event_stream, get_hub
+from .metrics import (
+    BOOKING_BATCH_SIZE, REQUEST_DURATION, REQUEST_QUERIES, REQUESTS_SHED, REQUESTS_THROTTLED, BOOKING_CONFLICTS,
+)
+from .middleware import ConcurrencyLimitMiddleware, PrimaryPinningMiddleware, ShardMiddleware
+from .search import FTS_TABLE, fts_query, rebuild_index, search_businesses
+from .routers import PrimaryReplicaRouter, ShardRouter, primary_pinned, use_primary
+from .sharding import (
+    SHARD_ID_SPAN, move_business, on_shard, pick_shard, reserve_id_range, shard_for_business, shard_for_pk,
+)
+from .booking_queue import get_writer, run_booking
+from .throttling import take_token
+from .signals import configure_sqlite, create_staff_group, STAFF_GROUP
+from . import admin as appointment_admin
+from .models import (
+    UserProfile, Business, BusinessStaff, Day, TimeSlot, Appointment, DayArchive, AppointmentArchive, ScheduleEvent,
+    DailyUtilization, FeedCursor, Closure, slot_datetime,
+)
+from .outbox import prune_events
+from .rollups import rebuild_rollups, update_rollups, with_rates
+from .utils import (
+    archive_days_before, block_slots, book_free_staff, book_slot, business_history, cancel_appointments, close_business,
+    days_with_free_slots, free_staff_slots, generate_time_slots, iter_days_with_bookings, month_availability,
+    regenerate_slots, reopen_closure, send_reminders, unblock_slots,
+)
+
+
+# -------------------------
+# QUERY PLANS
+# -------------------------
+class QueryPlanTests(TestCase):
+    """
+    Run EXPLAIN QUERY PLAN on the hot queries of views.py / utils.py and
+    fail if SQLite answers any of them with a full table scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='pw')
+        cls.client_user = User.objects.create_user('client', password='pw')
+        cls.business = Business.objects.create(name='Salon', owner=cls.owner)
+        cls.day = Day.objects.create(business=cls.business, date=date.today() + timedelta(days=1))
+        cls.slot = TimeSlot.objects.create(day=cls.day, start=time(9, 0), end=time(9, 30))
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScan(self, queryset, index=None, ordered=False):
+        """
+        index: name of the index the plan is expected to use
+        ordered: the index must also satisfy the ORDER BY (no temp b-tree sort)
+        """
+        if connection.vendor != 'sqlite':
+            self.skipTest("EXPLAIN QUERY PLAN checks are SQLite specific")
+        plan = self.query_plan(queryset)
+        scans = [step for step in plan if step.startswith('SCAN ') and 'USING' not in step]
+        self.assertFalse(scans, f"Full table scan in query plan: {plan}")
+        if index:
+            self.assertTrue(any(index in step for step in plan), f"{index} not used: {plan}")
+        if ordered:
+            self.assertFalse(any('TEMP B-TREE' in step for step in plan), f"Sort not covered by index: {plan}")
+
+    def test_owner_business_list(self):
+        self.assertNoFullScan(
+            Business.objects.filter(owner=self.owner).order_by('name'),
+            index='business_owner_name_idx', ordered=True,
+        )
+
+    def test_business_days(self):
+        self.assertNoFullScan(
+            self.business.days.all().order_by('date'), index='day_business_date_idx', ordered=True
+        )
+
+    def test_day_exists_for_business(self):
+        self.assertNoFullScan(Day.objects.filter(business=self.business, date=self.day.date))
+
+    def test_free_slots_for_day(self):
+        self.assertNoFullScan(self.day.slots.filter(is_booked=False), index='timeslot_free_idx', ordered=True)
+
+    def test_slots_for_day(self):
+        self.assertNoFullScan(self.day.slots.all().order_by('start'), index='timeslot_day_start_idx', ordered=True)
+
+    def test_duplicate_slot_check(self):
+        self.assertNoFullScan(TimeSlot.objects.filter(day=self.day, start=time(9, 0), end=time(9, 30)))
+
+    def test_overlapping_slot_check(self):
+        self.assertNoFullScan(TimeSlot.objects.filter(day=self.day, start__lt=time(10, 0), end__gt=time(9, 0)))
+
+    def test_client_booking_on_day(self):
+        self.assertNoFullScan(
+            Appointment.objects.filter(client=self.client_user, slot__day=self.day),
+            index='appointment_client_slot_idx',
+        )
+
+    def test_bookings_for_day(self):
+        self.assertNoFullScan(
+            Appointment.objects.filter(slot__day=self.day).select_related('client', 'slot').order_by('slot__start')
+        )
+
+    def test_booking_for_slot(self):
+        self.assertNoFullScan(Appointment.objects.filter(slot=self.slot))
+
+    def test_client_dashboard_appointments(self):
+        self.assertNoFullScan(
+            Appointment.objects.filter(client=self.client_user)
+            .select_related('slot__day__business')
+            .order_by('slot__start_at')
+        )
+
+    def test_free_slots_in_range(self):
+        starts = timezone.now()
+        self.assertNoFullScan(
+            TimeSlot.objects.filter(is_booked=False, start_at__gte=starts, start_at__lt=starts + timedelta(days=7))
+            .order_by('start_at'),
+            index='timeslot_free_start_at_idx', ordered=True,
+        )
+
+    def test_free_slots_of_business_in_range(self):
+        self.assertNoFullScan(
+            TimeSlot.objects.filter(business=self.business, is_booked=False, start_at__gte=timezone.now())
+            .order_by('start_at'),
+            index='timeslot_business_free_idx', ordered=True,
+        )
+
+    def test_bookings_of_business(self):
+        self.assertNoFullScan(Appointment.objects.filter(business=self.business), index='appointment_business_slot_idx')
+
+    def test_booked_slots_in_range(self):
+        starts = timezone.now()
+        self.assertNoFullScan(
+            TimeSlot.objects.filter(booked__gt=0, start_at__gte=starts, start_at__lt=starts + timedelta(days=1)),
+            index='timeslot_start_at_idx',
+        )
+
+    def test_staff_membership(self):
+        self.assertNoFullScan(self.business.staff.filter(pk=self.client_user.pk))
+
+    def test_free_staff_slots(self):
+        self.assertNoFullScan(free_staff_slots(self.day, time(9, 0)), index='timeslot_staff_day_idx')
+
+    def test_month_availability(self):
+        first = self.day.date.replace(day=1)
+        self.assertNoFullScan(
+            TimeSlot.objects.filter(day__business=self.business, day__date__gte=first,
+                                    day__date__lte=first + timedelta(days=30))
+            .values('day__date', 'day').annotate(total=Count('id')).order_by('day__date'),
+            index='day_business_date_idx',
+        )
+
+    def test_appointment_date_hierarchy(self):
+        now = timezone.now()
+        self.assertNoFullScan(
+            Appointment.objects.filter(created_at__gte=now - timedelta(days=1), created_at__lt=now).order_by('-created_at'),
+            index='appointment_created_at_idx',
+        )
+
+    def test_change_feed_page(self):
+        self.assertNoFullScan(
+            ScheduleEvent.objects.filter(business=self.business, id__gt=0, id__lte=10 ** 6).order_by('id'),
+            index='event_business_id_idx', ordered=True,
+        )
+
+    def test_daily_utilization_range(self):
+        self.assertNoFullScan(
+            DailyUtilization.objects.filter(business=self.business, date__gte=self.day.date,
+                                            date__lt=self.day.date + timedelta(days=42)).order_by('date'),
+            ordered=True,
+        )
+
+    def test_events_to_prune(self):
+        self.assertNoFullScan(
+            ScheduleEvent.objects.filter(created_at__lt=timezone.now(), id__lt=10 ** 6).order_by('id'),
+        )
+
+
+# -------------------------
+# QUERY BUDGETS
+# -------------------------
+class ScheduleFixture:
+    """
+    Bulk-seeds owners, businesses, staff, clients, days, slots and bookings.
+    Every call to grow() adds one more batch of the same size, so calling it
+    again doubles the data the views have to deal with.
+    """
+    BUSINESSES_PER_OWNER = 2
+    DAYS_PER_BUSINESS = 5
+    SLOTS_PER_DAY = 16
+    CLIENTS = 10
+
+    def __init__(self):
+        self.batches = 0
+        self.owner = self.make_user('owner', 'owner')
+        self.other_owner = self.make_user('other_owner', 'owner')
+        self.business = Business.objects.create(name='Main Salon', owner=self.owner)
+        self.other_business = Business.objects.create(name='Other Salon', owner=self.other_owner)
+        self.staff = self.make_user('staff', 'client')
+        self.client = self.make_user('client', 'client', business=self.business)
+        BusinessStaff.objects.create(user=self.staff, business=self.business)
+        self.next_date = date.today() + timedelta(days=1)
+
+    def make_user(self, username, role, business=None):
+        user = User.objects.create(username=username)
+        UserProfile.objects.create(user=user, role=role, business=business)
+        return user
+
+    def grow(self):
+        self.batches += 1
+        batch = self.batches
+
+        # More businesses for both owners
+        Business.objects.bulk_create([
+            Business(name=f'Business {batch}-{owner.username}-{i}', owner=owner)
+            for owner in (self.owner, self.other_owner)
+            for i in range(self.BUSINESSES_PER_OWNER)
+        ])
+
+        # More clients
+        clients = User.objects.bulk_create([
+            User(username=f'client-{batch}-{i}') for i in range(self.CLIENTS)
+        ])
+        UserProfile.objects.bulk_create([
+            UserProfile(user=c, role='client', business=self.business) for c in clients
+        ])
+
+        # More days on every business, each with a full set of slots
+        dates = [self.next_date + timedelta(days=i) for i in range(self.DAYS_PER_BUSINESS)]
+        self.next_date += timedelta(days=self.DAYS_PER_BUSINESS)
+        days = Day.objects.bulk_create([
+            Day(business=business, date=d) for business in Business.objects.all() for d in dates
+        ])
+        slots = [
+            TimeSlot(
+                day=day,
+                start=time(8 + i // 2, 30 * (i % 2)),
+                end=time(8 + (i + 1) // 2, 30 * ((i + 1) % 2)),
+                booked=int(i % 2 == 0),
+                is_booked=i % 2 == 0,
+            )
+            for day in days for i in range(self.SLOTS_PER_DAY)
+        ]
+        for slot in slots:
+            slot.set_datetimes()
+        TimeSlot.objects.bulk_create(slots)
+
+        # Every other slot is booked; the fixture client books one slot
+        # per day at the main business
+        appointments = []
+        for n, slot in enumerate(s for s in slots if s.is_booked):
+            client = clients[n % len(clients)]
+            if slot.day.business_id == self.business.id and slot.start == time(8, 0):
+                client = self.client
+            appointments.append(Appointment(client=client, slot=slot, business_id=slot.business_id))
+        Appointment.objects.bulk_create(appointments)
+
+    def free_slot(self, business, client):
+        """An unbooked slot on a day the client has no booking yet."""
+        booked_days = Appointment.objects.filter(client=client).values('slot__day')
+        return TimeSlot.objects.filter(day__business=business, is_booked=False).exclude(day__in=booked_days).first()
+
+    def client_booking(self, business):
+        return Appointment.objects.filter(client=self.client, slot__day__business=business).first()
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every URL of appointment/urls.py, per role, must run in a fixed number of
+    queries. Each budget is checked on the seeded fixture, then again after
+    the fixture has been doubled: the count must not move.
+    """
+
+    def setUp(self):
+        self.fixture = ScheduleFixture()
+        self.fixture.grow()
+
+    def assertBudget(self, budget, user, url, method='get', data=None):
+        """
+        url: a string, or a callable returning one (called before each run,
+        so write endpoints can pick fresh rows)
+        """
+        for scale in (1, 2):
+            if scale == 2:
+                self.fixture.grow()
+            if user is None:
+                self.client.logout()
+            else:
+                self.client.force_login(user)
+            path = url() if callable(url) else url
+            with self.assertNumQueries(budget, msg=f"{method.upper()} {path} at scale {scale}"):
+                response = getattr(self.client, method)(path, data or {})
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 400, f"{method.upper()} {path}")
+
+    def url(self, name, *args):
+        return reverse(f'calendar:{name}', args=args)
+
+    def first_day(self, business):
+        return business.days.order_by('date').first()
+
+    # -------------------------
+    # AUTHENTICATION
+    # -------------------------
+    def test_signup(self):
+        # No business <select>: the form looks businesses up with business_search
+        self.assertBudget(0, None, self.url('signup'))
+
+    def test_business_search(self):
+        self.assertBudget(2, None, self.url('business_search') + '?q=salon')
+        self.assertBudget(1, None, self.url('business_search') + '?after=Business')
+
+    def test_login(self):
+        self.assertBudget(0, None, self.url('login'))
+
+    def test_logout(self):
+        self.assertBudget(4, self.fixture.client, self.url('logout'), method='post')
+
+    # -------------------------
+    # DASHBOARD
+    # -------------------------
+    def test_dashboard_owner(self):
+        self.assertBudget(6, self.fixture.owner, self.url('dashboard'))
+
+    def test_dashboard_client(self):
+        self.assertBudget(6, self.fixture.client, self.url('dashboard'))
+
+    # -------------------------
+    # BUSINESS
+    # -------------------------
+    def test_create_business_owner(self):
+        self.assertBudget(3, self.fixture.owner, self.url('create_business'))
+
+    def test_business_detail_owner(self):
+        self.assertBudget(6, self.fixture.owner, self.url('business_detail', self.fixture.business.id))
+
+    def test_business_detail_client(self):
+        self.assertBudget(6, self.fixture.client, self.url('business_detail', self.fixture.business.id))
+
+    def test_business_month(self):
+        def url():
+            cache.clear()  # measure the uncached month
+            month = self.fixture.next_date.strftime('%Y-%m')
+            return self.url('business_month', self.fixture.business.id) + f'?month={month}'
+        self.assertBudget(5, self.fixture.client, url)
+
+    def test_business_analytics(self):
+        def url():
+            rebuild_rollups()  # the fixture is bulk-created, without change feed events
+            month = self.fixture.next_date.strftime('%Y-%m')
+            return self.url('business_analytics', self.fixture.business.id) + f'?month={month}'
+        self.assertBudget(6, self.fixture.owner, url)
+
+    def test_business_closures(self):
+        self.assertBudget(6, self.fixture.owner, self.url('business_closures', self.fixture.business.id))
+
+    def test_business_history_export(self):
+        self.assertBudget(6, self.fixture.owner, self.url('business_history_export', self.fixture.business.id))
+
+    def test_business_list_owner(self):
+        self.assertBudget(4, self.fixture.owner, self.url('business_list'))
+
+    def test_business_list_client(self):
+        self.assertBudget(4, self.fixture.client, self.url('business_list'))
+        self.assertBudget(5, self.fixture.client, self.url('business_list') + '?q=salon')
+
+    # -------------------------
+    # DAY MANAGEMENT
+    # -------------------------
+    def test_create_day_owner(self):
+        self.assertBudget(4, self.fixture.owner, self.url('create_day', self.fixture.business.id))
+
+    def test_day_detail_owner(self):
+        day = self.first_day(self.fixture.business)
+        self.assertBudget(6, self.fixture.owner, self.url('day_detail', day.id))
+
+    def test_day_detail_client(self):
+        day = self.first_day(self.fixture.business)
+        self.assertBudget(6, self.fixture.client, self.url('day_detail', day.id))
+
+    # -------------------------
+    # SLOT GENERATION
+    # -------------------------
+    def test_generate_slots_owner(self):
+        day = self.first_day(self.fixture.business)
+        # + the staff choices of the form
+        self.assertBudget(6, self.fixture.owner, self.url('generate_slots', day.id))
+
+    def test_generate_slots_staff(self):
+        day = self.first_day(self.fixture.business)
+        self.assertBudget(5, self.fixture.staff, self.url('generate_slots', day.id))
+
+    # -------------------------
+    # APPOINTMENT BOOKING
+    # -------------------------
+    def test_book_slot_confirm_client(self):
+        def url():
+            return self.url('book_slot', self.fixture.free_slot(self.fixture.other_business, self.fixture.client).id)
+        self.assertBudget(5, self.fixture.client, url)
+
+    def test_book_slot_client(self):
+        def url():
+            return self.url('book_slot', self.fixture.free_slot(self.fixture.other_business, self.fixture.client).id)
+        self.assertBudget(12, self.fixture.client, url, method='post')
+
+    def test_cancel_booking_client(self):
+        def url():
+            return self.url('cancel_booking', self.fixture.client_booking(self.fixture.business).slot_id)
+        self.assertBudget(10, self.fixture.client, url, method='post')
+
+    def test_cancel_booking_owner(self):
+        def url():
+            return self.url('cancel_booking', self.fixture.client_booking(self.fixture.business).slot_id)
+        self.assertBudget(10, self.fixture.owner, url, method='post')
+
+    # -------------------------
+    # OWNER DASHBOARD / STAFF MANAGEMENT
+    # -------------------------
+    def test_owner_dashboard(self):
+        self.assertBudget(5, self.fixture.owner, self.url('owner_dashboard', self.fixture.business.id))
+
+    def test_add_staff(self):
+        self.assertBudget(4, self.fixture.owner, self.url('add_staff', self.fixture.business.id))
+
+    def test_remove_staff(self):
+        url = self.url('remove_staff', self.fixture.business.id, self.fixture.staff.id)
+        self.assertBudget(7, self.fixture.owner, url)
+
+    def test_owner_permissions(self):
+        self.assertBudget(6, self.fixture.owner, self.url('owner_permissions', self.fixture.business.id))
+
+    # -------------------------
+    # STAFF VIEW
+    # -------------------------
+    def test_business_detail_staff_owner(self):
+        self.assertBudget(7, self.fixture.owner, self.url('business_detail_staff', self.fixture.business.id))
+
+    def test_business_detail_staff_staff(self):
+        self.assertBudget(8, self.fixture.staff, self.url('business_detail_staff', self.fixture.business.id))
+
+    # -------------------------
+    # ASYNC READ API
+    # -------------------------
+    def test_api_business_list(self):
+        self.assertBudget(5, self.fixture.client, self.url('api_business_list'))
+
+    def test_api_business_availability(self):
+        self.assertBudget(4, self.fixture.client, self.url('api_business_availability', self.fixture.business.id))
+
+    def test_api_day_availability(self):
+        day = self.first_day(self.fixture.business)
+        self.assertBudget(4, self.fixture.client, self.url('api_day_availability', day.id))
+
+    def test_api_slot_search(self):
+        self.assertBudget(3, self.fixture.client, self.url('api_slot_search') + f'?business={self.fixture.business.id}')
+
+    # -------------------------
+    # ADMIN
+    # -------------------------
+    def admin_user(self):
+        return User.objects.create(username='admin', is_staff=True, is_superuser=True)
+
+    def test_admin_changelists(self):
+        admin_user = self.admin_user()
+        for model, budget in (('business', 5), ('day', 7), ('timeslot', 7), ('appointment', 7)):
+            with self.subTest(model=model):
+                self.assertBudget(budget, admin_user, reverse(f'admin:appointment_{model}_changelist'))
+
+    def test_admin_day_change_form(self):
+        day = self.first_day(self.fixture.business)
+        # The content type is cached per process; do not count it
+        ContentType.objects.get_for_model(Day)
+        self.assertBudget(6, self.admin_user(), reverse('admin:appointment_day_change', args=[day.id]))
+
+    # -------------------------
+    # LIVE AVAILABILITY (SSE)
+    # -------------------------
+    def test_day_events(self):
+        day = self.first_day(self.fixture.business)
+        self.assertBudget(4, self.fixture.client, self.url('day_events', day.id))
+
+    def test_business_events(self):
+        self.assertBudget(4, self.fixture.client, self.url('business_events', self.fixture.business.id))
+
+
+class AsyncApiTests(TestCase):
+    def setUp(self):
+        self.fixture = ScheduleFixture()
+        self.fixture.grow()
+        self.client.force_login(self.fixture.client)
+
+    def test_day_availability_lists_free_slots(self):
+        day = self.fixture.business.days.order_by('date').first()
+        data = self.client.get(reverse('calendar:api_day_availability', args=[day.id])).json()
+        free = TimeSlot.objects.filter(day=day, is_booked=False).order_by('start')
+        self.assertEqual([s['id'] for s in data['slots']], [s.id for s in free])
+
+    def test_business_availability_counts_free_slots(self):
+        data = self.client.get(reverse('calendar:api_business_availability', args=[self.fixture.business.id])).json()
+        for row in data['days']:
+            self.assertEqual(row['available_slots'], TimeSlot.objects.filter(day_id=row['id'], is_booked=False).count())
+
+    def test_slot_search_filters(self):
+        day = self.fixture.business.days.order_by('date').first()
+        response = self.client.get(reverse('calendar:api_slot_search'), {
+            'business': self.fixture.business.id, 'date_from': day.date, 'date_to': day.date, 'limit': 3,
+        })
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(r['day'] == day.id and r['business'] == self.fixture.business.id for r in results))
+
+    def test_slot_search_all_businesses(self):
+        response = self.client.get(reverse('calendar:api_slot_search'), {'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 10)
+
+        # Without ?business= (or with it blank or malformed) every business is searched
+        everywhere = self.client.get(reverse('calendar:api_slot_search'), {'limit': 200}).json()['results']
+        self.assertGreater(len({r['business'] for r in everywhere}), 1)
+        for business in ('', 'dentist'):
+            response = self.client.get(reverse('calendar:api_slot_search'), {'business': business, 'limit': 200})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['results'], everywhere)
+
+    def test_slot_search_bad_date(self):
+        response = self.client.get(reverse('calendar:api_slot_search'), {'date_from': 'tomorrow'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.client.get(reverse('calendar:api_business_list'))
+        self.assertEqual(response.status_code, 302)
+
+
+# -------------------------
+# LIVE AVAILABILITY
+# -------------------------
+class RecordingHub:
+    """APPOINTMENT_LIVE_BACKEND for tests: keeps what was published."""
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, event, data):
+        # One slot, or the slots of a set-based change
+        self.published.append((channel, event, data['slot'] if 'slot' in data else data['slots']))
+
+
+class LiveHubTests(SimpleTestCase):
+    async def test_local_hub_fans_out_across_threads(self):
+        hub = LocalHub()
+        first = await hub.subscribe('day:1')
+        second = await hub.subscribe('day:1')
+        await asyncio.to_thread(hub.publish, 'day:1', 'slot_booked', {'slot': 7})
+        await asyncio.to_thread(hub.publish, 'day:2', 'slot_booked', {'slot': 8})
+
+        for subscription in (first, second):
+            self.assertEqual(await subscription.get(1), (1, 'slot_booked', {'slot': 7}))
+            self.assertIsNone(await subscription.get(0.01))
+            subscription.close()
+        self.assertFalse(hub.subscribers)
+
+    async def test_cache_hub_resumes_from_last_event_id(self):
+        hub = CacheHub(poll_interval=0.01)
+        hub.publish('test:resume', 'slot_booked', {'slot': 1})
+        live = await hub.subscribe('test:resume')
+        hub.publish('test:resume', 'slot_freed', {'slot': 1})
+
+        self.assertEqual((await live.get(1))[1:], ('slot_freed', {'slot': 1}))
+        self.assertIsNone(await live.get(0.02))
+
+        resumed = await hub.subscribe('test:resume', last_id=0)
+        self.assertEqual([(await resumed.get(1))[1] for _ in range(2)], ['slot_booked', 'slot_freed'])
+
+    @override_settings(APPOINTMENT_LIVE_HEARTBEAT=0.01)
+    async def test_event_stream_keepalive_and_unsubscribe(self):
+        hub = LocalHub()
+        stream = event_stream(await hub.subscribe('day:1'), {'free_slots': []})
+        self.assertIn('event: snapshot', await anext(stream))
+        self.assertEqual(await anext(stream), ': keepalive\n\n')
+        hub.publish('day:1', 'slot_freed', {'slot': 3})
+        self.assertEqual(await anext(stream), 'id: 1\nevent: slot_freed\ndata: {"slot": 3}\n\n')
+        await stream.aclose()
+        self.assertFalse(hub.subscribers)
+
+
+@override_settings(APPOINTMENT_LIVE_BACKEND='appointment.tests.RecordingHub')
+class LiveAvailabilityTests(TestCase):
+    def setUp(self):
+        self.fixture = ScheduleFixture()
+        self.fixture.grow()
+        self.day = self.fixture.business.days.order_by('date').first()
+        self.hub = get_hub()
+        self.hub.published.clear()
+
+    def test_booking_and_cancelling_publish_after_commit(self):
+        slot = self.fixture.free_slot(self.fixture.other_business, self.fixture.client)
+        self.client.force_login(self.fixture.client)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('calendar:book_slot', args=[slot.id]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('calendar:cancel_booking', args=[slot.id]))
+
+        day, business = slot.day_id, self.fixture.other_business.id
+        self.assertEqual(self.hub.published, [
+            (day_channel(day), 'slot_booked', slot.id),
+            (business_channel(business), 'slot_booked', slot.id),
+            (day_channel(day), 'slot_freed', slot.id),
+            (business_channel(business), 'slot_freed', slot.id),
+        ])
+
+    def test_wsgi_gets_snapshot_only(self):
+        self.client.force_login(self.fixture.client)
+        response = self.client.get(reverse('calendar:day_events', args=[self.day.id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertFalse(response.streaming)
+        retry, snapshot = response.content.decode().strip().split('\n\n')
+        self.assertTrue(retry.startswith('retry: '))
+        free = list(TimeSlot.objects.filter(day=self.day, is_booked=False).order_by('start').values_list('id', flat=True))
+        self.assertEqual(json.loads(snapshot.split('data: ')[1])['free_slots'], free)
+
+    @override_settings(APPOINTMENT_LIVE_BACKEND='appointment.live.LocalHub')
+    async def test_asgi_streams_published_events(self):
+        await self.async_client.aforce_login(self.fixture.client)
+        response = await self.async_client.get(reverse('calendar:day_events', args=[self.day.id]))
+        self.assertTrue(response.streaming)
+        stream = aiter(response.streaming_content)
+        start = (await anext(stream)).decode()
+        self.assertIn('event: snapshot', start)
+
+        get_hub().publish(day_channel(self.day.id), 'slot_booked', {'slot': 42})
+        event = (await anext(stream)).decode()
+        self.assertIn('event: slot_booked', event)
+        self.assertIn('"slot": 42', event)
+        await stream.aclose()
+
+    @override_settings(APPOINTMENT_LIVE_BACKEND='appointment.live.LocalHub')
+    async def test_asgi_unsubscribes_without_streaming(self):
+        await self.async_client.aforce_login(self.fixture.client)
+        url = reverse('calendar:business_events', args=[self.fixture.business.id])
+        with mock.patch('appointment.views.days_with_free_slots', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                await self.async_client.get(url)
+        self.assertFalse(get_hub().subscribers)
+
+        # Closed before the first chunk was read
+        response = await self.async_client.get(url)
+        self.assertTrue(get_hub().subscribers)
+        response.close()
+        self.assertFalse(get_hub().subscribers)
+
+
+# -------------------------
+# SLOT CAPACITY
+# -------------------------
+class SlotCapacityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        UserProfile.objects.create(user=cls.owner, role='owner')
+        cls.clients = []
+        for i in range(3):
+            user = User.objects.create(username=f'client{i}')
+            UserProfile.objects.create(user=user, role='client')
+            cls.clients.append(user)
+        cls.business = Business.objects.create(name='Yoga', owner=cls.owner)
+        cls.day = Day.objects.create(business=cls.business, date=date.today() + timedelta(days=1))
+
+    def setUp(self):
+        self.slot = TimeSlot.objects.create(day=self.day, start=time(9, 0), end=time(10, 0), capacity=2)
+
+    def book(self, user):
+        self.client.force_login(user)
+        return self.client.post(reverse('calendar:book_slot', args=[self.slot.id]))
+
+    def test_reserve_until_full(self):
+        self.assertTrue(self.slot.reserve())
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.booked, self.slot.is_booked), (1, False))
+        self.assertTrue(self.slot.reserve())
+        self.assertFalse(self.slot.reserve())
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.booked, self.slot.is_booked), (2, True))
+
+    def test_bookings_share_a_slot(self):
+        self.book(self.clients[0])
+        self.book(self.clients[1])
+        self.book(self.clients[2])
+        self.slot.refresh_from_db()
+        self.assertEqual(self.slot.appointments.count(), 2)
+        self.assertEqual((self.slot.booked, self.slot.is_booked), (2, True))
+        self.assertFalse(self.slot.appointments.filter(client=self.clients[2]).exists())
+
+    def test_cancel_gives_place_back(self):
+        self.book(self.clients[0])
+        self.book(self.clients[1])
+        self.client.post(reverse('calendar:cancel_booking', args=[self.slot.id]))
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.booked, self.slot.is_booked), (1, False))
+        self.assertEqual(list(self.slot.appointments.values_list('client', flat=True)), [self.clients[0].id])
+
+    def test_owner_cancels_posted_appointment(self):
+        self.book(self.clients[0])
+        self.book(self.clients[1])
+        second = self.slot.appointments.get(client=self.clients[1])
+        self.client.force_login(self.owner)
+        self.client.post(reverse('calendar:cancel_booking', args=[self.slot.id]), {'appointment': second.id})
+        self.assertEqual(list(self.slot.appointments.values_list('client', flat=True)), [self.clients[0].id])
+
+    def test_booked_cannot_exceed_capacity(self):
+        self.assertTrue(self.slot.reserve())
+        self.assertTrue(self.slot.reserve())
+        self.slot.capacity = 1
+        with self.assertRaises(ValidationError):
+            self.slot.save()
+
+    def test_save_keeps_concurrent_bookings(self):
+        stale = TimeSlot.objects.get(pk=self.slot.pk)
+        self.assertTrue(self.slot.reserve())
+        self.assertTrue(self.slot.reserve())
+        # An edit made from a copy read before the bookings
+        stale.capacity = 3
+        stale.save()
+        self.assertEqual((stale.booked, stale.is_booked), (2, False))
+        stale.capacity = 2
+        stale.save()
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.booked, self.slot.is_booked), (2, True))
+
+    def test_generate_with_capacity(self):
+        day = Day.objects.create(business=self.business, date=date.today() + timedelta(days=2))
+        self.assertEqual(generate_time_slots(day, time(9, 0), time(11, 0), 60, capacity=6), 2)
+        self.assertEqual(set(day.slots.values_list('capacity', flat=True)), {6})
+
+    def test_book_slot_service(self):
+        appointment = book_slot(self.clients[0], self.slot.id)
+        self.assertEqual(appointment.slot_id, self.slot.id)
+        with self.assertRaises(ValidationError):
+            book_slot(self.clients[0], self.slot.id)
+
+
+class SlotDatetimeTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create(username='owner')
+        self.day = Day.objects.create(business=Business.objects.create(name='Clinic', owner=owner), date=date(2031, 3, 4))
+
+    def test_datetimes_follow_day_and_times(self):
+        slot = TimeSlot.objects.create(day=self.day, start=time(9, 0), end=time(9, 45))
+        self.assertEqual(timezone.localtime(slot.start_at).replace(tzinfo=None), datetime(2031, 3, 4, 9, 0))
+        self.assertEqual(slot.end_at - slot.start_at, timedelta(minutes=45))
+
+    def test_business_copied_from_day_and_slot(self):
+        client = User.objects.create(username='client')
+        UserProfile.objects.create(user=client, role='client')
+        slot = TimeSlot.objects.create(day=self.day, start=time(9, 0), end=time(9, 45))
+        appointment = Appointment.objects.create(client=client, slot=slot)
+        self.assertEqual((slot.business_id, appointment.business_id), (self.day.business_id, self.day.business_id))
+
+        other = Business.objects.create(name='Other', owner=client)
+        TimeSlot.objects.update(business=other)
+        Appointment.objects.update(business=other)
+        migration = import_module('appointment.migrations.0008_denormalized_business')
+        migration.copy_business_ids(apps, SimpleNamespace(connection=connection))
+        slot.refresh_from_db()
+        appointment.refresh_from_db()
+        self.assertEqual((slot.business_id, appointment.business_id), (self.day.business_id, self.day.business_id))
+
+    def test_migration_backfill(self):
+        slot = TimeSlot.objects.create(day=self.day, start=time(14, 0), end=time(15, 0))
+        expected = (slot.start_at, slot.end_at)
+        TimeSlot.objects.filter(pk=slot.pk).update(start_at=timezone.now(), end_at=timezone.now())
+        migration = import_module('appointment.migrations.0007_timeslot_datetimes')
+        migration.fill_datetimes(apps, SimpleNamespace(connection=connection))
+        slot.refresh_from_db()
+        self.assertEqual((slot.start_at, slot.end_at), expected)
+
+
+class StaffAssignmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        UserProfile.objects.create(user=cls.owner, role='owner')
+        cls.business = Business.objects.create(name='Stylists', owner=cls.owner)
+        cls.staff = []
+        cls.clients = []
+        for i in range(3):
+            stylist = User.objects.create(username=f'stylist{i}')
+            BusinessStaff.objects.create(user=stylist, business=cls.business)
+            cls.staff.append(stylist)
+        for i in range(4):
+            user = User.objects.create(username=f'client{i}')
+            UserProfile.objects.create(user=user, role='client')
+            cls.clients.append(user)
+        cls.day = Day.objects.create(business=cls.business, date=date.today() + timedelta(days=1))
+        for stylist in cls.staff:
+            generate_time_slots(cls.day, time(9, 0), time(11, 0), 60, staff=stylist)
+
+    def test_staff_calendars_run_in_parallel(self):
+        self.assertEqual(self.day.slots.filter(start=time(9, 0)).count(), 3)
+        with self.assertRaises(ValidationError):
+            TimeSlot.objects.create(day=self.day, start=time(9, 30), end=time(10, 30), staff=self.staff[0])
+
+    def test_least_loaded_staff_first(self):
+        TimeSlot.objects.get(day=self.day, start=time(10, 0), staff=self.staff[0]).reserve()
+        with self.assertNumQueries(1):
+            candidates = list(free_staff_slots(self.day, time(9, 0)))
+        self.assertEqual([slot.staff for slot in candidates], [self.staff[1], self.staff[2], self.staff[0]])
+        self.assertEqual([slot.load for slot in candidates], [0, 0, 1])
+
+        assigned = [book_free_staff(client, self.day, time(9, 0)).slot.staff for client in self.clients[:3]]
+        self.assertEqual(assigned, [self.staff[1], self.staff[2], self.staff[0]])
+        with self.assertRaises(ValidationError):
+            book_free_staff(self.clients[3], self.day, time(9, 0))
+
+    def test_combined_availability(self):
+        day = days_with_free_slots().get(pk=self.day.pk)
+        self.assertEqual((day.available_slots, day.available_places), (6, 6))
+
+        self.client.force_login(self.clients[0])
+        response = self.client.get(reverse('calendar:day_detail', args=[self.day.id]))
+        self.assertEqual([entry['free'] for entry in response.context['staff_times']], [3, 3])
+
+    def test_book_any_staff_view(self):
+        self.client.force_login(self.clients[0])
+        self.client.post(reverse('calendar:book_any_staff', args=[self.day.id]), {'start': '10:00'})
+        appointment = Appointment.objects.get(client=self.clients[0])
+        self.assertEqual((appointment.slot.start, appointment.slot.staff), (time(10, 0), self.staff[0]))
+
+
+# -------------------------
+# BULK OPERATIONS
+# -------------------------
+class BulkOperationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        cls.clients = [User.objects.create(username=f'client{i}') for i in range(3)]
+        for user in cls.clients:
+            UserProfile.objects.create(user=user, role='client')
+        cls.business = Business.objects.create(name='Gym', owner=cls.owner)
+        cls.day = Day.objects.create(business=cls.business, date=date.today() + timedelta(days=1))
+        generate_time_slots(cls.day, time(9, 0), time(12, 0), 60, capacity=2)
+
+    def slots(self):
+        return TimeSlot.objects.filter(day=self.day).order_by('start')
+
+    def test_block_skips_booked_slots(self):
+        first = self.slots()[0]
+        Appointment.objects.create(client=self.clients[0], slot=first)
+        # In a savepoint: the slots for the change feed event, its INSERT, the UPDATE
+        with self.assertNumQueries(5):
+            self.assertEqual(block_slots(self.slots()), 2)
+        event = ScheduleEvent.objects.get(kind='slots_blocked')
+        self.assertEqual(event.data['slots'], [slot.id for slot in self.slots()[1:]])
+        self.assertEqual(list(self.slots().values_list('is_blocked', flat=True)), [False, True, True])
+        self.assertEqual(days_with_free_slots().get(pk=self.day.pk).available_places, 1)
+        self.assertFalse(self.slots()[1].reserve())
+
+        with self.assertNumQueries(5):
+            self.assertEqual(unblock_slots(self.slots()), 2)
+        self.assertEqual(days_with_free_slots().get(pk=self.day.pk).available_places, 5)
+
+    def test_cancel_appointments(self):
+        first, second = self.slots()[:2]
+        for client in self.clients[:2]:
+            Appointment.objects.create(client=client, slot=first)
+        Appointment.objects.create(client=self.clients[2], slot=second)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            cancelled = cancel_appointments(Appointment.objects.filter(slot__day=self.day))
+        self.assertEqual(cancelled, 3)
+        # One heatmap invalidation, one slot_freed event per slot
+        self.assertEqual(len(callbacks), 3)
+        self.assertFalse(Appointment.objects.exists())
+        self.assertEqual(
+            list(self.slots().values_list('booked', 'is_booked')), [(0, False), (0, False), (0, False)],
+        )
+
+    def test_admin_cancels_instead_of_deleting(self):
+        Appointment.objects.create(client=self.clients[0], slot=self.slots()[0])
+        admin_user = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        url = reverse('admin:appointment_appointment_changelist')
+        actions = dict(self.client.get(url).context['action_form'].fields['action'].choices)
+        self.assertNotIn('delete_selected', actions)
+        self.assertIn('cancel_action', actions)
+
+        self.client.post(url, {'action': 'cancel_action', '_selected_action': list(Appointment.objects.values_list('id', flat=True))})
+        self.assertFalse(Appointment.objects.exists())
+        self.assertEqual((self.slots()[0].booked, self.slots()[0].is_booked), (0, False))
+
+    def test_estimated_changelist_count(self):
+        admin_user = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        url = reverse('admin:appointment_timeslot_changelist')
+        with mock.patch.object(appointment_admin, 'ESTIMATE_THRESHOLD', 1), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertFalse([q for q in queries.captured_queries if 'COUNT(' in q['sql']])
+
+
+# -------------------------
+# CLOSURES
+# -------------------------
+class ClosureTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        UserProfile.objects.create(user=cls.owner, role='owner')
+        cls.staff = User.objects.create(username='staff')
+        UserProfile.objects.create(user=cls.staff, role='client')
+        cls.clients = [User.objects.create(username=f'client{i}') for i in range(2)]
+        for user in cls.clients:
+            UserProfile.objects.create(user=user, role='client')
+        cls.business = Business.objects.create(name='Dentist', owner=cls.owner)
+        BusinessStaff.objects.create(user=cls.staff, business=cls.business)
+        cls.day = Day.objects.create(business=cls.business, date=date.today() + timedelta(days=1))
+        generate_time_slots(cls.day, time(9, 0), time(13, 0), 60, capacity=2)
+
+    def slots(self):
+        return TimeSlot.objects.filter(day=self.day, staff=None).order_by('start')
+
+    def period(self, start, end):
+        return slot_datetime(self.day.date, start), slot_datetime(self.day.date, end)
+
+    def test_close_blocks_slots_and_reports_bookings(self):
+        booking = Appointment.objects.create(client=self.clients[0], slot=self.slots()[0])
+        with CaptureQueriesContext(connection) as queries:
+            closures, blocked, conflicts = close_business(self.business, [self.period(time(9, 0), time(11, 0))], reason='Holiday')
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "appointment_timeslot"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual((len(closures), blocked), (1, 2))
+        self.assertEqual(conflicts, [booking])
+
+        # Gone from every availability read, bookings kept
+        self.assertEqual(list(self.slots().values_list('is_blocked', flat=True)), [True, True, False, False])
+        self.assertEqual(days_with_free_slots().get(pk=self.day.pk).available_places, 4)
+        self.assertEqual(month_availability(self.business, self.day.date.year, self.day.date.month)[0]['free'], 2)
+        self.client.force_login(self.clients[1])
+        data = self.client.get(reverse('calendar:api_day_availability', args=[self.day.id])).json()
+        self.assertEqual([slot['id'] for slot in data['slots']], [slot.id for slot in self.slots()[2:]])
+        self.assertFalse(self.slots()[0].reserve())
+
+        # A cancelled conflict does not reopen its slot
+        booking.delete()
+        self.assertTrue(self.slots()[0].is_booked)
+
+    def test_staff_closure_covers_their_calendar_only(self):
+        generate_time_slots(self.day, time(9, 0), time(11, 0), 60, staff=self.staff)
+        _, blocked, _ = close_business(self.business, [self.period(time(9, 0), time(13, 0))], staff=self.staff)
+        self.assertEqual(blocked, 2)
+        self.assertFalse(self.slots().filter(is_blocked=True).exists())
+
+    def test_generators_honor_closures(self):
+        close_business(self.business, [self.period(time(10, 0), time(11, 0))])
+        regenerate_slots(self.day, time(8, 0), time(13, 0), 60)
+        self.assertEqual(
+            list(self.slots().values_list('start', 'is_blocked')),
+            [(time(8, 0), False), (time(9, 0), False), (time(10, 0), True), (time(11, 0), False), (time(12, 0), False)],
+        )
+        other_day = Day.objects.create(business=self.business, date=self.day.date + timedelta(days=1))
+        close_business(self.business, [(slot_datetime(other_day.date, time.min), slot_datetime(other_day.date, time.max))])
+        generate_time_slots(other_day, time(9, 0), time(11, 0), 60)
+        self.assertTrue(all(TimeSlot.objects.filter(day=other_day).values_list('is_booked', flat=True)))
+
+    def test_reopen_keeps_slots_another_closure_covers(self):
+        Appointment.objects.create(client=self.clients[0], slot=self.slots()[1])
+        (first,), _, _ = close_business(self.business, [self.period(time(9, 0), time(12, 0))])
+        (second,), _, _ = close_business(self.business, [self.period(time(11, 0), time(13, 0))])
+
+        self.assertEqual(reopen_closure(first), 2)
+        self.assertEqual(
+            list(self.slots().values_list('is_blocked', 'is_booked')),
+            [(False, False), (False, False), (True, True), (True, True)],
+        )
+        self.assertEqual(reopen_closure(second), 2)
+        self.assertFalse(Closure.objects.exists())
+        self.assertFalse(self.slots().filter(is_booked=True).exists())
+
+    def test_reopen_leaves_slots_blocked_by_hand(self):
+        block_slots(self.slots().filter(start=time(10, 0)))
+        (closure,), blocked, _ = close_business(self.business, [self.period(time(9, 0), time(12, 0))])
+        self.assertEqual(blocked, 2)
+
+        self.assertEqual(reopen_closure(closure), 2)
+        self.assertEqual(list(self.slots().values_list('is_blocked', flat=True)), [False, True, False, False])
+
+    @override_settings(APPOINTMENT_LIVE_BACKEND='appointment.tests.RecordingHub')
+    def test_close_and_reopen_publish_after_commit(self):
+        hub = get_hub()
+        hub.published.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            (closure,), _, _ = close_business(self.business, [self.period(time(9, 0), time(11, 0))])
+        slot_ids = [slot.id for slot in self.slots()[:2]]
+        with self.captureOnCommitCallbacks(execute=True):
+            reopen_closure(closure)
+
+        channels = [day_channel(self.day.id), business_channel(self.business.id)]
+        self.assertEqual(hub.published, [
+            *[(channel, 'slots_blocked', slot_ids) for channel in channels],
+            *[(channel, 'slots_unblocked', slot_ids) for channel in channels],
+        ])
+
+    def test_close_and_reopen_views(self):
+        Appointment.objects.create(client=self.clients[0], slot=self.slots()[0])
+        self.client.force_login(self.owner)
+        url = reverse('calendar:business_closures', args=[self.business.id])
+        response = self.client.post(url, {
+            'start_date': self.day.date, 'end_date': self.day.date, 'start_time': '09:00', 'end_time': '10:00',
+            'reason': 'Dentist away',
+        }, follow=True)
+        texts = [str(message) for message in response.context['messages']]
+        self.assertEqual(texts[0], "Closed: 1 slots taken out of availability.")
+        self.assertIn("1 bookings fall in the closure: client0", texts[1])
+        closure = Closure.objects.get()
+        self.assertEqual(list(response.context['closures']), [closure])
+
+        response = self.client.post(url, {'start_date': self.day.date, 'end_date': self.day.date, 'start_time': '09:00'})
+        self.assertFormError(response.context['form'], None, "Give both times, or neither to close whole days.")
+
+        self.client.post(reverse('calendar:reopen_business_closure', args=[self.business.id, closure.id]))
+        self.assertFalse(Closure.objects.exists())
+        self.assertFalse(self.slots()[0].is_blocked)
+
+
+# -------------------------
+# REMINDERS
+# -------------------------
+class ReminderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        cls.business = Business.objects.create(name='Dentist', owner=cls.owner)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        cls.day = Day.objects.create(business=cls.business, date=cls.tomorrow)
+        today = Day.objects.create(business=cls.business, date=timezone.localdate())
+        generate_time_slots(cls.day, time(9, 0), time(11, 0), 60, capacity=2)
+        generate_time_slots(today, time(9, 0), time(10, 0), 60)
+        slots = list(TimeSlot.objects.filter(day=cls.day).order_by('start'))
+        for i, slot in enumerate([slots[0], slots[0], slots[1], slots[1], today.slots.get()]):
+            user = User.objects.create(username=f'client{i}', email='' if i == 3 else f'client{i}@example.com')
+            UserProfile.objects.create(user=user, role='client')
+            Appointment.objects.create(client=user, slot=slot)
+
+    def test_batched_and_idempotent(self):
+        # Two batches of select + update, then the empty select
+        with self.assertNumQueries(5):
+            self.assertEqual(send_reminders(self.tomorrow, batch_size=2), 3)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [f'client{i}@example.com' for i in range(3)])
+        self.assertIn('Dentist', mail.outbox[0].subject)
+        self.assertIn('09:00', mail.outbox[0].body)
+        self.assertEqual(Appointment.objects.filter(reminder_sent_at__isnull=False).count(), 3)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(send_reminders(self.tomorrow), 0)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_one_connection(self):
+        connection = mail.get_connection()
+        with mock.patch.object(connection, 'open', wraps=connection.open) as opened:
+            send_reminders(self.tomorrow, batch_size=1, connection=connection)
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('send_reminders', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue(), f"3 reminders due for {self.tomorrow}.\n")
+        call_command('send_reminders', stdout=out)
+        self.assertEqual(len(mail.outbox), 3)
+
+
+# -------------------------
+# MONTH HEATMAP
+# -------------------------
+class MonthAvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        cls.client_user = User.objects.create(username='client')
+        UserProfile.objects.create(user=cls.client_user, role='client')
+        cls.business = Business.objects.create(name='Clinic', owner=cls.owner)
+        cls.first = (timezone.localdate().replace(day=1) + timedelta(days=32)).replace(day=1)
+        for offset in (0, 1, 30):
+            day = Day.objects.create(business=cls.business, date=cls.first + timedelta(days=offset))
+            generate_time_slots(day, time(9, 0), time(11, 0), 60, capacity=2)
+
+    def setUp(self):
+        cache.clear()
+
+    def month(self):
+        return month_availability(self.business, self.first.year, self.first.month)
+
+    def test_one_grouped_query_then_cached(self):
+        with self.assertNumQueries(1):
+            rows = self.month()
+        in_month = [self.first, self.first + timedelta(days=1)]
+        if (self.first + timedelta(days=30)).month == self.first.month:
+            in_month.append(self.first + timedelta(days=30))
+        self.assertEqual([row['date'] for row in rows], in_month)
+        self.assertEqual((rows[0]['total'], rows[0]['free'], rows[0]['free_places']), (2, 2, 4))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.month(), rows)
+
+    def test_booking_invalidates(self):
+        self.month()
+        slot = TimeSlot.objects.filter(day__date=self.first).order_by('start').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(client=self.client_user, slot=slot)
+            TimeSlot.objects.get(pk=slot.pk).reserve()
+        with self.assertNumQueries(1):
+            row = self.month()[0]
+        self.assertEqual((row['free'], row['free_places']), (1, 2))
+
+    def test_view(self):
+        self.client.force_login(self.client_user)
+        response = self.client.get(
+            reverse('calendar:business_month', args=[self.business.id]), {'month': self.first.strftime('%Y-%m')}
+        )
+        cells = {cell['date']: cell for week in response.context['weeks'] for cell in week}
+        self.assertEqual(cells[self.first]['level'], 4)
+        self.assertIsNone(cells[self.first + timedelta(days=2)]['row'])
+        self.assertContains(response, reverse('calendar:day_detail', args=[cells[self.first]['row']['day']]))
+
+    def test_months_at_the_ends_of_the_calendar(self):
+        self.assertEqual(month_availability(self.business, 9999, 12), [])
+        UserProfile.objects.create(user=self.owner, role='owner')
+        current = timezone.localdate().replace(day=1)
+        for user, name in ((self.client_user, 'business_month'), (self.owner, 'business_analytics')):
+            self.client.force_login(user)
+            for month in ('9999-12', '0001-01'):
+                response = self.client.get(reverse(f'calendar:{name}', args=[self.business.id]), {'month': month})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['month'], current)
+
+
+# -------------------------
+# BUSINESS SEARCH
+# -------------------------
+class BusinessSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        cls.salon = Business.objects.create(name='Salon Anna', owner=cls.owner, description='Hair and nails')
+        cls.barber = Business.objects.create(name='Barber Bob', owner=cls.owner, description='Beards')
+        Business.objects.bulk_create([Business(name=f'Studio {i:02d}', owner=cls.owner) for i in range(12)])
+
+    def names(self, text, limit=20, offset=0):
+        return [b.name for b in search_businesses(text, limit, offset)]
+
+    def test_fts_query(self):
+        self.assertEqual(fts_query('hair "sal'), '"hair"* "sal"*')
+        self.assertEqual(fts_query('  -- '), '')
+
+    def test_prefix_search(self):
+        self.assertEqual(self.names('sal'), ['Salon Anna'])
+        self.assertEqual(self.names('hair sal'), ['Salon Anna'])  # description words count too
+        self.assertEqual(self.names('bo'), ['Barber Bob'])
+        self.assertEqual(self.names('sal bob'), [])
+        self.assertEqual(self.names('"'), [])
+
+    def test_signals_keep_index_in_step(self):
+        self.salon.name = 'Spa Anna'
+        self.salon.save()
+        self.assertEqual(self.names('sal'), [])
+        self.assertEqual(self.names('spa'), ['Spa Anna'])
+        self.barber.delete()
+        self.assertEqual(self.names('barb'), [])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+                # The bulk-created studios skipped the signal
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_search_endpoint_pages(self):
+        rebuild_index()
+        url = reverse('calendar:business_search')
+        data = self.client.get(url, {'q': 'stu', 'limit': 5}).json()
+        seen = [b['name'] for b in data['results']]
+        while data['next']:
+            data = self.client.get(f"{url}?{data['next']}").json()
+            seen += [b['name'] for b in data['results']]
+        self.assertEqual(sorted(seen), [f'Studio {i:02d}' for i in range(12)])
+
+    def test_browse_pages_by_name(self):
+        url = reverse('calendar:business_search')
+        data = self.client.get(url, {'limit': 10}).json()
+        self.assertEqual(data['results'][0]['name'], 'Barber Bob')
+        data = self.client.get(f"{url}?{data['next']}").json()
+        self.assertEqual([b['name'] for b in data['results']], ['Studio 08', 'Studio 09', 'Studio 10', 'Studio 11'])
+        self.assertIsNone(data['next'])
+
+    def test_signup_with_searched_business(self):
+        self.client.post(reverse('calendar:signup'), {
+            'username': 'new', 'email': 'new@example.com', 'password': 'pw', 'role': 'client',
+            'business': self.salon.id,
+        })
+        self.assertEqual(UserProfile.objects.get(user__username='new').business, self.salon)
+
+
+# -------------------------
+# METRICS
+# -------------------------
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.fixture = ScheduleFixture()
+        self.fixture.grow()
+
+    def test_server_timing_header(self):
+        self.client.force_login(self.fixture.owner)
+        response = self.client.get(reverse('calendar:dashboard'))
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'view;dur=', 'py;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        self.assertRegex(timing, r'desc="[1-9]\d* queries"')
+
+    def test_metrics_endpoint(self):
+        self.client.force_login(self.fixture.owner)
+        before = REQUEST_DURATION.count(url_name='calendar:dashboard')
+        b''.join(self.client.get(reverse('calendar:dashboard')).streaming_content)
+        self.assertEqual(REQUEST_DURATION.count(url_name='calendar:dashboard'), before + 1)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE appointment_request_duration_seconds histogram', body)
+        self.assertIn('appointment_request_queries_bucket{url_name="calendar:dashboard",le="+Inf"}', body)
+        self.assertIn('appointment_slots_generated_total', body)
+
+    def test_streamed_page_recorded_once_sent(self):
+        self.client.force_login(self.fixture.owner)
+        name = 'calendar:dashboard'
+        count, queries = REQUEST_QUERIES.count(url_name=name), REQUEST_QUERIES.sum(url_name=name)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse(name))
+            in_view = len(captured)
+            self.assertEqual(REQUEST_QUERIES.count(url_name=name), count)
+            b''.join(response.streaming_content)
+        self.assertIn(f'desc="{in_view} queries"', response['Server-Timing'])
+        # The histograms include the queries the stream ran
+        self.assertGreater(len(captured), in_view)
+        self.assertEqual(REQUEST_QUERIES.count(url_name=name), count + 1)
+        self.assertEqual(REQUEST_QUERIES.sum(url_name=name) - queries, len(captured))
+
+    def test_booking_conflict_counter(self):
+        self.client.force_login(self.fixture.client)
+        booking = self.fixture.client_booking(self.fixture.business)
+        taken = TimeSlot.objects.filter(day=booking.slot.day, is_booked=False).first()
+        before = BOOKING_CONFLICTS.value(reason='client_has_booking')
+        self.client.post(reverse('calendar:book_slot', args=[taken.id]))
+        self.assertEqual(BOOKING_CONFLICTS.value(reason='client_has_booking'), before + 1)
+
+
+# -------------------------
+# RATE LIMITING
+# -------------------------
+class ThrottlingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        cls.clients = []
+        for i in range(2):
+            user = User.objects.create(username=f'client{i}')
+            UserProfile.objects.create(user=user, role='client')
+            cls.clients.append(user)
+        cls.business = Business.objects.create(name='Popular', owner=cls.owner)
+        cls.day = Day.objects.create(business=cls.business, date=date.today() + timedelta(days=1))
+        generate_time_slots(cls.day, time(9, 0), time(10, 0), 60, capacity=10)
+        cls.slot = cls.day.slots.get()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_token_bucket(self):
+        self.assertEqual(take_token('bucket', 2, 60, now=0), 0)
+        self.assertEqual(take_token('bucket', 2, 60, now=0), 0)
+        self.assertEqual(take_token('bucket', 2, 60, now=0), 30)
+        self.assertEqual(take_token('bucket', 2, 60, now=30), 0)
+
+    @override_settings(APPOINTMENT_RATE_LIMITS={'availability': {'user': '2/m'}})
+    def test_user_limit(self):
+        self.client.force_login(self.clients[0])
+        url = reverse('calendar:day_detail', args=[self.day.id])
+        throttled = REQUESTS_THROTTLED.value(rule='availability', scope='user')
+        self.assertEqual([self.client.get(url).status_code for _ in range(3)], [200, 200, 429])
+        # Refused after the session and user lookups, before the view's queries
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(REQUESTS_THROTTLED.value(rule='availability', scope='user'), throttled + 2)
+
+        # Other users have their own bucket
+        self.client.force_login(self.clients[1])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(APPOINTMENT_RATE_LIMITS={'book': {'business': '1/m'}})
+    def test_business_limit_across_users(self):
+        url = reverse('calendar:book_slot', args=[self.slot.id])
+        self.client.force_login(self.clients[0])
+        self.assertEqual(self.client.post(url).status_code, 302)
+        self.client.force_login(self.clients[1])
+        self.assertEqual(self.client.post(url).status_code, 429)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    @override_settings(APPOINTMENT_RATE_LIMITS={'availability': {'ip': '1/s'}})
+    def test_async_view(self):
+        self.client.force_login(self.clients[0])
+        url = reverse('calendar:api_day_availability', args=[self.day.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 429)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_unlimited_by_default(self):
+        self.client.force_login(self.clients[0])
+        url = reverse('calendar:day_detail', args=[self.day.id])
+        self.assertTrue(all(self.client.get(url).status_code == 200 for _ in range(5)))
+
+
+class ConcurrencyLimitMiddlewareTests(SimpleTestCase):
+    def test_sheds_over_the_cap(self):
+        responses = []
+
+        def view(request):
+            # A second request arriving while this one runs
+            if not responses:
+                responses.append(middleware(request))
+            return HttpResponse('ok')
+
+        with self.settings(APPOINTMENT_MAX_CONCURRENT_REQUESTS=1):
+            middleware = ConcurrencyLimitMiddleware(view)
+        shed = REQUESTS_SHED.value()
+        request = RequestFactory().get('/')
+        self.assertEqual(middleware(request).status_code, 200)
+        self.assertEqual((responses[0].status_code, responses[0]['Retry-After']), (503, '1'))
+        self.assertEqual(REQUESTS_SHED.value(), shed + 1)
+        # The slot is free again once the request finished
+        self.assertEqual(middleware(request).status_code, 200)
+
+    def test_streamed_page_holds_its_slot(self):
+        with self.settings(APPOINTMENT_MAX_CONCURRENT_REQUESTS=1):
+            middleware = ConcurrencyLimitMiddleware(lambda request: StreamingHttpResponse(iter(['head', 'days'])))
+        request = RequestFactory().get('/')
+        page = middleware(request)
+        self.assertEqual(middleware(request).status_code, 503)
+        self.assertEqual(b''.join(page.streaming_content), b'headdays')
+        # Sent, or closed before it was
+        unsent = middleware(request)
+        self.assertTrue(unsent.streaming)
+        unsent.close()
+        self.assertTrue(middleware(request).streaming)
+
+    def test_off_by_default(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ConcurrencyLimitMiddleware(lambda request: HttpResponse())
+
+
+# -------------------------
+# GROUP-COMMIT BOOKING
+# -------------------------
+@override_settings(APPOINTMENT_BOOKING_MODE='queue', APPOINTMENT_BOOKING_BATCH_WAIT_MS=20)
+class BookingQueueTests(TransactionTestCase):
+    def setUp(self):
+        owner = User.objects.create(username='owner')
+        self.clients = []
+        for i in range(8):
+            user = User.objects.create(username=f'client{i}')
+            UserProfile.objects.create(user=user, role='client')
+            self.clients.append(user)
+        business = Business.objects.create(name='Concert', owner=owner)
+        self.day = Day.objects.create(business=business, date=date.today() + timedelta(days=1))
+        self.slot = TimeSlot.objects.create(day=self.day, start=time(20, 0), end=time(22, 0), capacity=5)
+
+    def book(self, user):
+        try:
+            return run_booking('default', lambda: Appointment.objects.create(client=user, slot=self.slot))
+        except ValidationError as error:
+            return error
+        finally:
+            connection.close()
+
+    def test_batches_claims_and_reports_each_result(self):
+        batches = BOOKING_BATCH_SIZE.count()
+        with ThreadPoolExecutor(max_workers=len(self.clients)) as pool:
+            results = list(pool.map(self.book, self.clients))
+
+        booked = [r for r in results if isinstance(r, Appointment)]
+        self.assertEqual(len(booked), 5)
+        self.assertTrue(all(str(r) == "['This slot is already booked']" for r in results if r not in booked))
+        self.assertEqual(sorted(a.client_id for a in Appointment.objects.all()), sorted(a.client_id for a in booked))
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.booked, self.slot.is_booked), (5, True))
+        # Fewer transactions than bookings
+        self.assertLess(BOOKING_BATCH_SIZE.count() - batches, len(self.clients))
+
+    def test_inside_a_transaction_books_directly(self):
+        with transaction.atomic():
+            appointment = run_booking('default', lambda: Appointment.objects.create(client=self.clients[0], slot=self.slot))
+            self.assertTrue(Appointment.objects.filter(pk=appointment.pk).exists())
+
+    def test_failed_commit_reports_and_keeps_the_writer(self):
+        with mock.patch('appointment.booking_queue.close_old_connections', side_effect=RuntimeError('disk full')):
+            with self.assertRaisesMessage(RuntimeError, 'disk full'):
+                run_booking('default', lambda: Appointment.objects.create(client=self.clients[0], slot=self.slot))
+        self.assertFalse(Appointment.objects.exists())
+        self.assertIsInstance(self.book(self.clients[1]), Appointment)
+
+    def test_dead_writer_is_replaced(self):
+        writer = get_writer('default')
+        with mock.patch.object(writer.thread, 'is_alive', return_value=False):
+            self.assertIsNot(get_writer('default'), writer)
+        self.assertIsInstance(self.book(self.clients[0]), Appointment)
+
+    def test_booking_view(self):
+        self.client.force_login(self.clients[0])
+        response = self.client.post(reverse('calendar:book_slot', args=[self.slot.id]))
+        self.assertRedirects(response, reverse('calendar:day_detail', args=[self.day.id]), fetch_redirect_response=False)
+        self.assertTrue(Appointment.objects.filter(client=self.clients[0]).exists())
+
+
+# -------------------------
+# CHANGE FEED
+# -------------------------
+class ChangeFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        UserProfile.objects.create(user=cls.owner, role='owner')
+        cls.clients = [User.objects.create(username=f'client{i}') for i in range(2)]
+        for user in cls.clients:
+            UserProfile.objects.create(user=user, role='client')
+        cls.business = Business.objects.create(name='Barber', owner=cls.owner)
+        cls.day = Day.objects.create(business=cls.business, date=date.today() + timedelta(days=1))
+        generate_time_slots(cls.day, time(9, 0), time(11, 0), 30)
+
+    def events(self, **filters):
+        return list(ScheduleEvent.objects.filter(business=self.business, **filters).values_list('kind', flat=True))
+
+    def changes(self, **params):
+        self.client.force_login(self.owner)
+        return self.client.get(reverse('calendar:api_business_changes', args=[self.business.id]), params)
+
+    def test_writes_record_events(self):
+        self.assertEqual(self.events(), ['slot_created'] * 4)
+        slot = TimeSlot.objects.filter(day=self.day).first()
+        appointment = Appointment.objects.create(client=self.clients[0], slot=slot)
+        appointment_id = appointment.id
+        appointment.delete()
+        booked, freed = ScheduleEvent.objects.filter(kind__in=['slot_booked', 'slot_freed'])
+        self.assertEqual((booked.kind, booked.data['places_left'], booked.data['appointment']), ('slot_booked', 0, appointment_id))
+        self.assertEqual((freed.kind, freed.data['places_left']), ('slot_freed', 1))
+
+    def test_failed_booking_records_nothing(self):
+        slot = TimeSlot.objects.filter(day=self.day).first()
+        Appointment.objects.create(client=self.clients[0], slot=slot)
+        with self.assertRaises(ValidationError):
+            Appointment.objects.create(client=self.clients[1], slot=slot)
+        self.assertEqual(self.events(kind='slot_booked'), ['slot_booked'])
+
+    def test_staff_changes(self):
+        staff = User.objects.create(username='staff')
+        UserProfile.objects.create(user=staff, role='client')
+        self.client.force_login(self.owner)
+        self.client.post(reverse('calendar:add_staff', args=[self.business.id]), {'username': 'staff'})
+        generate_time_slots(self.day, time(9, 0), time(10, 0), 30, staff=staff)
+        staff_slots = list(TimeSlot.objects.filter(staff=staff).order_by('id').values_list('id', flat=True))
+        self.client.post(reverse('calendar:remove_staff', args=[self.business.id, staff.id]))
+
+        added, removed, deleted = ScheduleEvent.objects.filter(kind__in=['staff_added', 'staff_removed', 'slots_deleted'])
+        self.assertEqual((added.kind, added.data['user']), ('staff_added', staff.id))
+        self.assertEqual((removed.kind, removed.data['user']), ('staff_removed', staff.id))
+        self.assertEqual((deleted.kind, deleted.data['slots']), ('slots_deleted', staff_slots))
+        self.assertEqual(deleted.data['dates'], [self.day.date.isoformat()])
+
+    def test_feed_pages_after_cursor(self):
+        cursor = self.changes().json()['cursor']
+        for slot in TimeSlot.objects.filter(day=self.day)[:3]:
+            Appointment.objects.create(client=self.clients[0], slot=slot).delete()
+
+        page = self.changes(after=cursor, limit=4).json()
+        self.assertEqual([e['kind'] for e in page['events']], ['slot_booked', 'slot_freed'] * 2)
+        self.assertTrue(page['has_more'])
+        page = self.changes(after=page['cursor'], limit=4).json()
+        self.assertEqual([e['kind'] for e in page['events']], ['slot_booked', 'slot_freed'])
+        self.assertFalse(page['has_more'])
+        self.assertEqual(page['cursor'], ScheduleEvent.objects.latest('id').id)
+        self.assertEqual(self.changes(after=page['cursor']).json()['events'], [])
+
+    def test_cursor_skips_other_businesses(self):
+        cursor = self.changes().json()['cursor']
+        other = Business.objects.create(name='Other', owner=self.owner)
+        other_day = Day.objects.create(business=other, date=self.day.date)
+        generate_time_slots(other_day, time(9, 0), time(10, 0), 30)
+        page = self.changes(after=cursor).json()
+        self.assertEqual(page['events'], [])
+        self.assertEqual(page['cursor'], ScheduleEvent.objects.latest('id').id)
+
+    def test_only_owner_and_staff(self):
+        self.client.force_login(self.clients[0])
+        response = self.client.get(reverse('calendar:api_business_changes', args=[self.business.id]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_pruned_cursor_expires(self):
+        cursor = ScheduleEvent.objects.earliest('id').id
+        ScheduleEvent.objects.update(created_at=timezone.now() - timedelta(days=60))
+        # The newest event stays
+        self.assertEqual(prune_events(timezone.now() - timedelta(days=30), batch_size=2), 3)
+        self.assertEqual(self.changes(after=cursor).status_code, 410)
+        head = ScheduleEvent.objects.get().id
+        self.assertEqual(self.changes(after=head).status_code, 200)
+        # A cursor from beyond the head was issued by another shard
+        self.assertEqual(self.changes(after=head + 1).status_code, 410)
+
+    def test_prune_command(self):
+        ScheduleEvent.objects.update(created_at=timezone.now() - timedelta(days=60))
+        out = io.StringIO()
+        call_command('prune_events', '--retention-days', '30', '--dry-run', stdout=out)
+        self.assertIn('Up to 4 events', out.getvalue())
+        call_command('prune_events', '--retention-days', '30', stdout=out)
+        self.assertIn('Deleted 3 events', out.getvalue())
+        self.assertEqual(ScheduleEvent.objects.count(), 1)
+
+
+# -------------------------
+# ROLLUPS
+# -------------------------
+class RollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(username='owner')
+        UserProfile.objects.create(user=cls.owner, role='owner')
+        cls.clients = [User.objects.create(username=f'client{i}') for i in range(3)]
+        for user in cls.clients:
+            UserProfile.objects.create(user=user, role='client')
+        cls.business = Business.objects.create(name='Yoga', owner=cls.owner)
+        cls.day = Day.objects.create(business=cls.business, date=date.today() + timedelta(days=2))
+        generate_time_slots(cls.day, time(9, 0), time(11, 0), 30, capacity=2)
+
+    def slots(self):
+        return TimeSlot.objects.filter(day=self.day).order_by('start')
+
+    def rollup(self):
+        return DailyUtilization.objects.get(business=self.business, date=self.day.date)
+
+    def book_and_cancel(self):
+        first, second = self.slots()[:2]
+        Appointment.objects.create(client=self.clients[0], slot=first)
+        Appointment.objects.create(client=self.clients[1], slot=first)
+        Appointment.objects.create(client=self.clients[2], slot=second).delete()
+
+    def test_update_applies_bookings_and_cancellations(self):
+        self.book_and_cancel()
+        self.assertEqual(update_rollups(batch_size=3), ScheduleEvent.objects.count())
+        row = self.rollup()
+        self.assertEqual((row.slots, row.places, row.booked, row.cancellations), (4, 8, 2, 1))
+        # Booked just now for the day after tomorrow
+        self.assertAlmostEqual(row.lead_time_seconds / 2 / 86400, 2, delta=1)
+        self.assertEqual(update_rollups(), 0)
+
+    def test_blocked_slots_leave_the_places(self):
+        update_rollups()
+        block_slots(self.slots().filter(start__gte=time(10, 0)))
+        update_rollups()
+        self.assertEqual((self.rollup().slots, self.rollup().places), (4, 4))
+
+    def test_closure_keeps_utilization_within_open_slots(self):
+        first, second = self.slots()[:2]
+        for client, slot in zip(self.clients, (first, first, second)):
+            Appointment.objects.create(client=client, slot=slot)
+
+        # The closure keeps the full slot's bookings but takes it out of both sums
+        close_business(self.business, [(first.start_at, first.end_at)])
+        update_rollups()
+        row = with_rates(DailyUtilization.objects.values().get(business=self.business, date=self.day.date))
+        self.assertEqual((row['places'], row['booked'], row['utilization']), (6, 1, 16.7))
+
+        close_business(self.business, [(first.start_at, self.slots().last().end_at)])
+        update_rollups()
+        row = with_rates(DailyUtilization.objects.values().get(business=self.business, date=self.day.date))
+        self.assertEqual((row['places'], row['booked'], row['utilization']), (0, 0, None))
+
+    def test_rebuild_keeps_cancellations(self):
+        self.book_and_cancel()
+        update_rollups()
+        DailyUtilization.objects.update(booked=0, places=0)
+        self.assertEqual(rebuild_rollups(), 1)
+        row = self.rollup()
+        self.assertEqual((row.places, row.booked, row.cancellations), (8, 2, 1))
+
+    def test_prune_keeps_unapplied_events(self):
+        update_rollups()
+        self.book_and_cancel()
+        ScheduleEvent.objects.update(created_at=timezone.now() - timedelta(days=60))
+        prune_events(timezone.now() - timedelta(days=30))
+        position = FeedCursor.objects.get().position
+        self.assertFalse(ScheduleEvent.objects.filter(id__lt=position).exists())
+        self.assertEqual(ScheduleEvent.objects.filter(id__gt=position).count(), 4)
+        update_rollups()
+        self.assertEqual(self.rollup().cancellations, 1)
+
+    def test_analytics_page(self):
+        self.book_and_cancel()
+        update_rollups()
+        self.client.force_login(self.owner)
+        response = self.client.get(
+            reverse('calendar:business_analytics', args=[self.business.id]), {'month': self.day.date.strftime('%Y-%m')}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['month_total']['utilization'], 25.0)
+        self.assertEqual(response.context['month_total']['cancellation_rate'], 33.3)
+        self.assertEqual([row['booked'] for row in response.context['weeks']], [2])
+        self.assertEqual([row['cancellations'] for row in response.context['months']][-1], 1)
+
+
+# -------------------------
+# STREAMED PAGES
+# -------------------------
+class StreamedPageTests(TestCase):
+    def setUp(self):
+        self.fixture = ScheduleFixture()
+        self.fixture.grow()
+        self.client.force_login(self.fixture.owner)
+
+    def page(self, name, *args):
+        response = self.client.get(reverse(f'calendar:{name}', args=args))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        return b''.join(response.streaming_content).decode()
+
+    def test_days_paired_with_their_bookings(self):
+        days = days_with_free_slots().filter(business=self.fixture.business).order_by('date', 'id')
+        appointments = Appointment.objects.filter(business=self.fixture.business).order_by(
+            'slot__day__date', 'slot__day__id', 'slot__start', 'id',
+        )
+        pairs = list(iter_days_with_bookings(days, appointments, chunk_size=2))
+        self.assertEqual([day.id for day, _ in pairs], [day.id for day in days])
+        for day, bookings in pairs:
+            expected = Appointment.objects.filter(slot__day=day).order_by('slot__start')
+            self.assertEqual([appt.id for appt in bookings], [appt.id for appt in expected])
+
+    def test_business_detail_streams_one_section_per_day(self):
+        html = self.page('business_detail', self.fixture.business.id)
+        head, *sections = html.split('<h3>')
+        self.assertIn('Days & Slots', head)
+        days = list(self.fixture.business.days.order_by('date'))
+        self.assertEqual(len(sections), len(days))
+        for day, section in zip(days, sections):
+            self.assertTrue(section.startswith(f'{date_format(day.date)}</h3>'))
+            self.assertEqual(section.count('<li>'), Appointment.objects.filter(slot__day=day).count())
+        self.assertIn('Add a New Day', sections[-1])
+
+    def test_business_detail_without_days(self):
+        business = Business.objects.create(name='Empty', owner=self.fixture.owner)
+        html = self.page('business_detail', business.id)
+        self.assertIn('No days created yet.', html)
+        self.assertTrue(html.rstrip().endswith('</html>'))
+
+    def test_dashboard_lists_businesses_by_name(self):
+        Business.objects.create(name='Aardvark', owner=self.fixture.owner)
+        response = self.client.get(reverse('calendar:dashboard'))
+        html = b''.join(response.streaming_content).decode()
+        # Sections are rendered without the request: the cancel forms still get the token
+        self.assertIn('csrftoken', response.cookies)
+        self.assertIn('csrfmiddlewaretoken', html)
+
+        names = list(Business.objects.filter(owner=self.fixture.owner).order_by('name').values_list('name', flat=True))
+        positions = [html.index(f'>{name}</a></h3>') for name in names]
+        self.assertEqual(positions, sorted(positions))
+        sections = [html[start:end] for start, end in zip(positions, positions[1:] + [len(html)])]
+        self.assertIn('No days created yet.', sections[0])
+        self.assertTrue(all(section.count('<ul>') == section.count('</ul>') for section in sections[:-1]))
+        main = sections[names.index('Main Salon')]
+        self.assertEqual(main.count('View Slots'), self.fixture.business.days.count())
+
+    def test_dashboard_without_businesses(self):
+        self.client.force_login(self.fixture.other_owner)
+        Business.objects.filter(owner=self.fixture.other_owner).delete()
+        self.assertIn('You have no businesses yet.', self.page('dashboard'))
+
+    async def test_asgi_streams_asynchronously(self):
+        await self.async_client.aforce_login(self.fixture.owner)
+        response = await self.async_client.get(reverse('calendar:business_detail', args=[self.fixture.business.id]))
+        self.assertTrue(response.streaming)
+        self.assertTrue(response.is_async)
+        html = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(html.count('Generate Slots for this Day'), await self.fixture.business.days.acount())
+
+
+# -------------------------
+# PROFILING
+# -------------------------
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.fixture = ScheduleFixture()
+        self.fixture.grow()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def profile_dashboard(self, profiler):
+        with self.settings(APPOINTMENT_PROFILE_THRESHOLD_MS=0, APPOINTMENT_PROFILER=profiler,
+                           APPOINTMENT_PROFILE_DIR=self.directory):
+            client = Client()
+            client.force_login(self.fixture.owner)
+            response = client.get(reverse('calendar:dashboard'))
+            # The page is streamed: its profile is kept once it has been sent
+            self.assertEqual(os.listdir(self.directory), [])
+            b''.join(response.streaming_content)
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 1)
+        self.assertRegex(files[0], r'-calendar\.dashboard-owner-\d+q-\d+ms-\d+\.prof$')
+        return pstats.Stats(os.path.join(self.directory, files[0]))
+
+    def test_sampling_profile(self):
+        self.profile_dashboard('sampling')
+
+    def test_cprofile_profile(self):
+        stats = self.profile_dashboard('cprofile')
+        self.assertTrue(any(func[2] == 'dashboard' for func in stats.stats))
+
+    def test_disabled_by_default(self):
+        with self.settings(APPOINTMENT_PROFILE_DIR=self.directory):
+            client = Client()
+            client.force_login(self.fixture.owner)
+            client.get(reverse('calendar:dashboard'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+# -------------------------
+# DATABASE ROUTING
+# -------------------------
+@override_settings(APPOINTMENT_DATABASE_REPLICAS=['replica'])
+class PrimaryReplicaRouterTests(TransactionTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Business), 'replica')
+        self.assertEqual(self.router.db_for_write(Business), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'appointment'))
+
+    def test_pinned_reads_go_to_primary(self):
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Business), 'default')
+        self.assertEqual(self.router.db_for_read(Business), 'replica')
+
+    def test_reads_in_transaction_go_to_primary(self):
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Business), 'default')
+
+    @override_settings(APPOINTMENT_DATABASE_REPLICAS=[])
+    def test_no_replica_configured(self):
+        self.assertEqual(self.router.db_for_read(Business), 'default')
+
+
+class PrimaryPinningMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.seen = []
+
+        def view(request):
+            self.seen.append(primary_pinned.get())
+            return HttpResponse()
+
+        self.middleware = PrimaryPinningMiddleware(view)
+        self.factory = RequestFactory()
+
+    def test_post_pins_request_and_follow_up(self):
+        response = self.middleware(self.factory.post('/'))
+        self.assertIn('pin_primary', response.cookies)
+
+        follow_up = self.factory.get('/')
+        follow_up.COOKIES['pin_primary'] = '1'
+        self.middleware(follow_up)
+        self.middleware(self.factory.get('/'))
+        self.assertEqual(self.seen, [True, True, False])
+        self.assertFalse(primary_pinned.get())
+
+
+class SqlitePragmaTests(TestCase):
+    @override_settings(APPOINTMENT_SQLITE_PRAGMAS={'default': {'cache_size': -1234}})
+    def test_configure_sqlite(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite only")
+        configure_sqlite(None, connection)
+        self.assertEqual(connection.connection.execute('PRAGMA cache_size').fetchone()[0], -1234)
+
+
+@override_settings(APPOINTMENT_SHARDS=['default', 'shard1'])
+class ShardRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ShardRouter()
+        self.business = Business(id=7, name='Salon', shard='shard1')
+
+    def on(self, alias, obj):
+        obj._state.db = alias
+        obj._state.adding = False
+        return obj
+
+    def test_pick_shard_is_deterministic(self):
+        self.assertIn(pick_shard(42), ['default', 'shard1'])
+        self.assertEqual(pick_shard(42), pick_shard(42))
+
+    def test_shard_for_ids_and_businesses(self):
+        self.assertEqual(shard_for_pk(5), 'default')
+        self.assertEqual(shard_for_pk(SHARD_ID_SPAN + 5), 'shard1')
+        self.assertEqual(shard_for_pk(5 * SHARD_ID_SPAN), 'default')
+        self.assertEqual(shard_for_business(self.business), 'shard1')
+        self.assertEqual(shard_for_business(Business(name='Old')), 'default')
+
+    def test_scheduling_queries_follow_the_business(self):
+        self.assertEqual(self.router.db_for_read(Day, instance=self.business), 'shard1')
+        day = self.on('shard1', Day(id=SHARD_ID_SPAN + 1, business=self.business, date=date.today()))
+        self.assertEqual(self.router.db_for_read(TimeSlot, instance=day), 'shard1')
+        self.assertIsNone(self.router.db_for_read(Day))
+        with on_shard('shard1'):
+            self.assertEqual(self.router.db_for_write(Appointment), 'shard1')
+
+    def test_reference_rows_are_read_from_default(self):
+        slot = self.on('shard1', TimeSlot(id=SHARD_ID_SPAN + 1))
+        self.assertEqual(self.router.db_for_read(User, instance=slot), 'default')
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_relations_stay_on_one_shard(self):
+        day = self.on('shard1', Day(id=SHARD_ID_SPAN + 1))
+        other = self.on('default', Day(id=1))
+        self.assertTrue(self.router.allow_relation(day, TimeSlot()))
+        self.assertFalse(self.router.allow_relation(self.on('default', TimeSlot(id=1)), day))
+        self.assertTrue(self.router.allow_relation(other, self.business))
+
+    @override_settings(APPOINTMENT_SHARDS=['default'])
+    def test_middleware_unused_without_shards(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ShardMiddleware(lambda request: HttpResponse())
+
+
+@override_settings(APPOINTMENT_SHARDS=['default', 'shard1'], DATABASE_ROUTERS=['appointment.routers.ShardRouter'])
+class ShardedBookingTests(TestCase):
+    """The web paths end to end with a business on the second shard."""
+    databases = {'default', 'shard1'}
+
+    @classmethod
+    def setUpTestData(cls):
+        reserve_id_range('shard1')
+        cls.owner = User.objects.create(username='owner')
+        UserProfile.objects.create(user=cls.owner, role='owner')
+        cls.client_user = User.objects.create(username='client')
+        UserProfile.objects.create(user=cls.client_user, role='client')
+        cls.business = Business.objects.create(name='Barber', owner=cls.owner, shard='shard1')
+        with on_shard('shard1'):
+            cls.day = Day.objects.create(business=cls.business, date=date.today() + timedelta(days=1))
+        generate_time_slots(cls.day, time(9, 0), time(11, 0), 60)
+
+    def slot(self):
+        return TimeSlot.objects.using(shard_for_business(self.business)).filter(day__date=self.day.date).order_by('start').first()
+
+    def test_reference_rows_are_mirrored(self):
+        for model, pk in ((User, self.client_user.pk), (Business, self.business.pk)):
+            self.assertTrue(model.objects.using('shard1').filter(pk=pk).exists())
+        self.assertEqual(self.day._state.db, 'shard1')
+        self.assertEqual(shard_for_pk(self.slot().pk), 'shard1')
+
+    def test_book_and_cancel_through_the_views(self):
+        slot = self.slot()
+        self.client.force_login(self.client_user)
+        response = self.client.post(reverse('calendar:book_slot', args=[slot.id]), follow=True)
+        self.assertEqual([str(m) for m in response.context['messages']], [
+            f"Slot booked: {slot.start}-{slot.end} on {self.day.date}.",
+        ])
+        self.assertTrue(Appointment.objects.using('shard1').filter(slot_id=slot.id, client=self.client_user).exists())
+        self.assertFalse(Appointment.objects.using('default').exists())
+
+        response = self.client.post(reverse('calendar:cancel_booking', args=[slot.id]), follow=True)
+        self.assertIn("has been canceled", str(list(response.context['messages'])[0]))
+        self.assertFalse(Appointment.objects.using('shard1').exists())
+        self.assertFalse(self.slot().is_booked)
+
+    def test_staff_change_rolls_back_on_both_databases(self):
+        self.client.force_login(self.owner)
+        with mock.patch('appointment.views.record_event', side_effect=RuntimeError('shard down')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('calendar:add_staff', args=[self.business.id]), {'username': 'client'})
+        self.assertFalse(self.business.staff.exists())
+
+        self.client.post(reverse('calendar:add_staff', args=[self.business.id]), {'username': 'client'})
+        self.assertEqual(list(self.business.staff.all()), [self.client_user])
+        self.assertTrue(ScheduleEvent.objects.using('shard1').filter(kind='staff_added').exists())
+
+    def test_move_business(self):
+        Appointment.objects.create(client=self.client_user, slot=self.slot())
+        moved = move_business(self.business, 'default')
+        self.assertEqual((moved['days'], moved['slots'], moved['appointments']), (1, 2, 1))
+        self.assertEqual(Business.objects.get(pk=self.business.pk).shard, 'default')
+        self.assertFalse(TimeSlot.objects.using('shard1').exists())
+
+        # The moved booking is found and cancelled on its new shard
+        self.business.refresh_from_db()
+        slot = self.slot()
+        self.assertEqual(slot._state.db, 'default')
+        self.client.force_login(self.client_user)
+        self.client.post(reverse('calendar:cancel_booking', args=[slot.id]))
+        self.assertFalse(Appointment.objects.using('default').exists())
+
+
+# -------------------------
+# STARTUP
+# -------------------------
+class StaffGroupTests(TestCase):
+    def test_created_by_migrate_and_idempotent(self):
+        config = apps.get_app_config('appointment')
+        create_staff_group(sender=config, using='default', apps=apps)
+        create_staff_group(sender=config, using='default', apps=apps)
+        group = Group.objects.get(name=STAFF_GROUP)
+        self.assertEqual(
+            set(group.permissions.values_list('codename', flat=True)),
+            {'add_timeslot', 'change_timeslot', 'delete_timeslot', 'view_timeslot'},
+        )
+
+
+# -------------------------
+# ARCHIVE
+# -------------------------
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.fixture = ScheduleFixture()
+        # Move the fixture into the past so it is due for archiving
+        self.fixture.next_date = date.today() - timedelta(days=200)
+        self.fixture.grow()
+        self.cutoff = date.today() - timedelta(days=90)
+
+    def test_archive_moves_past_days(self):
+        business = self.fixture.business
+        live = business_history(business)
+        bookings = Appointment.objects.filter(slot__day__business=business).count()
+
+        days, appointments = archive_days_before(self.cutoff, batch_size=7)
+
+        self.assertEqual(days, ScheduleFixture.DAYS_PER_BUSINESS * Business.objects.count())
+        self.assertFalse(Day.objects.filter(date__lt=self.cutoff).exists())
+        self.assertFalse(TimeSlot.objects.exists())
+        self.assertFalse(Appointment.objects.exists())
+        self.assertEqual(AppointmentArchive.objects.filter(business=business).count(), bookings)
+        self.assertEqual(appointments, AppointmentArchive.objects.count())
+
+        # Reporting reads the same numbers back from the archive
+        archived = business_history(business)
+        self.assertTrue(all(row['archived'] for row in archived))
+        self.assertEqual(
+            [(r['date'], r['total_slots'], r['free_slots'], r['bookings']) for r in archived],
+            [(r['date'], r['total_slots'], r['free_slots'], r['bookings']) for r in live],
+        )
+
+    def test_keeps_days_inside_retention(self):
+        recent = Day.objects.create(business=self.fixture.business, date=date.today() - timedelta(days=10))
+        archive_days_before(self.cutoff)
+        self.assertTrue(Day.objects.filter(pk=recent.pk).exists())
+        self.assertFalse(DayArchive.objects.filter(date=recent.date).exists())
+
+    def test_export_includes_archived_appointments(self):
+        archive_days_before(self.cutoff)
+        self.client.force_login(self.fixture.owner)
+        response = self.client.get(reverse('calendar:business_history_export', args=[self.fixture.business.id]))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines) - 1, AppointmentArchive.objects.filter(business=self.fixture.business).count())
+        self.assertTrue(lines[1].endswith(',True'))
@@ -0,0 +1,142 @@
+"""
+Rate limiting of the booking, cancellation and availability views.
+
+@rate_limited('<rule>') checks the token buckets of the rule in
+APPOINTMENT_RATE_LIMITS before the view runs, e.g.
+
+    APPOINTMENT_RATE_LIMITS = {
+        'book': {'user': '10/m', 'ip': '30/m', 'business': '600/m'},
+    }
+
+Each scope (the logged-in user, the client IP, the business named by the
+URL's business_id, day_id or slot_id) has its own bucket of `limit`
+tokens, refilled evenly over the period (s, m or h). A request takes one
+token from each; when a bucket is empty it gets a 429 with Retry-After
+and never reaches the view. Rules missing from the setting are not
+limited, so nothing is limited by default.
+
+Buckets live in the APPOINTMENT_RATE_LIMIT_CACHE cache (default
+'default'); use a shared one with several workers. Reads and writes of a
+bucket are not atomic, so concurrent requests can overdraw it slightly:
+the limit is approximate, which is all shedding abusive traffic needs.
+"""
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from .metrics import REQUESTS_THROTTLED
+from .models import Day, TimeSlot
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def parse_rate(rate):
+    """'10/m' -> (10, 60)"""
+    limit, period = rate.split('/')
+    return int(limit), PERIODS[period[0]]
+
+
+def get_cache():
+    return caches[getattr(settings, 'APPOINTMENT_RATE_LIMIT_CACHE', 'default')]
+
+
+def take_token(key, limit, period, now=None):
+    """
+    Take one token from bucket `key`.
+
+    Returns:
+    - float: 0 when a token was taken, else seconds until one is available
+    """
+    now = time.time() if now is None else now
+    cache = get_cache()
+    rate = limit / period
+    tokens, updated = cache.get(key) or (limit, now)
+    tokens = min(limit, tokens + (now - updated) * rate)
+    wait = 0.0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        wait = (1 - tokens) / rate
+    # An untouched bucket is full again after one period
+    cache.set(key, (tokens, now), timeout=math.ceil(period))
+    return wait
+
+
+def client_ip(request):
+    # Behind a proxy, have it set REMOTE_ADDR (e.g. gunicorn --forwarded-allow-ips)
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def business_for_request(kwargs):
+    """Business id named by the URL, looking up (and caching) the one of a day or slot."""
+    if 'business_id' in kwargs:
+        return kwargs['business_id']
+    for name, model in (('slot_id', TimeSlot), ('day_id', Day)):
+        if name in kwargs:
+            # The business of a day or slot never changes: cache it for a day
+            key = f'appointment:throttle:{name}:{kwargs[name]}'
+            business_id = get_cache().get(key)
+            if business_id is None:
+                business_id = model.objects.filter(pk=kwargs[name]).values_list('business_id', flat=True).first()
+                get_cache().set(key, business_id, timeout=86400)
+            return business_id
+    return None
+
+
+def check_limits(rule, request, kwargs):
+    """Seconds the request has to wait under `rule`, 0 when it may proceed."""
+    limits = getattr(settings, 'APPOINTMENT_RATE_LIMITS', {}).get(rule)
+    if not limits:
+        return 0
+    for scope in ('user', 'ip', 'business'):  # cheapest first: 'business' may query
+        if scope not in limits:
+            continue
+        if scope == 'user':
+            subject = request.user.pk if request.user.is_authenticated else None
+        elif scope == 'ip':
+            subject = client_ip(request)
+        else:
+            subject = business_for_request(kwargs)
+        if subject is None:
+            continue
+        limit, period = parse_rate(limits[scope])
+        wait = take_token(f'appointment:throttle:{rule}:{scope}:{subject}', limit, period)
+        if wait:
+            REQUESTS_THROTTLED.inc(rule=rule, scope=scope)
+            return wait
+    return 0
+
+
+def too_many_requests(wait):
+    response = HttpResponse("Too many requests, please retry shortly.", status=429, content_type='text/plain')
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def rate_limited(rule):
+    """View decorator applying the APPOINTMENT_RATE_LIMITS rule `rule`; sync and async views alike."""
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def wrapper(request, *args, **kwargs):
+                wait = await sync_to_async(check_limits)(rule, request, kwargs)
+                if wait:
+                    return too_many_requests(wait)
+                return await view_func(request, *args, **kwargs)
+        else:
+            @wraps(view_func)
+            def wrapper(request, *args, **kwargs):
+                wait = check_limits(rule, request, kwargs)
+                if wait:
+                    return too_many_requests(wait)
+                return view_func(request, *args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -23,6 +23,13 @@ urlpatterns = [
     path('business/create/', views.create_business, name='create_business'),  # Owner only
     path('business/<int:business_id>/', views.business_detail, name='business_detail'),  # Owner / Client
     path('businesses/', views.business_list, name='business_list'),  # Client / Owner
+    path('businesses/search/', views.business_search, name='business_search'),  # Any user (signup)
+    path('business/<int:business_id>/history.csv', views.business_history_export, name='business_history_export'),  # Owner
+    path('business/<int:business_id>/month/', views.business_month, name='business_month'),  # Owner / Client
+    path('business/<int:business_id>/analytics/', views.business_analytics, name='business_analytics'),  # Owner
+    path('business/<int:business_id>/closures/', views.business_closures, name='business_closures'),  # Owner
+    path('business/<int:business_id>/closures/<int:closure_id>/reopen/', views.reopen_business_closure,
+         name='reopen_business_closure'),  # Owner
 
     # -------------------------
     # DAY MANAGEMENT
@@ -40,6 +47,7 @@ urlpatterns = [
     # APPOINTMENT BOOKING
     # -------------------------
     path('slot/<int:slot_id>/book/', views.book_slot, name='book_slot'),  # Client only
+    path('day/<int:day_id>/book-any-staff/', views.book_any_staff, name='book_any_staff'),  # Client only
     path('slot/<int:slot_id>/cancel/', views.cancel_booking_view, name='cancel_booking'),  # Client only
 
     # -------------------------
@@ -54,4 +62,19 @@ urlpatterns = [
     # STAFF VIEW
     # -------------------------
     path('business/<int:business_id>/staff/', views.business_detail_staff, name='business_detail_staff'),  # Owner / Staff
+
+    # -------------------------
+    # ASYNC READ API
+    # -------------------------
+    path('api/businesses/', views.api_business_list, name='api_business_list'),  # Any logged-in user
+    path('api/business/<int:business_id>/availability/', views.api_business_availability, name='api_business_availability'),
+    path('api/day/<int:day_id>/availability/', views.api_day_availability, name='api_day_availability'),
+    path('api/slots/search/', views.api_slot_search, name='api_slot_search'),
+    path('api/business/<int:business_id>/changes/', views.api_business_changes, name='api_business_changes'),  # Owner / Staff
+
+    # -------------------------
+    # LIVE AVAILABILITY (SSE)
+    # -------------------------
+    path('day/<int:day_id>/events/', views.day_events, name='day_events'),
+    path('business/<int:business_id>/events/', views.business_events, name='business_events'),
 ]
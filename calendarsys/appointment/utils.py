@@ -1,14 +1,26 @@
+from calendar import monthrange
 from datetime import datetime, timedelta, time, date
-from .models import TimeSlot, Day,Appointment, Business
+from .models import TimeSlot, Day,Appointment, Business, DayArchive, AppointmentArchive, Closure, slot_datetime
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.shortcuts import redirect, get_object_or_404
 from django.contrib import messages
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
 from functools import wraps
+from .availability import cached_month, invalidate_availability
+from .live import publish_slot_change, publish_slots_change
+from .metrics import SLOTS_GENERATED
+from .outbox import record_events, record_slot_events, slot_data
+from .sharding import on_shard, shard_for_business, shards
 
 
 
 
-def generate_time_slots(day, start_time, end_time, interval_minutes=30, breaks=None):
+def generate_time_slots(day, start_time, end_time, interval_minutes=30, breaks=None, capacity=1):
     """
     Generate TimeSlot objects for a given Day.
     
@@ -18,6 +30,7 @@ def generate_time_slots(day, start_time, end_time, interval_minutes=30, breaks=N
         end_time (datetime.time): end of the workday
         interval_minutes (int): slot length in minutes
         breaks (list of tuples): [(break_start_time, break_end_time), ...]
+        capacity (int): places per slot
     
     Returns:
         int: number of slots created
@@ -40,7 +53,7 @@ def generate_time_slots(day, start_time, end_time, interval_minutes=30, breaks=N
 
         # Avoid duplicate slots
         if not TimeSlot.objects.filter(day=day, start=slot_start, end=slot_end).exists():
-            TimeSlot.objects.create(day=day, start=slot_start, end=slot_end, is_booked=False)
+            TimeSlot.objects.create(day=day, start=slot_start, end=slot_end, capacity=capacity)
             slots_created += 1
 
         current = slot_end_dt
@@ -48,7 +61,7 @@ def generate_time_slots(day, start_time, end_time, interval_minutes=30, breaks=N
     return slots_created
 
 
-def generate_week(business, start_date, end_date, start_time, end_time, interval, breaks=None):
+def generate_week(business, start_date, end_date, start_time, end_time, interval, breaks=None, capacity=1):
     """
     Generate slots for all weekdays in a week.
     Skips Saturday and Sunday.
@@ -57,18 +70,19 @@ def generate_week(business, start_date, end_date, start_time, end_time, interval
     days_created = 0
     slots_created = 0
 
-    while current <= end_date:
-        if current.weekday() < 5:  # Monday=0 ... Friday=4
-            day, created = Day.objects.get_or_create(date=current, business=business)
-            if created:
-                days_created += 1
-            slots_created += generate_time_slots(day, start_time, end_time, interval, breaks)
-        current += timedelta(days=1)
+    with on_shard(shard_for_business(business)):
+        while current <= end_date:
+            if current.weekday() < 5:  # Monday=0 ... Friday=4
+                day, created = Day.objects.get_or_create(date=current, business=business)
+                if created:
+                    days_created += 1
+                slots_created += generate_time_slots(day, start_time, end_time, interval, breaks, capacity)
+            current += timedelta(days=1)
 
     return days_created, slots_created
 
 
-def generate_month(business, year, month, start_time, end_time, interval, breaks=None):
+def generate_month(business, year, month, start_time, end_time, interval, breaks=None, capacity=1):
     """
     Generate slots for all weekdays in a month.
     Skips Saturday and Sunday.
@@ -81,53 +95,227 @@ def generate_month(business, year, month, start_time, end_time, interval, breaks
     days_created = 0
     slots_created = 0
 
-    while current <= last_day:
-        if current.weekday() < 5:  # skip weekends
-            day, created = Day.objects.get_or_create(date=current, business=business)
-            if created:
-                days_created += 1
-            slots_created += generate_time_slots(day, start_time, end_time, interval, breaks)
-        current += timedelta(days=1)
+    with on_shard(shard_for_business(business)):
+        while current <= last_day:
+            if current.weekday() < 5:  # skip weekends
+                day, created = Day.objects.get_or_create(date=current, business=business)
+                if created:
+                    days_created += 1
+                slots_created += generate_time_slots(day, start_time, end_time, interval, breaks, capacity)
+            current += timedelta(days=1)
 
     return days_created, slots_created
 
-def regenerate_slots(day, start_time, end_time, interval_minutes=30, breaks=None):
+def regenerate_slots(day, start_time, end_time, interval_minutes=30, breaks=None, capacity=1):
     """
     Regenerate time slots for a Day.
-    Preserves already booked slots.
+    Preserves slots with bookings.
     
     day: Day instance
     start_time, end_time: datetime.time objects
     interval_minutes: int
     breaks: list of (start, end) times to skip
+    capacity: places per new slot
     """
-    # Delete all unbooked slots
-    TimeSlot.objects.filter(day=day, is_booked=False).delete()
+    # Delete all slots nobody booked (a partly booked slot is not full, but keeps its bookings;
+    # blocked slots stay so they are not regenerated)
+    unused = TimeSlot.objects.using(day._state.db).filter(day=day, booked=0, is_blocked=False)
+    with transaction.atomic(using=day._state.db):
+        record_slot_events(unused, 'slots_deleted')
+        unused.delete()
+    invalidate_availability(day.business_id, day._state.db)
     
     # Generate new slots
-    return generate_time_slots(day, start_time, end_time, interval_minutes, breaks=breaks)
+    return generate_time_slots(day, start_time, end_time, interval_minutes, breaks=breaks, capacity=capacity)
 
 
 
 def book_slot(user, slot_id):
-    with transaction.atomic():
-        slot = TimeSlot.objects.select_for_update().get(id=slot_id)
+    """
+    Book one place in a slot for `user`.
+    Raises ValidationError when the slot is full or the user already has a booking that day.
+    """
+    slot = TimeSlot.objects.select_related('day').get(id=slot_id)
+    with transaction.atomic(using=slot._state.db):
+        if Appointment.objects.filter(client=user, slot__day_id=slot.day_id).exists():
+            raise ValidationError("You already have a booking on this day for this business.")
+        # Appointment.save() takes the place with one conditional UPDATE
+        return Appointment.objects.create(client=user, slot=slot)
+
+
+# -------------------------
+# BULK OPERATIONS
+# -------------------------
+def block_slots(slots, include_booked=False, **fields):
+    """
+    Take the unbooked slots of the `slots` queryset out of availability,
+    with one UPDATE (also setting `fields`). Slots with bookings are left
+    alone, unless `include_booked`: then they take no more bookings and
+    stay closed once theirs are cancelled, but keep them. Open day pages
+    get a slots_blocked event after commit.
 
-        if slot.is_booked:
-            raise ValueError("This slot is already booked.")
+    Returns:
+    - int: slots blocked
+    """
+    slots = slots.filter(is_blocked=False)
+    if not include_booked:
+        slots = slots.filter(booked=0)
+    with transaction.atomic(using=slots.db):
+        for business_id, days in record_slot_events(slots, 'slots_blocked').items():
+            invalidate_availability(business_id, slots.db)
+            publish_slots_change(business_id, days, 'slots_blocked')
+        return slots.update(is_blocked=True, is_booked=True, **fields)
 
-        if Appointment.objects.filter(user=user, slot__day=slot.day).exists():
-            raise ValueError("You already have a booking on this day for this business.")
 
-        slot.is_booked = True
-        slot.save()
+def unblock_slots(slots):
+    """
+    Put blocked slots of the `slots` queryset back into availability, with
+    one UPDATE. Open day pages get a slots_unblocked event after commit.
+    """
+    slots = slots.filter(is_blocked=True)
+    with transaction.atomic(using=slots.db):
+        for business_id, days in record_slot_events(slots, 'slots_unblocked').items():
+            invalidate_availability(business_id, slots.db)
+            publish_slots_change(business_id, days, 'slots_unblocked')
+        return slots.update(
+            is_blocked=False,
+            closure=None,
+            is_booked=Case(When(booked__gte=F('capacity'), then=Value(True)), default=Value(False)),
+        )
+
+
+# -------------------------
+# CLOSURES
+# -------------------------
+def closure_q(ranges, staff=None, prefix=''):
+    """
+    Q matching slots (bookings with prefix='slot__') that overlap any of
+    the (start_at, end_at) `ranges`, on the calendar of `staff` if given.
+    """
+    overlaps = Q()
+    for start_at, end_at in ranges:
+        overlaps |= Q(**{f'{prefix}start_at__lt': end_at, f'{prefix}end_at__gt': start_at})
+    if staff is not None:
+        overlaps &= Q(**{f'{prefix}staff': staff})
+    return overlaps
 
-        appt = Appointment.objects.create(user=user, slot=slot, business=slot.day.business)
 
-        return appt
+def close_business(business, ranges, staff=None, reason=''):
+    """
+    Close `business` (or only the calendar of `staff`) over the
+    (start_at, end_at) `ranges`: one Closure per range, and every open slot
+    overlapping them blocked with one UPDATE that also records which
+    closure blocked it, so they leave availability everywhere. Bookings in the ranges are kept and reported: cancel them
+    with cancel_appointments() or honor them. Slots generated there later
+    are created blocked (see generate_time_slots).
 
+    Returns:
+    - (closures, slots blocked, conflicting Appointments by slot start)
+    """
+    if not ranges:
+        raise ValueError("A closure needs at least one period")
+    using = shard_for_business(business)
+    matching = closure_q(ranges, staff)
+    with transaction.atomic(using=using):
+        closures = Closure.objects.using(using).bulk_create([
+            Closure(business=business, staff=staff, start_at=start_at, end_at=end_at, reason=reason)
+            for start_at, end_at in ranges
+        ])
+        blocked_by = Case(*[
+            When(closure_q([(closure.start_at, closure.end_at)]), then=Value(closure.pk))
+            for closure in closures
+        ])
+        blocked = block_slots(
+            TimeSlot.objects.using(using).filter(matching, business=business),
+            include_booked=True, closure=blocked_by,
+        )
+        conflicts = list(
+            Appointment.objects.using(using)
+            .filter(closure_q(ranges, staff, prefix='slot__'), business=business)
+            .select_related('client', 'slot').order_by('slot__start_at', 'id')
+        )
+    return closures, blocked, conflicts
+
+
+def reopen_closure(closure):
+    """
+    Delete `closure` and put the slots it blocked back into availability,
+    set-based: those another closure still covers move to it and stay
+    blocked, the rest are unblocked with one UPDATE. Slots blocked by hand
+    inside the period are left alone.
 
-def generate_time_slots(day, start_time, end_time, interval, breaks=None):
+    Returns:
+    - int: slots unblocked
+    """
+    using = closure._state.db
+    # Business-wide closures cover every calendar, a staff closure only its own
+    still_closed = Closure.objects.using(using).filter(
+        Q(staff__isnull=True) | Q(staff=OuterRef('staff')),
+        business_id=OuterRef('business_id'),
+        start_at__lt=OuterRef('end_at'),
+        end_at__gt=OuterRef('start_at'),
+    ).exclude(pk=closure.pk).order_by('start_at', 'pk')
+    slots = TimeSlot.objects.using(using).filter(closure=closure)
+    with transaction.atomic(using=using):
+        slot_ids = list(slots.values_list('id', flat=True))
+        slots.update(closure=Subquery(still_closed.values('pk')[:1]))
+        closure.delete(using=using)
+        return unblock_slots(TimeSlot.objects.using(using).filter(id__in=slot_ids, closure__isnull=True))
+
+
+def closed_periods(day, staff=None):
+    """
+    (start_at, end_at, id) of the closures overlapping `day` that cover the
+    calendar of `staff` (the business's own slots when None).
+    """
+    covers = Q(staff__isnull=True) | Q(staff=staff) if staff is not None else Q(staff__isnull=True)
+    return list(
+        Closure.objects.using(day._state.db)
+        .filter(covers, business_id=day.business_id,
+                start_at__lt=slot_datetime(day.date + timedelta(days=1), time.min),
+                end_at__gt=slot_datetime(day.date, time.min))
+        .values_list('start_at', 'end_at', 'id')
+    )
+
+
+def cancel_appointments(appointments):
+    """
+    Cancel the `appointments` queryset set-based: one UPDATE gives every
+    affected slot back as many places as it loses bookings, one DELETE
+    removes them. A slot_freed event goes out per slot after commit.
+
+    Returns:
+    - int: appointments cancelled
+    """
+    using = appointments.db
+    ids = list(appointments.values_list('id', flat=True))
+    if not ids:
+        return 0
+    selected = Appointment.objects.using(using).filter(id__in=ids)
+    lost = (
+        selected.filter(slot=OuterRef('pk'))
+        .order_by().values('slot').annotate(total=Count('id')).values('total')
+    )
+    with transaction.atomic(using=using):
+        rows = list(selected.values_list('id', 'slot_id', 'business_id', 'client_id'))
+        slot_ids = {slot_id for _, slot_id, _, _ in rows}
+        for business_id in {business_id for _, _, business_id, _ in rows}:
+            invalidate_availability(business_id, using)
+        TimeSlot.objects.using(using).filter(id__in=slot_ids).update(
+            booked=F('booked') - Subquery(lost), is_booked=F('is_blocked'),
+        )
+        cancelled, _ = selected.delete()
+        slots = TimeSlot.objects.using(using).in_bulk(slot_ids)
+        record_events([
+            (business_id, 'slot_freed', {**slot_data(slots[slot_id]), 'appointment': appointment_id, 'client': client_id})
+            for appointment_id, slot_id, business_id, client_id in rows
+        ], using)
+        for slot in slots.values():
+            publish_slot_change(slot, 'slot_freed')
+    return cancelled
+
+
+def generate_time_slots(day, start_time, end_time, interval, breaks=None, capacity=1, staff=None):
     """
     Generates TimeSlot objects for a given Day.
     
@@ -137,6 +325,8 @@ def generate_time_slots(day, start_time, end_time, interval, breaks=None):
     - end_time: datetime.time, ending time of the day
     - interval: int, slot length in minutes
     - breaks: list of tuples [(start_time, end_time), ...] for break periods
+    - capacity: int, places per slot (parallel staff, class size)
+    - staff: User whose calendar gets the slots, or None for the business
     
     Returns:
     - count: number of slots created
@@ -150,23 +340,336 @@ def generate_time_slots(day, start_time, end_time, interval, breaks=None):
     current = datetime.combine(day.date, start_time)
     end_datetime = datetime.combine(day.date, end_time)
 
-    while current + timedelta(minutes=interval) <= end_datetime:
-        slot_start = current.time()
-        slot_end = (current + timedelta(minutes=interval)).time()
+    # One transaction per day: one commit for all its slots and their change feed events
+    with on_shard(day._state.db), transaction.atomic(using=day._state.db):
+        closed = closed_periods(day, staff)
+        while current + timedelta(minutes=interval) <= end_datetime:
+            slot_start = current.time()
+            slot_end = (current + timedelta(minutes=interval)).time()
+
+            # Skip if slot falls into a break
+            if any(b_start <= slot_start < b_end or b_start < slot_end <= b_end for b_start, b_end in breaks):
+                current += timedelta(minutes=interval)
+                continue
+
+            # Prevent duplicate slots
+            if not TimeSlot.objects.filter(day=day, staff=staff, start=slot_start, end=slot_end).exists():
+                # Slots inside a closure are created blocked, so reopening it frees them
+                starts_at, ends_at = slot_datetime(day.date, slot_start), slot_datetime(day.date, slot_end)
+                closure_id = next(
+                    (pk for start_at, end_at, pk in closed if start_at < ends_at and end_at > starts_at), None,
+                )
+                TimeSlot.objects.create(
+                    day=day, start=slot_start, end=slot_end, capacity=capacity, staff=staff,
+                    is_blocked=closure_id is not None, closure_id=closure_id,
+                )
+                slots_created += 1
 
-        # Skip if slot falls into a break
-        if any(b_start <= slot_start < b_end or b_start < slot_end <= b_end for b_start, b_end in breaks):
             current += timedelta(minutes=interval)
-            continue
 
-        # Prevent duplicate slots
-        if not TimeSlot.objects.filter(day=day, start=slot_start, end=slot_end).exists():
-            TimeSlot.objects.create(day=day, start=slot_start, end=slot_end)
-            slots_created += 1
+    SLOTS_GENERATED.inc(slots_created)
+    return slots_created
 
-        current += timedelta(minutes=interval)
 
-    return slots_created
+def days_with_free_slots():
+    """
+    Day queryset annotated with ``available_slots`` (number of slots with a
+    free place) and ``available_places`` (free places over all slots and
+    staff calendars), computed in the same query instead of one COUNT per day.
+    """
+    free = Q(slots__is_booked=False)
+    return Day.objects.annotate(
+        available_slots=Count('slots', filter=free),
+        available_places=Coalesce(Sum(F('slots__capacity') - F('slots__booked'), filter=free), 0),
+    )
+
+
+# -------------------------
+# MONTH HEATMAP
+# -------------------------
+def month_availability(business, year, month):
+    """
+    Free and total slots per date of one month for `business`, computed
+    with one grouped query and cached until the business's slots change
+    (see appointment.availability).
+
+    Returns:
+    - list of dicts: date, day (id), total, free, free_places; dates
+      without slots are left out
+    """
+    first = date(year, month, 1)
+    last = date(year, month, monthrange(year, month)[1])
+
+    def compute():
+        free = Q(is_booked=False)
+        rows = (
+            TimeSlot.objects.using(shard_for_business(business))
+            .filter(day__business=business, day__date__gte=first, day__date__lte=last)
+            .values('day__date', 'day')
+            .annotate(
+                total=Count('id'),
+                free=Count('id', filter=free),
+                free_places=Coalesce(Sum(F('capacity') - F('booked'), filter=free), 0),
+            )
+            .order_by('day__date')
+        )
+        return [
+            {'date': row['day__date'], 'day': row['day'], 'total': row['total'],
+             'free': row['free'], 'free_places': row['free_places']}
+            for row in rows
+        ]
+
+    return cached_month(business.id, year, month, compute)
+
+# -------------------------
+# STAFF ASSIGNMENT
+# -------------------------
+def free_staff_slots(day, start):
+    """
+    Free staff slots of `day` starting at `start`, least booked staff member
+    (over the whole day) first. One query: the load is a correlated
+    subquery on timeslot_staff_day_idx.
+    """
+    load = (
+        TimeSlot.objects.filter(staff=OuterRef('staff'), day=OuterRef('day'), booked__gt=0)
+        .order_by().values('staff').annotate(total=Sum('booked')).values('total')
+    )
+    return (
+        TimeSlot.objects.using(day._state.db)
+        .filter(day=day, start=start, is_booked=False, staff__isnull=False)
+        .annotate(load=Coalesce(Subquery(load), 0))
+        .select_related('staff')
+        .order_by('load', 'staff_id')
+    )
+
+
+def book_free_staff(user, day, start):
+    """
+    Book `user` with whichever staff member is free at `start` on `day`.
+    Each candidate is claimed by Appointment.save()'s conditional UPDATE;
+    one taken in the meantime just moves on to the next.
+    Raises ValidationError when the user already has a booking that day or nobody is free.
+    """
+    with transaction.atomic(using=day._state.db):
+        if Appointment.objects.using(day._state.db).filter(client=user, slot__day=day).exists():
+            raise ValidationError("You already have a booking on this day for this business.")
+        for slot in free_staff_slots(day, start):
+            slot.day = day
+            try:
+                return Appointment.objects.create(client=user, slot=slot)
+            except ValidationError:
+                continue
+    raise ValidationError("No staff member is free at that time.")
+
+
+def iter_days_with_bookings(days, appointments, chunk_size=500):
+    """
+    Pair each day of `days` with its appointments, reading both querysets
+    with .iterator() in one pass each instead of loading them whole.
+    `appointments` must come in the order of `days` (see day_ordering()).
+
+    Yields:
+    - (Day, [Appointment, ...]) ordered by slot start
+    """
+    appointments = appointments.select_related('client', 'slot').iterator(chunk_size=chunk_size)
+    pending = next(appointments, None)
+    for day in days.iterator(chunk_size=chunk_size):
+        bookings = []
+        while pending is not None and pending.slot.day_id == day.id:
+            bookings.append(pending)
+            pending = next(appointments, None)
+        yield day, bookings
+
+
+def day_ordering(*fields):
+    """
+    (days, appointments) order_by() arguments sorting days by `fields`
+    (Day fields), then date, and appointments by their day the same way,
+    then slot start, as iter_days_with_bookings() needs.
+    """
+    days = [*fields, 'date', 'id']
+    appointments = [f'slot__day__{field}' for field in days] + ['slot__start', 'id']
+    return days, appointments
+
+
+# -------------------------
+# ARCHIVE
+# -------------------------
+def archive_days_before(cutoff, batch_size=500):
+    """
+    Move Days dated before `cutoff`, with their slots and appointments, into
+    the archive tables, shard by shard. Each batch of days is one
+    transaction: summarized into DayArchive (slot counts only, free slots
+    are not kept), bookings copied to AppointmentArchive, then the live rows
+    deleted.
+
+    Returns:
+    - (days_archived, appointments_archived)
+    """
+    days_archived = 0
+    appointments_archived = 0
+    for alias in shards():
+        with on_shard(alias):
+            days, appointments = archive_shard_days_before(alias, cutoff, batch_size)
+        days_archived += days
+        appointments_archived += appointments
+    return days_archived, appointments_archived
+
+
+def archive_shard_days_before(using, cutoff, batch_size):
+    days_archived = 0
+    appointments_archived = 0
+    while True:
+        with transaction.atomic(using=using):
+            ids = list(
+                Day.objects.filter(date__lt=cutoff).order_by('date', 'id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            summaries = Day.objects.filter(id__in=ids).annotate(
+                total=Count('slots', distinct=True),
+                free=Count('slots', filter=Q(slots__is_booked=False), distinct=True),
+                booked=Count('slots__appointments', distinct=True),
+            ).values_list('business_id', 'date', 'total', 'free', 'booked')
+            DayArchive.objects.bulk_create(
+                [
+                    DayArchive(business_id=b, date=d, total_slots=total, free_slots=free, bookings=booked)
+                    for b, d, total, free, booked in summaries
+                ],
+                update_conflicts=True,
+                unique_fields=['business', 'date'],
+                update_fields=['total_slots', 'free_slots', 'bookings'],
+            )
+
+            bookings = Appointment.objects.filter(slot__day_id__in=ids).values_list(
+                'business_id', 'client_id', 'client__username',
+                'slot__day__date', 'slot__start', 'slot__end', 'created_at',
+            )
+            archived = AppointmentArchive.objects.bulk_create([
+                AppointmentArchive(
+                    business_id=b, client_id=c, client_username=username,
+                    date=d, start=start, end=end, created_at=created,
+                )
+                for b, c, username, d, start, end, created in bookings
+            ])
+
+            # Bottom-up, so each level is a single set-based DELETE
+            Appointment.objects.filter(slot__day_id__in=ids).delete()
+            TimeSlot.objects.filter(day_id__in=ids).delete()
+            Day.objects.filter(id__in=ids).delete()
+
+        days_archived += len(ids)
+        appointments_archived += len(archived)
+    return days_archived, appointments_archived
+
+
+def business_history(business, start=None, end=None):
+    """
+    Per-date slot and booking counts for a business, from the archive and
+    the live tables alike.
+
+    Returns:
+    - list of dicts: date, total_slots, free_slots, bookings, archived
+    """
+    dates = {}
+    if start:
+        dates['date__gte'] = start
+    if end:
+        dates['date__lte'] = end
+
+    using = shard_for_business(business)
+    rows = [
+        {**row, 'archived': True}
+        for row in DayArchive.objects.using(using).filter(business=business, **dates)
+        .values('date', 'total_slots', 'free_slots', 'bookings')
+    ]
+    rows += [
+        {**row, 'archived': False}
+        for row in Day.objects.using(using).filter(business=business, **dates).annotate(
+            total_slots=Count('slots', distinct=True),
+            free_slots=Count('slots', filter=Q(slots__is_booked=False), distinct=True),
+            bookings=Count('slots__appointments', distinct=True),
+        ).values('date', 'total_slots', 'free_slots', 'bookings')
+    ]
+    return sorted(rows, key=lambda row: row['date'])
+
+
+def appointment_history(business):
+    """
+    Every appointment of a business, archived ones first, then live ones,
+    each part ordered by date and start.
+
+    Yields:
+    - dicts: date, start, end, client, created_at, archived
+    """
+    using = shard_for_business(business)
+    archived = AppointmentArchive.objects.using(using).filter(business=business).values_list(
+        'date', 'start', 'end', 'client_username', 'created_at'
+    ).order_by('date', 'start')
+    for date_, start, end, client, created_at in archived.iterator():
+        yield {'date': date_, 'start': start, 'end': end, 'client': client,
+               'created_at': created_at, 'archived': True}
+
+    live = Appointment.objects.using(using).filter(business=business).values_list(
+        'slot__day__date', 'slot__start', 'slot__end', 'client__username', 'created_at'
+    ).order_by('slot__day__date', 'slot__start')
+    for date_, start, end, client, created_at in live.iterator():
+        yield {'date': date_, 'start': start, 'end': end, 'client': client,
+               'created_at': created_at, 'archived': False}
+
+
+# -------------------------
+# REMINDERS
+# -------------------------
+def due_reminders(day):
+    """Appointments on `day` (local date) whose reminder has not been sent yet."""
+    starts = timezone.make_aware(datetime.combine(day, time.min))
+    return Appointment.objects.filter(
+        reminder_sent_at__isnull=True,
+        slot__start_at__gte=starts,
+        slot__start_at__lt=starts + timedelta(days=1),
+    ).exclude(client__email='')
+
+
+def reminder_message(appointment):
+    context = {'client': appointment.client, 'business': appointment.business, 'slot': appointment.slot}
+    return EmailMessage(
+        subject=f"Reminder: {appointment.business.name} on {appointment.slot.date:%b %d} at {appointment.slot.start:%H:%M}",
+        body=render_to_string('appointment/email/reminder.txt', context),
+        to=[appointment.client.email],
+    )
+
+
+def send_reminders(day=None, batch_size=200, connection=None):
+    """
+    Email every client booked on `day` (default: tomorrow) a reminder.
+
+    Shard by shard, due appointments are read in batches of `batch_size`
+    (one select_related query each), sent with one send_messages() call on
+    a single backend connection, then marked with one UPDATE. Already
+    reminded appointments are skipped, so reruns only send what is left; a
+    batch whose sending fails stays unmarked and is retried by the next run.
+
+    Returns:
+    - int: reminders sent
+    """
+    day = day or timezone.localdate() + timedelta(days=1)
+    connection = connection or get_connection()
+    sent = 0
+    with connection:
+        for alias in shards():
+            due = due_reminders(day).using(alias).select_related('client', 'business', 'slot').order_by('id')
+            last_id = 0
+            # Keyset batches rather than one open cursor: SQLite does not
+            # isolate a read from the UPDATEs made on the same connection
+            while batch := list(due.filter(id__gt=last_id)[:batch_size]):
+                sent += connection.send_messages([reminder_message(appointment) for appointment in batch]) or 0
+                Appointment.objects.using(alias).filter(id__in=[a.id for a in batch]).update(
+                    reminder_sent_at=timezone.now()
+                )
+                last_id = batch[-1].id
+    return sent
 
 
 def owner_required(view_func):
@@ -188,17 +691,20 @@ def staff_or_owner_required(view_func):
         business_id = kwargs.get('business_id')
         if business_id:
             business = get_object_or_404(Business, id=business_id)
+        elif kwargs.get('slot_id'):
+            # slot_id -> its business, no join through Day
+            business = get_object_or_404(TimeSlot.objects.select_related('business'), id=kwargs['slot_id']).business
         else:
             # Fall back to day_id -> find the related business
             day_id = kwargs.get('day_id')
             if day_id:
-                day = get_object_or_404(Day, id=day_id)
+                day = get_object_or_404(Day.objects.select_related('business'), id=day_id)
                 business = day.business
             else:
                 messages.error(request, "Business context not found.")
                 return redirect('calendar:dashboard')
 
-        if request.user != business.owner and request.user not in business.staff.all():
+        if request.user.id != business.owner_id and not business.staff.filter(pk=request.user.pk).exists():
             messages.error(request, "You do not have permission to access this page.")
             return redirect('calendar:dashboard')
 
@@ -1,13 +1,44 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
-from .models import Business, UserProfile, Day, TimeSlot, Appointment
-from .forms import UserRegistrationForm, BusinessForm, CreateDayForm, SlotGenerationForm
-from .utils import generate_time_slots, owner_required, staff_or_owner_required
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Prefetch
+from .models import Business, UserProfile, Day, TimeSlot, Appointment, Closure, slot_datetime
+from .forms import UserRegistrationForm, BusinessForm, ClosureForm, CreateDayForm, SlotGenerationForm
+from .utils import (
+    book_free_staff,
+    generate_time_slots,
+    owner_required,
+    staff_or_owner_required,
+    days_with_free_slots,
+    day_ordering,
+    iter_days_with_bookings,
+    appointment_history,
+    month_availability,
+    close_business,
+    reopen_closure,
+)
+from .search import search_businesses
+from .streaming import stream_page
+from .throttling import rate_limited
+from .booking_queue import run_booking
 from django.contrib.auth.models import User, Group
+import calendar
+import csv
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.http import urlencode
 from .forms import CreateDayForm
-from datetime import date
+from .metrics import registry, BOOKING_CONFLICTS
+from .sharding import fan_out, group_by_shard, is_sharded, prefetch_by_shard, shard_for_business, shards
+from .rollups import total, utilization_by_day, utilization_by_month, utilization_by_week
+from .outbox import event_json, feed_bounds, read_feed, record_event, record_slot_events
+from .live import business_channel, day_channel, event_stream, get_hub, publish_slot_change, stream_start
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from datetime import date, time, timedelta
+from django.utils import timezone
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
 
 
 
@@ -75,25 +106,27 @@ def create_day(request, business_id):
 @login_required
 @staff_or_owner_required
 def generate_slots(request, day_id):
-    day = get_object_or_404(Day, id=day_id)
-    if request.user != day.business.owner:
+    day = get_object_or_404(Day.objects.select_related('business'), id=day_id)
+    if request.user.id != day.business.owner_id:
         messages.error(request, "You do not have permission to generate slots for this business.")
         return redirect('calendar:dashboard')
 
     if request.method == 'POST':
-        form = SlotGenerationForm(request.POST)
+        form = SlotGenerationForm(request.POST, business=day.business)
         if form.is_valid():
             count = generate_time_slots(
                 day=day,
                 start_time=form.cleaned_data['start_time'],
                 end_time=form.cleaned_data['end_time'],
                 interval=form.cleaned_data['interval_minutes'],
-                breaks=form.cleaned_data['breaks']
+                breaks=form.cleaned_data['breaks'],
+                capacity=form.cleaned_data['capacity'],
+                staff=form.cleaned_data['staff'],
             )
             messages.success(request, f"{count} slots generated for {day.date}.")
             return redirect('calendar:day_detail', day_id=day.id)
     else:
-        form = SlotGenerationForm()
+        form = SlotGenerationForm(business=day.business)
     return render(request, 'appointment/slot_generation_form.html', {'form': form, 'day': day})
 
 
@@ -108,8 +141,9 @@ from django.contrib.auth.decorators import login_required
 from .models import TimeSlot, Appointment
 
 @login_required
+@rate_limited('book')
 def book_slot(request, slot_id):
-    slot = get_object_or_404(TimeSlot, id=slot_id)
+    slot = get_object_or_404(TimeSlot.objects.select_related('day'), id=slot_id)
     profile = request.user.profile
 
     # Only clients can book
@@ -119,17 +153,23 @@ def book_slot(request, slot_id):
 
     # Only one booking per day per client
     if Appointment.objects.filter(client=request.user, slot__day=slot.day).exists():
+        BOOKING_CONFLICTS.inc(reason='client_has_booking')
         messages.error(request, f"You already have a booking on {slot.day.date}.")
         return redirect('calendar:day_detail', day_id=slot.day.id)
 
     if request.method == 'POST':
+        def claim():
+            # Concurrency-safe creation handled inside Appointment.save()
+            appointment = Appointment.objects.create(client=request.user, slot=slot)
+            publish_slot_change(slot, 'slot_booked')
+            return appointment
+
         try:
-            with transaction.atomic():
-                # Concurrency-safe creation handled inside Appointment.save()
-                Appointment.objects.create(client=request.user, slot=slot)
-                messages.success(request, f"Slot booked: {slot.start}-{slot.end} on {slot.day.date}.")
+            run_booking(slot._state.db, claim)
+            messages.success(request, f"Slot booked: {slot.start}-{slot.end} on {slot.day.date}.")
             return redirect('calendar:day_detail', day_id=slot.day.id)
         except ValidationError as e:
+            BOOKING_CONFLICTS.inc(reason='slot_taken')
             messages.error(request, e.messages[0])
             return redirect('calendar:day_detail', day_id=slot.day.id)
         except Exception as e:
@@ -140,6 +180,37 @@ def book_slot(request, slot_id):
     return render(request, 'appointment/confirm_booking.html', {'slot': slot})
 
 
+@login_required
+@rate_limited('book')
+def book_any_staff(request, day_id):
+    """POST start=HH:MM: book whichever staff member is free then, least booked first."""
+    day = get_object_or_404(Day, id=day_id)
+    if request.method != 'POST' or request.user.profile.role != 'client':
+        messages.error(request, "Only clients can book appointments.")
+        return redirect('calendar:day_detail', day_id=day.id)
+    try:
+        start = time.fromisoformat(request.POST.get('start', ''))
+    except ValueError:
+        messages.error(request, "Pick a time to book.")
+        return redirect('calendar:day_detail', day_id=day.id)
+
+    def claim():
+        appointment = book_free_staff(request.user, day, start)
+        publish_slot_change(appointment.slot, 'slot_booked')
+        return appointment
+
+    try:
+        appointment = run_booking(day._state.db, claim)
+    except ValidationError as e:
+        BOOKING_CONFLICTS.inc(reason='no_staff_free')
+        messages.error(request, e.messages[0])
+        return redirect('calendar:day_detail', day_id=day.id)
+
+    slot = appointment.slot
+    messages.success(request, f"Booked {slot.start}-{slot.end} on {day.date} with {slot.staff.username}.")
+    return redirect('calendar:day_detail', day_id=day.id)
+
+
 
 
 # -------------------------
@@ -151,51 +222,44 @@ def dashboard(request):
     profile = user.profile
 
     if profile.role == 'owner':
-        # Owner sees all their businesses and bookings
-        businesses = Business.objects.filter(owner=user).prefetch_related('days__slots__appointments')
-        business_data = []
-
-        for business in businesses:
-            business_info = {
-                'business': business,
-                'days': []
-            }
-            for day in business.days.all().order_by('date'):
-                day_info = {
-                    'day': day,
-                    'available_slots': day.slots.filter(is_booked=False).count(),
-                    'bookings': Appointment.objects.filter(slot__day=day).select_related('client', 'slot').order_by('slot__start')
-                }
-                business_info['days'].append(day_info)
-            business_data.append(business_info)
-
-        return render(request, 'appointment/dashboard_owner.html', {'business_data': business_data})
+        # Owner sees all their businesses and bookings, streamed day by day
+        businesses = list(Business.objects.filter(owner=user).order_by('name', 'id'))
+        return stream_page(request, 'appointment/dashboard_owner.html', {'businesses': businesses}, owner_dashboard_sections(
+            businesses, get_token(request),
+        ))
 
     else:
         # Client sees only their appointments and available days
-        appointments = Appointment.objects.filter(client=user).select_related('slot__day__business').order_by('slot__day__date', 'slot__start')
+        appointments = fan_out(
+            Appointment.objects.filter(client=user).select_related('slot', 'business').order_by('slot__start_at')
+        )
+        if is_sharded():
+            appointments.sort(key=lambda appt: appt.slot.start_at)
         grouped_appointments = {}
         for appt in appointments:
-            business = appt.slot.day.business
+            business = appt.business
             if business not in grouped_appointments:
                 grouped_appointments[business] = []
             grouped_appointments[business].append(appt)
 
         # Optionally, show available days per business
-        businesses = Business.objects.all().prefetch_related('days__slots')
+        businesses = list(Business.objects.all())
+        prefetch_by_shard(businesses, Prefetch(
+            'days',
+            queryset=days_with_free_slots().filter(available_slots__gt=0).order_by('date'),
+            to_attr='open_days'
+        ))
         business_data = []
         for business in businesses:
             business_info = {
                 'business': business,
                 'available_days': []
             }
-            for day in business.days.all().order_by('date'):
-                available_slots = day.slots.filter(is_booked=False)
-                if available_slots.exists():
-                    business_info['available_days'].append({
-                        'day': day,
-                        'available_slots_count': available_slots.count()
-                    })
+            for day in business.open_days:
+                business_info['available_days'].append({
+                    'day': day,
+                    'available_slots_count': day.available_slots
+                })
             business_data.append(business_info)
 
         return render(request, 'appointment/dashboard_client.html', {
@@ -204,6 +268,37 @@ def dashboard(request):
         })
 
 
+def owner_dashboard_sections(businesses, csrf_token):
+    """
+    HTML of the owner dashboard, business by business and day by day. The
+    days and bookings of each shard are read with one pair of iterators in
+    the order of `businesses` (by name), so a shard costs two queries.
+    """
+    day_order, appointment_order = day_ordering('business__name', 'business_id')
+    streams = {}
+    for alias, group in group_by_shard(businesses).items():
+        days = days_with_free_slots().using(alias).filter(business__in=group).order_by(*day_order)
+        appointments = Appointment.objects.using(alias).filter(business__in=group).order_by(*appointment_order)
+        streams[alias] = iter_days_with_bookings(days, appointments)
+    pending = {}
+
+    for business in businesses:
+        alias = shard_for_business(business)
+        yield render_to_string('appointment/partials/_dashboard_business.html', {'business': business})
+        has_days = False
+        while True:
+            if alias not in pending:
+                pending[alias] = next(streams[alias], None)
+            if pending[alias] is None or pending[alias][0].business_id != business.id:
+                break
+            day, bookings = pending.pop(alias)
+            has_days = True
+            yield render_to_string('appointment/partials/_dashboard_day.html', {
+                'day': day, 'bookings': bookings, 'csrf_token': csrf_token,
+            })
+        yield render_to_string('appointment/partials/_dashboard_business_end.html', {'has_days': has_days})
+
+
 # -------------------------
 # BUSINESS DETAIL
 # -------------------------
@@ -212,32 +307,30 @@ def business_detail(request, business_id):
     business = get_object_or_404(Business, id=business_id)
     profile = request.user.profile
 
-    # Owners see all bookings for their business
-    if profile.role == 'owner' and business.owner == request.user:
-        days_info = []
-        for day in business.days.all().order_by('date'):
-            bookings = Appointment.objects.filter(slot__day=day).select_related('client', 'slot').order_by('slot__start')
-            available_slots = day.slots.filter(is_booked=False).count()
-            days_info.append({
-                'day': day,
-                'available_slots': available_slots,
-                'bookings': bookings
-            })
-        return render(request, 'appointment/business_detail_owner.html', {
-            'business': business,
-            'days_info': days_info
-        })
+    # Owners see all bookings for their business, streamed day by day
+    if profile.role == 'owner' and business.owner_id == request.user.id:
+        shard = shard_for_business(business)
+        day_order, appointment_order = day_ordering()
+        days = days_with_free_slots().using(shard).filter(business=business).order_by(*day_order)
+        appointments = Appointment.objects.using(shard).filter(business=business).order_by(*appointment_order)
+        sections = (
+            render_to_string('appointment/partials/_owner_day.html', {'day': day, 'bookings': bookings})
+            for day, bookings in iter_days_with_bookings(days, appointments)
+        )
+        return stream_page(request, 'appointment/business_detail_owner.html', {'business': business}, sections,
+                           empty='<p>No days created yet.</p>')
 
     # Clients see only available slots
     elif profile.role == 'client':
+        days = days_with_free_slots().filter(business=business, available_slots__gt=0).order_by('date').prefetch_related(
+            Prefetch('slots', queryset=TimeSlot.objects.filter(is_booked=False), to_attr='free_slots')
+        )
         days_info = []
-        for day in business.days.all().order_by('date'):
-            available_slots = day.slots.filter(is_booked=False)
-            if available_slots.exists():
-                days_info.append({
-                    'day': day,
-                    'available_slots': available_slots
-                })
+        for day in days:
+            days_info.append({
+                'day': day,
+                'available_slots': day.free_slots
+            })
         return render(request, 'appointment/business_detail_client.html', {
             'business': business,
             'days_info': days_info
@@ -252,15 +345,18 @@ def business_detail(request, business_id):
 # DAY DETAIL
 # -------------------------
 @login_required
+@rate_limited('availability')
 def day_detail(request, day_id):
-    day = get_object_or_404(Day, id=day_id)
+    day = get_object_or_404(Day.objects.select_related('business'), id=day_id)
     profile = request.user.profile
 
-    if profile.role == 'owner' and day.business.owner == request.user:
+    if profile.role == 'owner' and day.business.owner_id == request.user.id:
         # Owner sees all bookings for this day
-        bookings = Appointment.objects.filter(slot__day=day).select_related('client', 'slot').order_by('slot__start')
         slots_info = []
-        for slot in day.slots.all().order_by('start'):
+        slots = day.slots.select_related('staff').prefetch_related(
+            Prefetch('appointments', queryset=Appointment.objects.select_related('client'))
+        ).order_by('start')
+        for slot in slots:
             slots_info.append({
                 'slot': slot,
                 'bookings': slot.appointments.all()
@@ -272,11 +368,18 @@ def day_detail(request, day_id):
 
     elif profile.role == 'client':
         # Client sees their booking for this day and available slots
-        client_booking = Appointment.objects.filter(client=request.user, slot__day=day).first()
-        available_slots = day.slots.filter(is_booked=False)
+        client_booking = Appointment.objects.filter(client=request.user, slot__day=day).select_related('slot').first()
+        available_slots = list(day.slots.filter(is_booked=False).select_related('staff'))
+        # "Any staff member": free staff slots combined per time, from the same rows
+        staff_times = {}
+        for slot in available_slots:
+            if slot.staff_id is not None:
+                entry = staff_times.setdefault(slot.start, {'start': slot.start, 'end': slot.end, 'free': 0})
+                entry['free'] += slot.places_left
         return render(request, 'appointment/day_detail_client.html', {
             'day': day,
             'available_slots': available_slots,
+            'staff_times': list(staff_times.values()),
             'client_booking': client_booking
         })
 
@@ -284,32 +387,37 @@ def day_detail(request, day_id):
         return render(request, 'appointment/error.html', {'message': 'You do not have permission to view this day.'})
 
 @login_required
+@rate_limited('cancel')
 def cancel_booking_view(request, slot_id):
-    slot = get_object_or_404(TimeSlot, id=slot_id)
+    slot = get_object_or_404(TimeSlot.objects.select_related('business'), id=slot_id)
+    profile = request.user.profile
 
-    try:
-        appointment = Appointment.objects.get(slot=slot)
-    except Appointment.DoesNotExist:
+    # A slot with capacity holds several bookings: a client cancels their
+    # own, the owner the one posted as `appointment`
+    appointments = Appointment.objects.select_related('client').filter(slot=slot).order_by('id')
+    if profile.role == 'client':
+        appointments = appointments.filter(client=request.user)
+    elif request.POST.get('appointment', '').isdigit():
+        appointments = appointments.filter(id=request.POST['appointment'])
+    appointment = appointments.first()
+    if appointment is None:
         messages.error(request, "No booking exists for this slot.")
         return redirect('calendar:dashboard')
-
-    profile = request.user.profile
+    appointment.slot = slot
 
     # Client cancels their own booking
-    if profile.role == 'client' and appointment.client == request.user:
-        appointment.delete()
-        slot.is_booked = False
-        slot.save()
-        messages.success(request, f"Your booking on {slot.day.date} at {slot.start} has been canceled.")
+    if profile.role == 'client' and appointment.client_id == request.user.id:
+        appointment.delete()  # gives the place back
+        publish_slot_change(slot, 'slot_freed')
+        messages.success(request, f"Your booking on {slot.date} at {slot.start} has been canceled.")
         return redirect('calendar:dashboard')
 
     # Owner/Staff cancels a client's booking for their business
-    elif profile.role in ['owner', 'staff'] and slot.day.business in request.user.owned_businesses.all():
+    elif profile.role in ['owner', 'staff'] and slot.business.owner_id == request.user.id:
         appointment.delete()
-        slot.is_booked = False
-        slot.save()
-        messages.success(request, f"Booking for {appointment.client.username} on {slot.day.date} at {slot.start} has been canceled by the business.")
-        return redirect('calendar:owner_dashboard', business_id=slot.day.business.id)
+        publish_slot_change(slot, 'slot_freed')
+        messages.success(request, f"Booking for {appointment.client.username} on {slot.date} at {slot.start} has been canceled by the business.")
+        return redirect('calendar:owner_dashboard', business_id=slot.business_id)
 
     # Unauthorized
     else:
@@ -318,24 +426,64 @@ def cancel_booking_view(request, slot_id):
 
     
 
+BUSINESS_PAGE_SIZE = 50
+
+
+def business_page(request):
+    """
+    One page of businesses: with ?q=, the search matches (best first, paged
+    with ?offset=); without, every business by name (paged with ?after=<name>,
+    an index range scan however deep the page).
+
+    Returns:
+    - (list of Business, query string of the next page or None)
+    """
+    query = request.GET.get('q', '').strip()
+    limit = min(api_int(request, 'limit', BUSINESS_PAGE_SIZE), API_MAX_PAGE_SIZE) or BUSINESS_PAGE_SIZE
+    if query:
+        offset = api_int(request, 'offset', 0)
+        page = search_businesses(query, limit + 1, offset)
+        following = {'q': query, 'offset': offset + limit}
+    else:
+        businesses = Business.objects.order_by('name')
+        if request.GET.get('after'):
+            businesses = businesses.filter(name__gt=request.GET['after'])
+        page = list(businesses[:limit + 1])
+        following = {'after': page[limit - 1].name} if len(page) > limit else None
+    if len(page) <= limit:
+        return page, None
+    return page[:limit], urlencode({**following, 'limit': limit})
+
+
+def business_search(request):
+    """Businesses as JSON for the signup and business list autocompletes. Open to anonymous users."""
+    page, following = business_page(request)
+    return JsonResponse({
+        'results': [{'id': b.id, 'name': b.name, 'description': b.description or ''} for b in page],
+        'next': following,
+    })
+
+
 @login_required
 def business_list(request):
     """
     Show businesses depending on user role:
     - Owner: only their own businesses
-    - Client: all businesses available to book
+    - Client: businesses available to book, a page at a time (searchable)
     """
     profile = request.user.profile
 
     if profile.role == 'owner':
         # Owners see only their businesses
         businesses = Business.objects.filter(owner=request.user).order_by('name')
+        following = None
     else:
-        # Clients see all businesses
-        businesses = Business.objects.all().order_by('name')
+        businesses, following = business_page(request)
 
     return render(request, 'appointment/business_list.html', {
-        'businesses': businesses
+        'businesses': businesses,
+        'query': request.GET.get('q', ''),
+        'next': following,
     })
 
 
@@ -367,8 +515,13 @@ def add_staff(request, business_id):
             messages.error(request, "User does not exist.")
             return redirect("calendar:add_staff", business_id=business.id)
 
-        # Assign to business staff
-        business.staff.add(user)
+        # Assign to business staff. The membership lives on the default database,
+        # the change feed event on the business's shard: one transaction on each,
+        # the shard's committing last so the event never announces a rolled back change
+        shard = shard_for_business(business)
+        with transaction.atomic(using=shard), transaction.atomic(using=DEFAULT_DB_ALIAS):
+            business.staff.add(user)
+            record_event(business.id, 'staff_added', {'user': user.id, 'username': user.username}, shard)
 
         # Assign Django permissions group
         staff_group = Group.objects.get(name="Business Staff")
@@ -387,7 +540,7 @@ def owner_permissions(request, business_id):
     business = get_object_or_404(Business, id=business_id, owner=request.user)
 
     group = Group.objects.get(name="Business Staff")
-    permissions = group.permissions.all()
+    permissions = group.permissions.select_related('content_type')
 
     return render(request, "appointment/owner_permissions.html", {
         "business": business,
@@ -401,11 +554,15 @@ def business_detail_staff(request, business_id):
     business = get_object_or_404(Business, id=business_id)
 
     # Permission: owner or assigned staff only
-    if request.user != business.owner and request.user not in business.staff.all():
+    if request.user.id != business.owner_id and not business.staff.filter(pk=request.user.pk).exists():
         messages.error(request, "You do not have access to this business.")
         return redirect("calendar:dashboard")
 
-    days = business.days.order_by("date")
+    days = business.days.order_by("date").prefetch_related(
+        Prefetch('slots', queryset=TimeSlot.objects.prefetch_related(
+            Prefetch('appointments', queryset=Appointment.objects.select_related('client'))
+        ))
+    )
 
     return render(request, "appointment/business_detail_staff.html", {
         "business": business,
@@ -425,13 +582,20 @@ def remove_staff(request, business_id, user_id):
         return redirect("calendar:owner_dashboard", business_id=business.id)
 
     # Check that the user *is* staff of this business
-    if staff_user not in business.staff.all():
+    if not business.staff.filter(pk=staff_user.pk).exists():
         messages.error(request, "This user is not a staff member of your business.")
         return redirect("calendar:owner_dashboard", business_id=business.id)
 
     if request.method == "POST":
-        # Remove from business staff
-        business.staff.remove(staff_user)
+        # Remove from business staff, with the slots nobody booked on their calendar
+        # (membership on the default database, the rest on the shard: see add_staff)
+        shard = shard_for_business(business)
+        with transaction.atomic(using=shard), transaction.atomic(using=DEFAULT_DB_ALIAS):
+            business.staff.remove(staff_user)
+            record_event(business.id, 'staff_removed', {'user': staff_user.id, 'username': staff_user.username}, shard)
+            unused = TimeSlot.objects.using(shard).filter(business=business, staff=staff_user, booked=0)
+            record_slot_events(unused, 'slots_deleted')
+            unused.delete()
 
         # Remove from Django permissions group
         try:
@@ -475,3 +639,390 @@ def create_day(request, business_id):
 
     # GET request: show a form
     return render(request, 'appointment/create_day.html', {'business': business})
+
+
+# -------------------------
+# MONTH HEATMAP
+# -------------------------
+def month_param(request):
+    """
+    First day of the ?month=YYYY-MM month, the current one when absent,
+    malformed or in the first or last supported year (the pages step to
+    the weeks and months around it).
+    """
+    try:
+        first = date.fromisoformat(request.GET['month'] + '-01') if request.GET.get('month') else timezone.localdate()
+    except ValueError:
+        first = timezone.localdate()
+    if not date.min.year < first.year < date.max.year:
+        first = timezone.localdate()
+    return first.replace(day=1)
+
+
+@login_required
+@rate_limited('availability')
+def business_month(request, business_id):
+    """Month calendar of a business, each date shaded by its share of free slots. ?month=YYYY-MM"""
+    business = get_object_or_404(Business, id=business_id)
+    first = month_param(request)
+
+    by_date = {row['date']: row for row in month_availability(business, first.year, first.month)}
+    weeks = []
+    for week in calendar.Calendar().monthdatescalendar(first.year, first.month):
+        cells = []
+        for day_date in week:
+            row = by_date.get(day_date) if day_date.month == first.month else None
+            # 0 (nothing free) .. 4 (all free)
+            level = round(4 * row['free'] / row['total']) if row else None
+            cells.append({'date': day_date, 'in_month': day_date.month == first.month, 'row': row, 'level': level})
+        weeks.append(cells)
+
+    previous = (first - timedelta(days=1)).replace(day=1)
+    following = (first + timedelta(days=31)).replace(day=1)
+    return render(request, 'appointment/business_month.html', {
+        'business': business,
+        'month': first,
+        'weeks': weeks,
+        'previous': previous.strftime('%Y-%m'),
+        'following': following.strftime('%Y-%m'),
+    })
+
+
+# -------------------------
+# HISTORY EXPORT
+# -------------------------
+class Echo:
+    """File-like object for csv.writer that hands each row back instead of buffering it."""
+    def write(self, value):
+        return value
+
+
+@login_required
+@owner_required
+def business_history_export(request, business_id):
+    """CSV of every appointment of the business, archived and live."""
+    business = get_object_or_404(Business, id=business_id, owner=request.user)
+    writer = csv.writer(Echo())
+
+    def rows():
+        yield writer.writerow(['date', 'start', 'end', 'client', 'booked_at', 'archived'])
+        for row in appointment_history(business):
+            yield writer.writerow([
+                row['date'], row['start'], row['end'], row['client'], row['created_at'], row['archived']
+            ])
+
+    response = StreamingHttpResponse(rows(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="business-{business.id}-history.csv"'
+    return response
+
+
+# -------------------------
+# ANALYTICS
+# -------------------------
+@login_required
+@owner_required
+def business_analytics(request, business_id):
+    """
+    Utilization, booking lead time and cancellations per day and week of a
+    month and per month of the year to it, read from the rollups only
+    (see appointment.rollups). ?month=YYYY-MM
+    """
+    business = get_object_or_404(Business, id=business_id, owner=request.user)
+    shard = shard_for_business(business)
+    first = month_param(request)
+    following = (first + timedelta(days=31)).replace(day=1)
+
+    # Whole weeks around the month, so the first and last week add up
+    start = first - timedelta(days=first.weekday())
+    end = following + timedelta(days=-following.weekday() % 7)
+    days = utilization_by_day(business, start, end, shard)
+    in_month = [row for row in days if first <= row['date'] < following]
+    # The twelve months up to this one
+    year, month = divmod(first.year * 12 + first.month - 12, 12)
+    months = utilization_by_month(business, date(year, month + 1, 1), following, shard)
+
+    return render(request, 'appointment/business_analytics.html', {
+        'business': business,
+        'month': first,
+        'days': in_month,
+        'month_total': total(in_month),
+        'weeks': utilization_by_week(days),
+        'months': months,
+        'previous': (first - timedelta(days=1)).strftime('%Y-%m'),
+        'following': following.strftime('%Y-%m'),
+    })
+
+
+# -------------------------
+# CLOSURES
+# -------------------------
+@login_required
+@owner_required
+def business_closures(request, business_id):
+    """
+    Upcoming closures of a business, and a form closing it (or one staff
+    member) for a period. Bookings inside the period are listed for the
+    owner to deal with; they are not cancelled.
+    """
+    business = get_object_or_404(Business, id=business_id, owner=request.user)
+    shard = shard_for_business(business)
+
+    if request.method == 'POST':
+        form = ClosureForm(request.POST, business=business)
+        if form.is_valid():
+            _, blocked, conflicts = close_business(
+                business, form.ranges(), staff=form.cleaned_data['staff'], reason=form.cleaned_data['reason'],
+            )
+            messages.success(request, f"Closed: {blocked} slots taken out of availability.")
+            if conflicts:
+                listed = ', '.join(
+                    f"{appt.client.username} on {appt.slot.date} at {appt.slot.start:%H:%M}" for appt in conflicts[:10]
+                )
+                more = f" and {len(conflicts) - 10} more" if len(conflicts) > 10 else ""
+                messages.warning(request, f"{len(conflicts)} bookings fall in the closure: {listed}{more}.")
+            return redirect('calendar:business_closures', business_id=business.id)
+    else:
+        form = ClosureForm(business=business)
+
+    closures = Closure.objects.using(shard).filter(business=business, end_at__gt=timezone.now()).select_related('staff')
+    return render(request, 'appointment/business_closures.html', {
+        'business': business,
+        'form': form,
+        'closures': closures,
+    })
+
+
+@login_required
+@owner_required
+def reopen_business_closure(request, business_id, closure_id):
+    business = get_object_or_404(Business, id=business_id, owner=request.user)
+    if request.method != 'POST':
+        return redirect('calendar:business_closures', business_id=business.id)
+    closure = get_object_or_404(Closure.objects.using(shard_for_business(business)), id=closure_id, business=business)
+    reopened = reopen_closure(closure)
+    messages.success(request, f"Reopened: {reopened} slots are available again.")
+    return redirect('calendar:business_closures', business_id=business.id)
+
+
+# -------------------------
+# METRICS
+# -------------------------
+def metrics(request):
+    """Prometheus text exposition of the in-process metrics registry."""
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# -------------------------
+# ASYNC READ API
+# -------------------------
+# Read-only JSON endpoints written as async views. Under ASGI (see asgi.py)
+# a request waiting on the database does not hold a worker thread.
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+
+def api_int(request, name, default):
+    """Non-negative int from the query string; `default` when absent, blank or malformed."""
+    value = request.GET.get(name)
+    if not value:
+        return default
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return default
+
+
+def api_date(request, name):
+    """ISO date from the query string, None when absent. Raises ValueError if malformed."""
+    value = request.GET.get(name)
+    return date.fromisoformat(value) if value else None
+
+
+def slot_json(slot):
+    return {'id': slot.id, 'start': slot.start.isoformat(), 'end': slot.end.isoformat(), 'places_left': slot.places_left}
+
+
+@login_required
+async def api_business_list(request):
+    """
+    Businesses as JSON, paginated with ?offset= and ?limit=.
+    Owners get their own businesses, clients all of them (like business_list).
+    """
+    user = await request.auser()
+    profile = await UserProfile.objects.filter(user=user).afirst()
+    businesses = Business.objects.order_by('name')
+    if profile and profile.role == 'owner':
+        businesses = businesses.filter(owner=user)
+
+    offset = api_int(request, 'offset', 0)
+    limit = min(api_int(request, 'limit', API_PAGE_SIZE), API_MAX_PAGE_SIZE)
+    results = [
+        {'id': b.id, 'name': b.name, 'description': b.description}
+        async for b in businesses[offset:offset + limit]
+    ]
+    return JsonResponse({'count': await businesses.acount(), 'offset': offset, 'results': results})
+
+
+@login_required
+@rate_limited('availability')
+async def api_business_availability(request, business_id):
+    """Upcoming days of a business with their number of free slots."""
+    business = await aget_object_or_404(Business, id=business_id)
+    days = days_with_free_slots().filter(business=business, date__gte=date.today()).order_by('date')
+    return JsonResponse({
+        'business': {'id': business.id, 'name': business.name},
+        'days': [
+            {'id': day.id, 'date': day.date.isoformat(), 'available_slots': day.available_slots,
+             'available_places': day.available_places}
+            async for day in days
+        ],
+    })
+
+
+@login_required
+@rate_limited('availability')
+async def api_day_availability(request, day_id):
+    """Free slots of one day."""
+    day = await aget_object_or_404(Day, id=day_id)
+    slots = TimeSlot.objects.filter(day=day, is_booked=False).order_by('start')
+    return JsonResponse({
+        'day': {'id': day.id, 'date': day.date.isoformat(), 'business': day.business_id},
+        'slots': [slot_json(slot) async for slot in slots],
+    })
+
+
+@login_required
+async def api_slot_search(request):
+    """
+    Free slots across businesses, earliest first.
+
+    Query parameters: business (id), date_from, date_to (ISO dates; without
+    date_from the search starts now) and limit.
+    """
+    try:
+        date_from = api_date(request, 'date_from')
+        date_to = api_date(request, 'date_to')
+    except ValueError:
+        return JsonResponse({'error': "Dates must be in YYYY-MM-DD format."}, status=400)
+
+    # A range scan on timeslot_free_start_at_idx, no join to Day to filter or sort
+    starts = slot_datetime(date_from, time.min) if date_from else timezone.now()
+    slots = TimeSlot.objects.filter(is_booked=False, start_at__gte=starts)
+    if date_to:
+        slots = slots.filter(start_at__lt=slot_datetime(date_to + timedelta(days=1), time.min))
+    business_id = api_int(request, 'business', None)
+    if business_id is not None:
+        slots = slots.filter(business_id=business_id)
+    limit = min(api_int(request, 'limit', API_PAGE_SIZE), API_MAX_PAGE_SIZE)
+
+    # The first `limit` of each shard, merged
+    slots = slots.order_by('start_at', 'id')[:limit]
+    results = [slot for alias in shards() async for slot in slots.using(alias)]
+    if is_sharded():
+        results = sorted(results, key=lambda slot: (slot.start_at, slot.id))[:limit]
+    return JsonResponse({
+        'results': [
+            {**slot_json(slot), 'date': slot.date.isoformat(), 'day': slot.day_id,
+             'business': slot.business_id}
+            for slot in results
+        ],
+    })
+
+
+@login_required
+async def api_business_changes(request, business_id):
+    """
+    Change feed of a business for its owner and staff (see appointment.outbox).
+
+    ?after=<cursor> returns up to ?limit= events after it, oldest first, with
+    the cursor to send next and whether more are waiting. Without ?after the
+    response only carries the current cursor. 410 when the cursor expired.
+    """
+    user = await request.auser()
+    business = await aget_object_or_404(Business, id=business_id)
+    if user.id != business.owner_id and not await business.staff.filter(pk=user.pk).aexists():
+        return JsonResponse({'error': "You do not have access to this business."}, status=403)
+    shard = shard_for_business(business)
+
+    after = api_int(request, 'after', None)
+    if after is None:
+        _, head = await sync_to_async(feed_bounds)(shard)
+        return JsonResponse({'business': business.id, 'cursor': head or 0})
+
+    limit = max(min(api_int(request, 'limit', API_PAGE_SIZE), API_MAX_PAGE_SIZE), 1)
+    feed = await sync_to_async(read_feed)(business.id, after, limit, shard)
+    if feed is None:
+        return JsonResponse({'error': "This cursor has expired, take a new snapshot."}, status=410)
+    events, cursor, has_more = feed
+    return JsonResponse({
+        'business': business.id,
+        'events': [event_json(event) for event in events],
+        'cursor': cursor,
+        'has_more': has_more,
+    })
+
+
+# -------------------------
+# LIVE AVAILABILITY (SSE)
+# -------------------------
+def event_response(subscription, snapshot):
+    if subscription is None:
+        response = HttpResponse(stream_start(snapshot), content_type='text/event-stream')
+    else:
+        response = StreamingHttpResponse(event_stream(subscription, snapshot), content_type='text/event-stream')
+        response['X-Accel-Buffering'] = 'no'  # keep nginx from buffering the stream
+        # A stream closed before its first chunk never reaches event_stream()'s finally
+        response._resource_closers.append(subscription.close)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def last_event_id(request):
+    try:
+        return int(request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        return None
+
+
+async def live_response(request, channel, snapshot):
+    """
+    event_response() for `channel` with the result of the `snapshot`
+    coroutine, awaited after subscribing so no change falls in between.
+    Under WSGI a long-lived stream would hold a worker thread, so there the
+    response is the snapshot alone and the browser re-polls after `retry`.
+    """
+    subscription = None
+    try:
+        if isinstance(request, ASGIRequest):
+            subscription = await get_hub().subscribe(channel, last_event_id(request))
+        data = await snapshot
+    except BaseException:
+        snapshot.close()  # not awaited when subscribing failed
+        if subscription is not None:
+            subscription.close()
+        raise
+    return event_response(subscription, data)
+
+
+async def free_slots_snapshot(day):
+    free = TimeSlot.objects.filter(day=day, is_booked=False).order_by('start')
+    return {'day': day.id, 'free_slots': [slot.id async for slot in free]}
+
+
+async def free_days_snapshot(business):
+    days = days_with_free_slots().filter(business=business, date__gte=date.today()).order_by('date')
+    return {'business': business.id, 'days': {day.id: day.available_slots async for day in days}}
+
+
+@login_required
+async def day_events(request, day_id):
+    """SSE stream of the slot events of one day (see appointment.live), after a snapshot of its free slots."""
+    day = await aget_object_or_404(Day, id=day_id)
+    return await live_response(request, day_channel(day.id), free_slots_snapshot(day))
+
+
+@login_required
+async def business_events(request, business_id):
+    """SSE stream of slot events across a business, after a snapshot of free slots per upcoming day."""
+    business = await aget_object_or_404(Business, id=business_id)
+    return await live_response(request, business_channel(business.id), free_days_snapshot(business))
@@ -5,6 +5,14 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The availability API (appointment.views, "ASYNC READ API") is written as
+async views and only pays off when served from here, e.g.:
+
+    uvicorn calendarsys.asgi:application --workers 4
+
+Under WSGI the same views still work, each one run in its own event loop.
+`manage.py bench_concurrency` compares the two paths.
 """
 
 import os
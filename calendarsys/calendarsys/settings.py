@@ -42,6 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'appointment.middleware.PerformanceMiddleware',
+    'appointment.middleware.ProfilingMiddleware',
+    'appointment.middleware.ConcurrencyLimitMiddleware',  # only with APPOINTMENT_MAX_CONCURRENT_REQUESTS
+    'appointment.middleware.ShardMiddleware',  # only with APPOINTMENT_SHARDS
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +59,8 @@ ROOT_URLCONF = 'calendarsys.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to PerformanceMiddleware
+        'BACKEND': 'appointment.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -78,7 +83,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Second shard: unused until APPOINTMENT_SHARDS lists it (settings_sharded);
+    # the tests also run the sharded booking paths against it
+    'shard1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-shard1.sqlite3',
+    },
 }
 
 
@@ -127,4 +138,42 @@ LOGIN_REDIRECT_URL = '/appointment/dashboard/'  # or use name: reverse_lazy('das
 LOGIN_URL = '/login/'  # default login page
 LOGOUT_REDIRECT_URL = '/'  # or 'dashboard' or any other page
 
-
+# Slow-request profiling (appointment.middleware.ProfilingMiddleware).
+# Off unless a threshold or a sample rate is set; read the dumps with
+# `python manage.py profile_summary`.
+APPOINTMENT_PROFILE_THRESHOLD_MS = None  # e.g. 1000
+APPOINTMENT_PROFILE_SAMPLE_RATE = 0.0    # fraction of all requests
+APPOINTMENT_PROFILER = 'sampling'        # or 'cprofile'
+APPOINTMENT_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# Live availability over Server-Sent Events (appointment.live).
+# LocalHub only reaches subscribers in the same process; with several
+# workers use 'appointment.live.CacheHub' and a shared cache.
+APPOINTMENT_LIVE_BACKEND = 'appointment.live.LocalHub'
+APPOINTMENT_LIVE_HEARTBEAT = 15   # seconds between keepalive comments
+APPOINTMENT_LIVE_MAX_AGE = 300    # seconds before a stream is closed and reopened
+
+# Cached month availability heatmaps (appointment.availability). With
+# several workers point the alias at a shared cache, so a booking in one
+# process invalidates the heatmap in all of them.
+APPOINTMENT_AVAILABILITY_CACHE = 'default'
+APPOINTMENT_AVAILABILITY_TIMEOUT = 300  # seconds
+
+# Rate limits of the booking, cancellation and availability views
+# (appointment.throttling), per rule and scope as "<requests>/<s|m|h>".
+# Empty: nothing is limited. See settings_production.py for an example.
+APPOINTMENT_RATE_LIMITS = {}
+APPOINTMENT_RATE_LIMIT_CACHE = 'default'
+
+# Load shedding (appointment.middleware.ConcurrencyLimitMiddleware): requests
+# running at once per process before the next ones get a 503. None: off.
+APPOINTMENT_MAX_CONCURRENT_REQUESTS = None
+APPOINTMENT_SHED_RETRY_AFTER = 1  # seconds
+
+# Booking writes (appointment.booking_queue): 'direct' books in the request
+# thread; 'queue' hands bookings to a writer thread that commits them in
+# batches (group commit), for bursts against SQLite's single writer.
+APPOINTMENT_BOOKING_MODE = 'direct'
+APPOINTMENT_BOOKING_BATCH = 50           # bookings per transaction at most
+APPOINTMENT_BOOKING_BATCH_WAIT_MS = 2    # how long the writer waits to fill a batch
+APPOINTMENT_BOOKING_TIMEOUT = 30         # seconds a request waits for its booking to start (and again to commit)
@@ -0,0 +1,84 @@
+"""
+Production database profile, layered on settings.py.
+
+    DJANGO_SETTINGS_MODULE=calendarsys.settings_production
+
+- SQLite in WAL mode with a busy timeout: readers no longer block the
+  writer, and concurrent bookings wait for the write lock instead of
+  failing with "database is locked". Transactions start IMMEDIATE, so two
+  bookings cannot both read and then fail to upgrade to a write lock.
+- Persistent connections (CONN_MAX_AGE) instead of a connect per request.
+- A 'replica' alias for reads, routed by appointment.routers.PrimaryReplicaRouter.
+  By default it is a read-only connection to the same file; point
+  APPOINTMENT_REPLICA_PATH at a copy kept up to date (e.g. by Litestream)
+  to move reads off the primary.
+- Rate limits on booking, cancellation and availability views, and a
+  per-worker cap on concurrent requests. The buckets use the default
+  cache; configure a shared CACHES backend so they hold across workers.
+"""
+import os
+from pathlib import Path
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, MIDDLEWARE
+
+
+PRIMARY_PATH = Path(os.environ.get('APPOINTMENT_DB_PATH', BASE_DIR / 'db.sqlite3'))
+REPLICA_PATH = Path(os.environ.get('APPOINTMENT_REPLICA_PATH', PRIMARY_PATH))
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': PRIMARY_PATH,
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,  # seconds sqlite3 waits for a lock
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        # Django opens SQLite names as URIs: mode=ro refuses any write
+        'NAME': f'file:{REPLICA_PATH.resolve()}?mode=ro',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['appointment.routers.PrimaryReplicaRouter']
+APPOINTMENT_DATABASE_REPLICAS = ['replica']
+APPOINTMENT_REPLICA_PIN_SECONDS = 5
+
+# Keep bots and impatient reloads from piling up on the SQLite write lock
+APPOINTMENT_RATE_LIMITS = {
+    'book': {'user': '10/m', 'ip': '30/m', 'business': '600/m'},
+    'cancel': {'user': '10/m', 'ip': '30/m'},
+    'availability': {'user': '120/m', 'ip': '300/m', 'business': '3000/m'},
+}
+# Per worker process; a little above the threads a worker serves
+APPOINTMENT_MAX_CONCURRENT_REQUESTS = 32
+
+# Applied by appointment.signals.configure_sqlite on every new connection.
+# journal_mode is persistent in the file, so the read-only replica
+# connection does not set it.
+APPOINTMENT_SQLITE_PRAGMAS = {
+    'default': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',  # durable across app crashes; WAL makes FULL unnecessary
+        'busy_timeout': 20000,
+        'cache_size': -20000,  # KiB
+        'temp_store': 'MEMORY',
+    },
+    'replica': {
+        'busy_timeout': 20000,
+        'cache_size': -20000,
+        'temp_store': 'MEMORY',
+    },
+}
+
+# Before the session middleware, so session reads follow the pin too
+MIDDLEWARE = [*MIDDLEWARE]
+MIDDLEWARE.insert(MIDDLEWARE.index('django.contrib.sessions.middleware.SessionMiddleware'),
+                  'appointment.middleware.PrimaryPinningMiddleware')
@@ -0,0 +1,31 @@
+"""
+Sharded scheduling data, layered on settings.py (see appointment.sharding).
+
+    DJANGO_SETTINGS_MODULE=calendarsys.settings_sharded
+
+Two local SQLite files: 'default' holds everything global plus the
+scheduling rows of the businesses mapped to it, 'shard1' the scheduling
+rows of the others. Create the schema on both:
+
+    python manage.py migrate
+    python manage.py migrate --database shard1
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    'shard1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-shard1.sqlite3',
+    },
+}
+
+DATABASE_ROUTERS = ['appointment.routers.ShardRouter']
+
+# Order defines each shard's id range: only ever append
+APPOINTMENT_SHARDS = ['default', 'shard1']
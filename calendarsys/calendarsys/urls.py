@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from appointment.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics, name='metrics'),  # Prometheus scrape endpoint
     path('appointment/', include("appointment.urls")),
     path('accounts/', include('django.contrib.auth.urls')),  # ✅ add this
 